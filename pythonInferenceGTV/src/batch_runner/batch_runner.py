@@ -0,0 +1,301 @@
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+try:  # For production
+    from MIMPython.SupportedIOTypes import XMimImage
+except ModuleNotFoundError:  # For Testing
+    from testing.mock_classes import XMimImage
+
+from client_backend.client_backend_interface import ClientBackendInterface
+from ext_functions.ext_functions import build_task_input, load_crop, load_task_output, result_cache, save_crop, \
+    RelayedLogger
+from inference_client.inference_client import InferenceClient
+
+"""
+Runs one model over a worklist of cases. Every case goes through the stages of STAGES. All MIM calls stay on the
+calling thread: it copies the volumes of each case out of MIM and loads the contours of finished cases, in between each
+other. Encoding, uploading and retrieving only handle the copied arrays and run on a thread each, so case N+1 is encoded
+while case N is uploaded and earlier cases are retrieved. Copying and loading do not overlap each other.
+"""
+
+STAGES = ("copy", "encode", "upload", "retrieve", "load")
+STATUS_POSTED = "posted"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+DEFAULT_MAX_IN_FLIGHT = 4  # Cases between the start of copying and the end of loading
+RELAY_INTERVAL_SEC = 0.5  # How often the calling thread relays the messages of the stage threads to the logger
+
+_END = object()  # Closes the queue between two stages
+
+
+class BatchCase:
+    """
+    One case of a worklist. images are posted in the order of the single-case entrypoints and the contours are loaded
+    onto images[0]. case_id identifies the case in the checkpoint, so it must be stable across runs
+    """
+    def __init__(self, case_id: str, images: List[XMimImage]) -> None:
+        self.case_id = case_id
+        self.images = images
+
+
+class Checkpoint:
+    """
+    Status (STATUS_POSTED, STATUS_DONE or STATUS_FAILED) and UID of every case of a batch run. The json file at path
+    is rewritten on every change, so an interrupted run resumes from it. Without a path it is kept in memory only
+    """
+    def __init__(self, path: str = None) -> None:
+        self.path = path
+        self.cases: Dict[str, Dict[str, str]] = {}
+        self.__lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as r:
+                self.cases = json.load(r)
+
+    def status(self, case_id: str) -> str:
+        return self.cases.get(case_id, {}).get("status")
+
+    def uid(self, case_id: str) -> str:
+        return self.cases.get(case_id, {}).get("uid")
+
+    def set(self, case_id: str, status: str, uid: str = None) -> None:
+        with self.__lock:
+            self.cases[case_id] = {"status": status, "uid": uid}
+            if self.path is None:
+                return
+
+            # Write to a temporary file first, so an interrupted run never leaves a half written checkpoint
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.cases, f, indent=2)
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+
+class BatchRunner:
+    """
+    Posts every case of a worklist to model_human_readable_id and loads the output onto it. The options are those of
+    the single-case entrypoints. At most max_in_flight cases are held between copying and loading, which bounds memory.
+    The stage threads log through a RelayedLogger, whose messages the calling thread passes on to logger.
+    Progress is kept in the Checkpoint at checkpoint_path: cases which are done are skipped, and cases which were posted
+    are retrieved without posting them again. A case which fails in one stage is marked as failed and retried on the
+    next run, unless its task only timed out, then its output is retrieved again.
+    The seconds spent in each of STAGES, summed over all cases, are kept in timings
+    """
+    def __init__(self,
+                 logger,
+                 client_backend: ClientBackendInterface,
+                 model_human_readable_id: str,
+                 export_dicom_info: int = 0,
+                 export_contours: int = 0,
+                 contour_names: str = "",
+                 compression: str = "auto",
+                 crop: str = "none",
+                 dicom_tags: str = "",
+                 polling_interval_sec: int = 5,
+                 timeout_sec: int = 500,
+                 wait_mode: str = "auto",
+                 upload_mode: str = "chunked",
+                 checkpoint_path: str = None,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> None:
+        self.logger = logger
+        self.client_backend = client_backend
+        self.model_human_readable_id = model_human_readable_id
+        self.export_dicom_info = export_dicom_info
+        self.export_contours = export_contours
+        self.contour_names = contour_names
+        self.compression = compression
+        self.crop = crop
+        self.dicom_tags = dicom_tags
+        self.__worker_logger = RelayedLogger()
+        self.inference_client = InferenceClient(client_backend=client_backend,
+                                                polling_interval_sec=polling_interval_sec,
+                                                timeout_sec=timeout_sec,
+                                                logger=self.__worker_logger,
+                                                wait_mode=wait_mode,
+                                                upload_mode=upload_mode,
+                                                result_cache=result_cache())
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.max_in_flight = max_in_flight
+
+        self.timings: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}  # Cases which went through each stage
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.wall_sec = 0.0
+
+        self.__lock = threading.Lock()
+        self.__in_flight = None
+
+    def __fail(self, case: BatchCase, stage: str, e: Exception, uid: str = None) -> None:
+        self.__worker_logger.error(f"{case.case_id}: {stage} failed: {e!r}")
+        status = STATUS_POSTED if isinstance(e, TimeoutError) and uid is not None else STATUS_FAILED
+        self.checkpoint.set(case.case_id, status, uid)
+        with self.__lock:
+            self.failed += 1
+        self.__in_flight.release()
+
+    def __run_stage(self, stage: str, case: BatchCase, work, *args, uid: str = None):
+        t0 = time.perf_counter()
+        try:
+            return work(case, *args)
+        except Exception as e:
+            self.__fail(case, stage, e, uid)
+            return None
+        finally:
+            with self.__lock:
+                self.timings[stage] += time.perf_counter() - t0
+                self.counts[stage] += 1
+
+    def __copy(self, case: BatchCase):
+        # On the calling thread, as it reads the images and contours from MIM
+        task_input, _ = build_task_input(logger=self.logger,
+                                         images=case.images,
+                                         model_human_readable_id=self.model_human_readable_id,
+                                         export_dicom_info=self.export_dicom_info,
+                                         export_contours=self.export_contours,
+                                         contour_names=self.contour_names,
+                                         inference_client=self.inference_client,
+                                         client_backend=self.client_backend,
+                                         compression=self.compression,
+                                         crop=self.crop,
+                                         dicom_tags=self.dicom_tags)
+        return case, task_input, task_input.fetch_volumes()
+
+    def __encode(self, case: BatchCase, task_input, jobs):
+        return case, task_input, task_input.get_input_zip(jobs)
+
+    def __upload(self, case: BatchCase, task_input, input_zip):
+        try:
+            uid = self.inference_client.post_input_zip(input_zip, self.model_human_readable_id)
+        finally:
+            input_zip.close()
+        save_crop(uid, task_input.crop_box)
+        self.checkpoint.set(case.case_id, STATUS_POSTED, uid)
+        self.__worker_logger.info(f"{case.case_id}: posted as {uid}")
+        return case, uid
+
+    def __retrieve(self, case: BatchCase, uid: str):
+        return case, uid, self.inference_client.get_task(uid, crop=load_crop(uid))
+
+    def __load(self, case: BatchCase, uid: str, task_output):
+        load_task_output(logger=self.logger, task_output=task_output, reference_image=case.images[0])
+        self.checkpoint.set(case.case_id, STATUS_DONE, uid)
+        with self.__lock:
+            self.done += 1
+        self.__in_flight.release()
+
+    def __copy_next(self, cases: Iterator[BatchCase], copied: queue.Queue, posted: queue.Queue) -> bool:
+        # Starts the next case to work on with the in-flight slot acquired for it. Returns False once cases are exhausted
+        for case in cases:
+            status, uid = self.checkpoint.status(case.case_id), self.checkpoint.uid(case.case_id)
+            if status == STATUS_DONE:
+                self.skipped += 1
+                continue
+
+            if status == STATUS_POSTED and uid is not None:
+                self.logger.info(f"{case.case_id}: resuming {uid}")
+                posted.put((case, uid))
+                return True
+
+            item = self.__run_stage("copy", case, self.__copy)
+            if item is not None:
+                copied.put(item)
+            return True
+
+        self.__in_flight.release()
+        return False
+
+    def __encode_all(self, copied: queue.Queue, encoded: queue.Queue) -> None:
+        for case, task_input, jobs in iter(copied.get, _END):
+            item = self.__run_stage("encode", case, self.__encode, task_input, jobs)
+            if item is not None:
+                encoded.put(item)
+        encoded.put(_END)
+
+    def __upload_all(self, encoded: queue.Queue, posted: queue.Queue) -> None:
+        for case, task_input, input_zip in iter(encoded.get, _END):
+            item = self.__run_stage("upload", case, self.__upload, task_input, input_zip)
+            if item is not None:
+                posted.put(item)
+        posted.put(_END)
+
+    def __retrieve_all(self, posted: queue.Queue, retrieved: queue.Queue) -> None:
+        for case, uid in iter(posted.get, _END):
+            item = self.__run_stage("retrieve", case, self.__retrieve, uid, uid=uid)
+            if item is not None:
+                retrieved.put(item)
+        retrieved.put(_END)
+
+    def run(self, cases: Iterable[BatchCase]) -> Dict[str, Dict[str, str]]:
+        """
+        Runs the worklist cases, which may be a generator, and logs the summary. Returns the checkpoint of all cases
+        """
+        self.timings = {stage: 0.0 for stage in STAGES}
+        self.counts = {stage: 0 for stage in STAGES}
+        self.done, self.failed, self.skipped = 0, 0, 0
+        self.__in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        t_start = time.perf_counter()
+
+        # The calling thread must never block on a put, as it loads the cases which free the in-flight slots. The queues
+        # it puts to are unbounded, which max_in_flight bounds. The others hold one item, so a stage works at most one
+        # case ahead of the next
+        copied, encoded, posted, retrieved = queue.Queue(), queue.Queue(maxsize=1), queue.Queue(), queue.Queue(maxsize=1)
+        threads = [threading.Thread(target=self.__encode_all, args=(copied, encoded), name="BatchRunner-encode"),
+                   threading.Thread(target=self.__upload_all, args=(encoded, posted), name="BatchRunner-upload"),
+                   threading.Thread(target=self.__retrieve_all, args=(posted, retrieved), name="BatchRunner-retrieve")]
+        for thread in threads:
+            thread.daemon = True  # An interrupted run is resumed from the checkpoint
+            thread.start()
+
+        # Volumes are copied and contours are set on the calling thread, like in the single-case entrypoints. Finished
+        # cases are loaded first, then the next case is copied while there is a free in-flight slot
+        pending, feeding = iter(cases), True
+        while True:
+            self.__worker_logger.relay(self.logger)
+            try:
+                item = retrieved.get_nowait()
+            except queue.Empty:
+                if feeding and self.__in_flight.acquire(blocking=False):
+                    feeding = self.__copy_next(pending, copied, posted)
+                    if not feeding:
+                        copied.put(_END)
+                    continue
+                try:
+                    item = retrieved.get(timeout=RELAY_INTERVAL_SEC)
+                except queue.Empty:
+                    continue
+            if item is _END:
+                break
+            case, uid, task_output = item
+            self.__run_stage("load", case, self.__load, uid, task_output, uid=uid)
+
+        for thread in threads:
+            thread.join()
+        self.__worker_logger.relay(self.logger)
+        self.wall_sec = time.perf_counter() - t_start
+        self.logger.info(self.summary())
+        return dict(self.checkpoint.cases)
+
+    def cases_per_hour(self) -> float:
+        return 3600 * self.done / self.wall_sec if self.wall_sec > 0 else 0.0
+
+    def summary(self) -> str:
+        stages = ", ".join("{}: {:.2f}".format(stage, self.timings[stage] / max(self.counts[stage], 1))
+                           for stage in STAGES)
+        return ("Batch of {} cases: {} done, {} failed, {} skipped in {:.1f} sec ({:.1f} cases/hour). "
+                "Mean sec per case: {}").format(self.done + self.failed + self.skipped, self.done, self.failed,
+                                                self.skipped, self.wall_sec, self.cases_per_hour(), stages)
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from batch_runner.batch_runner import BatchCase, BatchRunner, Checkpoint, STATUS_DONE, STATUS_FAILED, \
+    STATUS_POSTED
+from ext_functions.test_ext_functions import use_temporary_cache_dirs
+from inference_client.test_inference_client import MockClientBackend
+from testing.mock_classes import XMimImage
+
+
+class SlowMockClientBackend(MockClientBackend):
+    """
+    Takes delay_sec for every post and every get of a task output, like a server some distance away
+    """
+    def __init__(self, base_url, delay_sec: float):
+        super().__init__(base_url)
+        self.delay_sec = delay_sec
+
+    def get(self, endpoint: str, stream: bool = False, headers=None):
+        time.sleep(self.delay_sec)
+        return super().get(endpoint, stream, headers)
+
+    def post(self, endpoint, params=None, files=None, data=None, headers=None):
+        time.sleep(self.delay_sec)
+        return super().post(endpoint, params, files, data, headers)
+
+
+def contour_names(img: XMimImage):
+    return [c.getInfo().getName() for c in img.getContours()]
+
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_path = os.path.join(self.tmp_dir.name, "checkpoint.json")
+        self.client_backend = MockClientBackend("https://test-hest.org")
+        use_temporary_cache_dirs(self)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def runner(self, client_backend=None, **kwargs) -> BatchRunner:
+        return BatchRunner(logger=logging.getLogger(__name__),
+                           client_backend=client_backend or self.client_backend,
+                           model_human_readable_id="model_human_readable_id",
+                           polling_interval_sec=1,
+                           timeout_sec=2,
+                           checkpoint_path=self.checkpoint_path,
+                           **kwargs)
+
+    def test_run(self):
+        cases = [BatchCase("case_{}".format(i), [XMimImage(), XMimImage()]) for i in range(3)]
+        runner = self.runner()
+        result = runner.run(cases)
+
+        self.assertEqual(runner.done, 3)
+        self.assertEqual(len(self.client_backend.tasks), 3)
+        for case in cases:
+            self.assertEqual(result[case.case_id]["status"], STATUS_DONE)
+            self.assertIn("GTVt", contour_names(case.images[0]))
+        with open(self.checkpoint_path) as r:
+            self.assertEqual(json.load(r), result)
+        self.assertEqual(runner.counts, {"copy": 3, "encode": 3, "upload": 3, "retrieve": 3, "load": 3})
+        self.assertIn("3 done, 0 failed, 0 skipped", runner.summary())
+
+    def test_mim_is_only_called_from_the_calling_thread(self):
+        mim_threads = set()
+
+        def record(method):
+            def recorded(*args, **kwargs):
+                mim_threads.add(threading.current_thread().name)
+                return method(*args, **kwargs)
+            return recorded
+
+        patches = [mock.patch.object(XMimImage, name, record(getattr(XMimImage, name)))
+                   for name in ["getRawData", "getContours", "createNewContour", "getSpace"]]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        cases = [BatchCase("case_{}".format(i), [XMimImage(), XMimImage()]) for i in range(3)]
+        with self.assertLogs(__name__, level="INFO") as logs:
+            runner = self.runner(export_contours=1, crop="body:0")
+            runner.run(cases)
+
+        self.assertEqual(runner.done, 3)
+        self.assertEqual(mim_threads, {threading.current_thread().name})
+        # Messages of the stage threads reach the logger on the calling thread too
+        self.assertTrue(any("posted as" in line for line in logs.output))
+        self.assertEqual({r.threadName for r in logs.records}, {threading.current_thread().name})
+
+    def test_resume_from_checkpoint(self):
+        done = BatchCase("done", [XMimImage()])
+        posted = BatchCase("posted", [XMimImage()])
+        new = BatchCase("new", [XMimImage()])
+
+        # An earlier run was interrupted after posting "posted"
+        runner = self.runner()
+        runner.run([done])
+        res = self.client_backend.post(endpoint="/api/tasks/",
+                                       params={"model_human_readable_id": "model_human_readable_id"},
+                                       files={"zip_file": tempfile.TemporaryFile()})
+        uid = json.loads(res.content)
+        Checkpoint(self.checkpoint_path).set("posted", STATUS_POSTED, uid)
+        n_tasks = len(self.client_backend.tasks)
+
+        runner = self.runner()
+        result = runner.run([done, posted, new])
+
+        self.assertEqual((runner.done, runner.skipped, runner.failed), (2, 1, 0))
+        self.assertEqual(len(self.client_backend.tasks), n_tasks + 1)  # Only "new" is posted
+        self.assertEqual(result["posted"], {"status": STATUS_DONE, "uid": uid})
+        self.assertIn("GTVt", contour_names(posted.images[0]))
+        self.assertIn("GTVt", contour_names(new.images[0]))
+
+    def test_failed_case_does_not_end_the_batch(self):
+        cases = [BatchCase("ok_0", [XMimImage()]), BatchCase("broken", [None]), BatchCase("ok_1", [XMimImage()])]
+        runner = self.runner()
+        result = runner.run(cases)
+
+        self.assertEqual((runner.done, runner.failed), (2, 1))
+        self.assertEqual(result["broken"]["status"], STATUS_FAILED)
+        self.assertEqual(result["ok_1"]["status"], STATUS_DONE)
+
+    def test_timed_out_case_is_retrieved_again(self):
+        Checkpoint(self.checkpoint_path).set("case", STATUS_POSTED, "does_not_exist")
+
+        runner = self.runner()
+        result = runner.run([BatchCase("case", [XMimImage()])])
+
+        self.assertEqual(runner.failed, 1)
+        self.assertEqual(result["case"], {"status": STATUS_POSTED, "uid": "does_not_exist"})
+
+    def test_stages_overlap(self):
+        # Uploading and retrieving take 0.3 sec each per case. Run one after another, 6 cases take at least 3.6 sec
+        client_backend = SlowMockClientBackend("https://test-hest.org", delay_sec=0.3)
+        runner = self.runner(client_backend=client_backend)
+        runner.run([BatchCase("case_{}".format(i), [XMimImage()]) for i in range(6)])
+
+        self.assertEqual(runner.done, 6)
+        self.assertLess(runner.wall_sec, sum(runner.timings.values()) - 1)
+        self.assertGreater(runner.cases_per_hour(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
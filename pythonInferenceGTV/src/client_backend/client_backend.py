@@ -1,28 +1,176 @@
 import os
-from typing import Dict
+import ssl
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
 
 import requests
-from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .client_backend_interface import ClientBackendInterface
 
+MIN_THROUGHPUT_SAMPLE_BYTES = 256 * 1024  # Smaller uploads are dominated by latency and say little about bandwidth
+THROUGHPUT_SMOOTHING = 0.5  # Weight of the newest sample in the moving average
+
+DEFAULT_CONNECT_TIMEOUT_SEC = 10.0
+DEFAULT_READ_TIMEOUT_SEC = 120.0  # Max silence on an open connection, not the duration of a transfer
+# Only failed connects are retried. Nothing has been sent then, so posts are safe too. Read errors are raised as they are
+DEFAULT_CONNECT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_SEC = 0.5  # Sleeps 0.5, 1, 2 ... sec between connect attempts
+POOL_MAXSIZE = 8  # Connections kept alive per server, enough for posting to several models at once
+
+# Recent upload throughput in bytes/sec per base_url. Kept for the whole process, so later posts can use it.
+_upload_throughput: Dict[str, float] = {}
+_upload_throughput_lock = threading.Lock()
+
+# Pooled sessions and SSL contexts are kept for the whole process, so connections are reused across polls,
+# instances and runs of the extension in the same MIM session
+_sessions: Dict[Tuple, requests.Session] = {}
+_ssl_contexts: Dict[str, ssl.SSLContext] = {}
+_sessions_lock = threading.Lock()
+
+
+def _remaining_size(fileobj) -> int:
+    if isinstance(fileobj, (bytes, bytearray)):
+        return len(fileobj)
+    try:
+        pos = fileobj.tell()
+        end = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(pos)
+        return end - pos
+    except (AttributeError, OSError):
+        return 0
+
+
+def _ssl_context(ca_file: str) -> ssl.SSLContext:
+    # Must be called with _sessions_lock held
+    if ca_file not in _ssl_contexts:
+        _ssl_contexts[ca_file] = ssl.create_default_context(cafile=ca_file)
+    return _ssl_contexts[ca_file]
+
+
+class _SSLContextAdapter(HTTPAdapter):
+    """
+    HTTPAdapter verifying servers with a prepared SSLContext, so the CA file is read once per process instead of
+    once per connection
+    """
+    def __init__(self, ssl_context: ssl.SSLContext = None, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs["ssl_context"] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        # Newer versions of requests pick the pool by the CA file. Keep the context of this adapter instead
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        if self.ssl_context is not None and verify is not False:
+            pool_kwargs.pop("ca_certs", None)
+            pool_kwargs.pop("ca_cert_dir", None)
+            pool_kwargs["ssl_context"] = self.ssl_context
+        return host_params, pool_kwargs
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if self.ssl_context is not None and verify is not False and url.lower().startswith("https"):
+            conn.ca_certs = None  # Already loaded into the context
+            conn.ca_cert_dir = None
+
+
+def session_for(base_url: str,
+                verify,
+                connect_retries: int = DEFAULT_CONNECT_RETRIES,
+                retry_backoff_sec: float = DEFAULT_RETRY_BACKOFF_SEC) -> requests.Session:
+    """
+    The process wide session for the server of base_url. Its connections are kept alive and reused by every
+    ClientBackend of that server
+    """
+    parts = urlsplit(base_url)
+    key = (parts.scheme.lower(), parts.netloc.lower(), verify, connect_retries, retry_backoff_sec)
+    with _sessions_lock:
+        if key not in _sessions:
+            ssl_context = _ssl_context(verify) if isinstance(verify, str) and os.path.isfile(verify) else None
+            retries = Retry(total=None, connect=connect_retries, read=False, status=0, redirect=None,
+                            backoff_factor=retry_backoff_sec, raise_on_status=False)
+            session = requests.Session()
+            session.mount("https://", _SSLContextAdapter(ssl_context=ssl_context, max_retries=retries,
+                                                         pool_maxsize=POOL_MAXSIZE))
+            session.mount("http://", HTTPAdapter(max_retries=retries, pool_maxsize=POOL_MAXSIZE))
+            _sessions[key] = session
+        return _sessions[key]
+
 
 class ClientBackend(ClientBackendInterface):
-    def __init__(self, base_url: str, verify=None):
+    def __init__(self,
+                 base_url: str,
+                 verify=None,
+                 connect_timeout_sec: float = DEFAULT_CONNECT_TIMEOUT_SEC,
+                 read_timeout_sec: float = DEFAULT_READ_TIMEOUT_SEC,
+                 connect_retries: int = DEFAULT_CONNECT_RETRIES,
+                 retry_backoff_sec: float = DEFAULT_RETRY_BACKOFF_SEC):
         self.base_url = base_url
         if not verify:
             self.verify = self.__get_cert_file_path()
         else:
             self.verify = verify
+        self.timeout = (connect_timeout_sec, read_timeout_sec)
+        self.session = session_for(base_url, self.verify, connect_retries, retry_backoff_sec)
+
+    def get(self, endpoint: str, stream: bool = False, headers: Dict = None):
+        return self.session.get(url=urljoin(self.base_url, endpoint),
+                                stream=stream,
+                                headers=headers,
+                                verify=self.verify,
+                                timeout=self.timeout)
+
+    def post(self, endpoint: str, params: Dict, files: Dict = None, data: bytes = None, headers: Dict = None):
+        upload_bytes = sum(_remaining_size(f) for f in files.values()) if files else 0
+        if data is not None:
+            upload_bytes += _remaining_size(data)
+        t0 = time.perf_counter()
+        res = self.session.post(url=urljoin(self.base_url, endpoint),
+                                params=params,
+                                files=files,
+                                data=data,
+                                headers=headers,
+                                verify=self.verify,
+                                timeout=self.timeout)
+        if res.ok:
+            self.__record_upload(upload_bytes, time.perf_counter() - t0)
+        return res
+
+    def preconnect(self) -> threading.Thread:
+        """
+        Opens a connection to the server in the background, so the TCP and TLS handshakes are done while the payload
+        is still being encoded. The connection is kept alive in the pool for the next request. Errors are ignored
+        """
+        def connect():
+            try:
+                self.session.head(url=self.base_url, verify=self.verify, timeout=self.timeout).close()
+            except requests.exceptions.RequestException:
+                pass
+
+        thread = threading.Thread(target=connect, daemon=True)
+        thread.start()
+        return thread
 
-    def get(self, endpoint: str):
-        return requests.get(url=urljoin(self.base_url, endpoint),
-                            verify=self.verify)
+    def get_upload_throughput(self) -> Optional[float]:
+        with _upload_throughput_lock:
+            return _upload_throughput.get(self.base_url)
 
-    def post(self, endpoint: str, params: Dict, files: Dict):
-        return requests.post(url=urljoin(self.base_url, endpoint),
-                             params=params,
-                             files=files,
-                             verify=self.verify)
+    def __record_upload(self, upload_bytes: int, seconds: float):
+        if upload_bytes < MIN_THROUGHPUT_SAMPLE_BYTES or seconds <= 0:
+            return
+        sample = upload_bytes / seconds
+        with _upload_throughput_lock:
+            previous = _upload_throughput.get(self.base_url)
+            if previous is None:
+                _upload_throughput[self.base_url] = sample
+            else:
+                _upload_throughput[self.base_url] = THROUGHPUT_SMOOTHING * sample + (1 - THROUGHPUT_SMOOTHING) * previous
 
     def __get_cert_file_path(self):
         absolutepath = os.path.abspath(__file__)
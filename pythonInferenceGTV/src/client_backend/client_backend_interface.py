@@ -1,13 +1,30 @@
 from abc import abstractmethod
-from typing import Dict
+from typing import Dict, Optional
 
 
 class ClientBackendInterface:
     @abstractmethod
-    def get(self, endpoint: str):
+    def get(self, endpoint: str, stream: bool = False, headers: Dict = None):
+        """
+        With stream=True the body is not read until iterated (Response.iter_content), e.g. to download large results
+        """
         pass
     
     @abstractmethod
-    def post(self, endpoint: str, params: Dict, files: Dict):
+    def post(self, endpoint: str, params: Dict, files: Dict = None, data: bytes = None, headers: Dict = None):
+        """
+        Posts files as multipart/form-data, or data as the raw body
+        """
         pass
-    
+
+    def preconnect(self):
+        """
+        Optionally starts connecting to the server in the background, so the connection is ready for the next request
+        """
+        return None
+
+    def get_upload_throughput(self) -> Optional[float]:
+        """
+        Recent upload throughput to the server in bytes/sec, or None if nothing has been measured yet
+        """
+        return None
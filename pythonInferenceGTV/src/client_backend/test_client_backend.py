@@ -1,8 +1,14 @@
+import io
 import unittest
 import os
 import sys
+from unittest import mock
+
+import requests
+
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
-from client_backend.client_backend import ClientBackend
+from client_backend.client_backend import ClientBackend, session_for
+from testing.stand_in_server import StandInInferenceServer
 
 class TestClientBackend(unittest.TestCase):
     def setUp(self) -> None:
@@ -24,5 +30,64 @@ class TestClientBackend(unittest.TestCase):
         res = self.cb.post("/post-does-not-exist", {}, {})
         self.assertEqual(res.status_code, 404)
 
+
+class TestClientBackendThroughput(unittest.TestCase):
+    def test_upload_throughput_recorded(self):
+        cb = ClientBackend("https://throughput.test/", verify=True)
+        self.assertIsNone(cb.get_upload_throughput())
+
+        ok = requests.Response()
+        ok.status_code = 200
+        with mock.patch.object(sys.modules[ClientBackend.__module__].requests.Session, "post", return_value=ok):
+            # Too small to say anything about bandwidth
+            cb.post("/api/tasks/", {}, {"zip_file": io.BytesIO(b"0" * 1024)})
+            self.assertIsNone(cb.get_upload_throughput())
+
+            cb.post("/api/tasks/", {}, {"zip_file": io.BytesIO(b"0" * 1024 * 1024)})
+            self.assertGreater(cb.get_upload_throughput(), 0)
+
+        # Shared between instances for the same server
+        self.assertIsNotNone(ClientBackend("https://throughput.test/", verify=True).get_upload_throughput())
+        self.assertIsNone(ClientBackend("https://other.test/", verify=True).get_upload_throughput())
+
+
+
+class TestClientBackendPooling(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = StandInInferenceServer().start()
+        self.server.add_task("uid", b"output")
+
+    def tearDown(self) -> None:
+        self.server.stop()
+
+    def test_connections_are_reused(self):
+        cb = ClientBackend(self.server.base_url)
+        for _ in range(3):
+            res = cb.get("/api/tasks/uid")
+            self.assertEqual(res.content, b"output")
+        self.assertEqual(ClientBackend(self.server.base_url).get("/api/tasks/uid").status_code, 200)
+
+        # Every request went over the same keep-alive connection
+        self.assertEqual(len(set(self.server.client_ports)), 1)
+        self.assertIs(ClientBackend(self.server.base_url).session, cb.session)
+
+    def test_preconnect(self):
+        cb = ClientBackend(self.server.base_url)
+        cb.preconnect().join(timeout=5)
+        cb.get("/api/tasks/uid")
+        self.assertEqual([m for m, _, _ in self.server.requests], ["HEAD", "GET"])
+        self.assertEqual(len(set(self.server.client_ports)), 1)
+
+    def test_read_timeout(self):
+        self.server.stall_sec = 1
+        cb = ClientBackend(self.server.base_url, read_timeout_sec=0.2)
+        self.assertRaises(requests.exceptions.ReadTimeout, cb.get, "/api/tasks/uid")
+
+    def test_connect_retries(self):
+        session = session_for("https://retries.test/", verify=True, connect_retries=2, retry_backoff_sec=0.1)
+        retries = session.get_adapter("https://retries.test/api/tasks/").max_retries
+        self.assertEqual((retries.connect, retries.read, retries.backoff_factor), (2, False, 0.1))
+
+
 if __name__ == '__main__':
     unittest.main()
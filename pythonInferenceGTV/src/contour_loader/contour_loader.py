@@ -1,4 +1,8 @@
-from typing import Dict
+import collections
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Mapping, Tuple
 
 import numpy as np
 import os
@@ -11,35 +15,169 @@ try:
 except ModuleNotFoundError:
     from testing.mock_classes import XMimImage, XMimContour
 
+DEFAULT_LOOKAHEAD = 1  # Masks built ahead of the one being set to MIM
+TIMING_STAGES = ["build", "wait", "compare", "set", "redraw", "total"]
+
+
+def mask_fingerprint(arr: np.ndarray) -> Tuple[Tuple[int, ...], int]:
+    """
+    Cheap summary of a mask: its shape and number of voxels set. Masks with different fingerprints differ
+    """
+    return tuple(arr.shape), int(np.count_nonzero(arr))
+
+
+def mask_digest(mask: np.ndarray) -> bytes:
+    """
+    Content hash of a bool mask incl. its shape. Kept per contour when it is set, so a later load can tell whether the
+    incoming mask is the one written last without copying the contour out of MIM
+    """
+    h = hashlib.blake2b(repr(tuple(mask.shape)).encode(), digest_size=16)
+    h.update(memoryview(np.ascontiguousarray(mask).reshape(-1).view(np.uint8)))
+    return h.digest()
+
+
+def is_unchanged(mask: np.ndarray, existing: np.ndarray) -> bool:
+    """
+    True if the contour data existing (any dtype, nonzero is inside) has exactly the voxels of mask.
+    The fingerprints are compared first, so most changed contours are rejected without a voxelwise comparison
+    """
+    if mask_fingerprint(mask) != mask_fingerprint(existing):
+        return False
+    if existing.dtype != bool:
+        existing = existing != 0
+    return np.array_equal(mask, existing)
+
 
 class ContourLoader:
-    def __init__(self, reference_image: XMimImage, logger):
+    """
+    Sets masks as contours on a reference image.
+    Masks are built on a worker thread up to lookahead contours ahead, while the current one is set to MIM on the
+    calling thread. All MIM calls stay on the calling thread. With defer_redraw, every touched contour is redrawn once
+    after all are set, instead of after each one. With skip_unchanged, existing contours which already hold exactly
+    the voxels of their mask are neither set nor redrawn. The digest of every mask set or found unchanged is kept in
+    fingerprints (label -> mask_digest), and an existing contour with a fingerprint is compared by digest only. Only
+    contours without one are copied out of MIM and compared voxelwise. Pass the fingerprints of an earlier loader to
+    share them, which trusts that the contours were not edited in MIM since.
+    The seconds spent in each stage of the last call are kept in timings:
+    - build: building masks on the worker
+    - wait: the calling thread waiting for a mask that was not built yet
+    - compare: comparing masks to existing contours
+    - set: setFromNPArray
+    - redraw: redrawCompletely
+    - total: the whole call
+    """
+    def __init__(self,
+                 reference_image: XMimImage,
+                 logger,
+                 lookahead: int = DEFAULT_LOOKAHEAD,
+                 defer_redraw: bool = False,
+                 skip_unchanged: bool = False,
+                 fingerprints: Dict[str, bytes] = None):
         self.ref_image = reference_image
         self.logger = logger
+        self.lookahead = max(0, lookahead)
+        self.defer_redraw = defer_redraw
+        self.skip_unchanged = skip_unchanged
+        self.fingerprints = fingerprints if fingerprints is not None else {}  # Label -> digest of the mask in MIM
+        self.timings: Dict[str, float] = {}
+        self.skipped: List[str] = []  # Labels of the last call whose contours were already up to date
 
-    def __get_or_create_contour(self, label: str) -> XMimContour:
+    def __get_or_create_contour(self, contours: Dict[str, XMimContour], label: str) -> XMimContour:
         """
-        Checks through existing contours and find matches with label. If it does not exist, a new contour is created.
+        Looks up label in the existing contours by name. If it does not exist, a new contour is created.
         """
+        if label not in contours:
+            contours[label] = self.ref_image.createNewContour(label)
+        return contours[label]
+
+    def __existing_contours(self) -> Dict[str, XMimContour]:
+        contours = {}
         for contour in self.ref_image.getContours():
-            if contour.getInfo().getName() == label:
-                return contour
-        else:
-            contour = self.ref_image.createNewContour(label)
-            return contour
+            contours.setdefault(contour.getInfo().getName(), contour)  # The first match wins, as in a linear search
+        return contours
+
+    @staticmethod
+    def __build(label_array_dict: Mapping[str, np.ndarray], label: str) -> Tuple[np.ndarray, float]:
+        t0 = time.perf_counter()
+        array = label_array_dict[label]
+        return array, time.perf_counter() - t0
 
-    def set_contours_from_label_array_dict(self, label_array_dict: Dict[str, np.ndarray]):
+    def set_contours_from_label_array_dict(self, label_array_dict: Mapping[str, np.ndarray]):
         """
-        Sets all contours from a label_array_dict which is served by a TaskOutput
+        Sets all contours from a label_array_dict which is served by a TaskOutput.
+        Masks of a TaskOutput are built on access, so at most lookahead + 1 are held at a time
         """
-        for label, array in label_array_dict.items():
-            assert array.dtype == bool
+        self.timings = {stage: 0.0 for stage in TIMING_STAGES}
+        self.skipped = []
+        t_start = time.perf_counter()
+
+        contours = self.__existing_contours()
+        touched = collections.OrderedDict()  # Contours to redraw at the end if defer_redraw
+        labels = list(label_array_dict.keys())
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = collections.deque()
+            next_label = 0
+            for _ in labels:
+                while next_label < len(labels) and len(pending) <= self.lookahead:
+                    pending.append((labels[next_label], pool.submit(self.__build, label_array_dict, labels[next_label])))
+                    next_label += 1
+
+                label, future = pending.popleft()
+                t0 = time.perf_counter()
+                array, build_sec = future.result()
+                del future  # It holds the mask as well
+                self.timings["wait"] += time.perf_counter() - t0
+                self.timings["build"] += build_sec
+                assert array.dtype == bool
+
+                # Leave contours alone which already hold exactly this mask, e.g. when the same task is loaded again
+                digest = None
+                if self.skip_unchanged:
+                    t0 = time.perf_counter()
+                    digest = mask_digest(array)
+                    if label not in contours:
+                        unchanged = False
+                    elif label in self.fingerprints:
+                        unchanged = self.fingerprints[label] == digest
+                    else:
+                        unchanged = is_unchanged(array, contours[label].getData().copyToNPArray())
+                    self.timings["compare"] += time.perf_counter() - t0
+                    if unchanged:
+                        self.fingerprints[label] = digest
+                        self.skipped.append(label)
+                        del array
+                        continue
+
+                # Create or get contour
+                contour = self.__get_or_create_contour(contours, label)
+
+                # Set the actual contour from a bool array
+                t0 = time.perf_counter()
+                contour.getData().setFromNPArray(array)
+                self.timings["set"] += time.perf_counter() - t0
+                if digest is not None:
+                    self.fingerprints[label] = digest
+                else:
+                    self.fingerprints.pop(label, None)
+                self.logger.info(str(label))
+                self.logger.info(str(contour.getDims()))
+                del array  # Free the mask before the next one is built
+
+                if self.defer_redraw:
+                    touched[id(contour)] = contour
+                else:
+                    self.__redraw(contour)
+
+        for contour in touched.values():
+            self.__redraw(contour)
 
-            # Create or get contour
-            contour = self.__get_or_create_contour(label)
+        self.timings["total"] = time.perf_counter() - t_start
+        self.logger.info("Skipped {} of {} unchanged contours".format(len(self.skipped), len(labels)))
+        self.logger.info("Contour loading timings (sec): " +
+                         ", ".join("{}: {:.3f}".format(stage, self.timings[stage]) for stage in TIMING_STAGES))
 
-            # Set the actual contour from a bool array
-            contour.getData().setFromNPArray(array)
-            self.logger.info(str(label))
-            self.logger.info(str(contour.getDims()))
-            contour.redrawCompletely()
+    def __redraw(self, contour: XMimContour) -> None:
+        t0 = time.perf_counter()
+        contour.redrawCompletely()
+        self.timings["redraw"] += time.perf_counter() - t0
@@ -1,5 +1,8 @@
 
+import collections.abc
+import threading
 import unittest
+from unittest import mock
 
 import numpy as np
 import os
@@ -8,7 +11,27 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from testing.mock_classes import XMimImage, XMimSession
 from task_output.test_task_output import TestTaskOutput
-from contour_loader.contour_loader import ContourLoader
+from contour_loader.contour_loader import ContourLoader, TIMING_STAGES, is_unchanged
+
+
+class RecordingMaskMapping(collections.abc.Mapping):
+    """
+    Builds masks on access like TaskOutput does and records when each build starts
+    """
+    def __init__(self, labels, shape):
+        self.labels = labels
+        self.shape = shape
+        self.build_started = {label: threading.Event() for label in labels}
+
+    def __getitem__(self, label):
+        self.build_started[label].set()
+        return np.ones(self.shape, dtype=bool)
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
 
 class TestContourLoader(unittest.TestCase):
     def setUp(self) -> None:
@@ -82,6 +105,125 @@ class TestContourLoader(unittest.TestCase):
         for k, v in label_array_dict0.items():
             self.assertFalse(np.array_equal(v, label_array_dict1[k]))
 
+    def record_calls(self, labels, events):
+        for label in labels:
+            contour = self.reference_img.createNewContour(label)
+            contour.redrawCompletely = lambda label=label: events.append(("redraw", label))
+            set_from_np_array = contour.getData().setFromNPArray
+
+            def set_and_record(arr, label=label, set_from_np_array=set_from_np_array):
+                events.append(("set", label))
+                set_from_np_array(arr)
+            contour.getData().setFromNPArray = set_and_record
+
+    def test_next_mask_is_built_while_setting(self):
+        labels = ["GTVt", "GTVn", "Brain"]
+        label_array_dict = RecordingMaskMapping(labels, self.reference_img.createNewContour("shape").getDims())
+        overlapped = []
+        for i, label in enumerate(labels[:-1]):
+            contour = self.reference_img.createNewContour(label)
+            set_from_np_array = contour.getData().setFromNPArray
+
+            def set_and_wait(arr, next_label=labels[i + 1], set_from_np_array=set_from_np_array):
+                # The worker builds the next mask while MIM is busy with this one
+                overlapped.append(label_array_dict.build_started[next_label].wait(timeout=5))
+                set_from_np_array(arr)
+            contour.getData().setFromNPArray = set_and_wait
+
+        contour_loader = ContourLoader(self.reference_img, self.session.createLogger())
+        contour_loader.set_contours_from_label_array_dict(label_array_dict)
+        self.assertEqual(overlapped, [True, True])
+        self.assertEqual(set(contour_loader.timings), set(TIMING_STAGES))
+
+    def test_defer_redraw(self):
+        labels = ["GTVt", "GTVn", "Brain"]
+        shape = self.reference_img.createNewContour("shape").getDims()
+        for defer_redraw, lookahead in [(False, 0), (True, 0), (True, 2)]:
+            self.reference_img = XMimImage()
+            events = []
+            self.record_calls(labels, events)
+            contour_loader = ContourLoader(self.reference_img, self.session.createLogger(),
+                                           lookahead=lookahead, defer_redraw=defer_redraw)
+            contour_loader.set_contours_from_label_array_dict(RecordingMaskMapping(labels, shape))
+
+            if defer_redraw:
+                expected = [("set", label) for label in labels] + [("redraw", label) for label in labels]
+            else:
+                expected = [(event, label) for label in labels for event in ["set", "redraw"]]
+            self.assertEqual(events, expected)
+            self.assertEqual(len(self.reference_img.getContours()), len(labels))
+
+    def test_is_unchanged(self):
+        mask = np.zeros((2, 3, 4), dtype=bool)
+        mask[1, 1:3, 2] = True
+        self.assertTrue(is_unchanged(mask, mask.copy()))
+        self.assertTrue(is_unchanged(mask, mask.astype(np.uint8) * 255))
+        self.assertFalse(is_unchanged(mask, np.roll(mask, 1)))  # Same fingerprint, other voxels
+        self.assertFalse(is_unchanged(mask, mask[:, :, :2]))
+
+    def test_unchanged_contours_are_skipped(self):
+        labels = ["GTVt", "GTVn", "Brain"]
+        shape = self.reference_img.createNewContour("shape").getDims()
+        masks = {label: np.zeros(shape, dtype=bool) for label in labels}
+        for i, label in enumerate(labels):
+            masks[label][i, :10, :10] = True
+
+        events = []
+        self.record_calls(labels, events)
+        contour_loader = ContourLoader(self.reference_img, self.session.createLogger(), skip_unchanged=True)
+        contour_loader.set_contours_from_label_array_dict(masks)
+        self.assertEqual(contour_loader.skipped, [])
+        self.assertEqual(len(events), 6)
+
+        # Loading the same masks again touches nothing
+        del events[:]
+        contour_loader.set_contours_from_label_array_dict(masks)
+        self.assertEqual(contour_loader.skipped, labels)
+        self.assertEqual(events, [])
+
+        # Only the changed contour is set and redrawn
+        masks["GTVn"] = masks["GTVn"].copy()
+        masks["GTVn"][20, 0, 0] = True
+        contour_loader.set_contours_from_label_array_dict(masks)
+        self.assertEqual(contour_loader.skipped, ["GTVt", "Brain"])
+        self.assertEqual(events, [("set", "GTVn"), ("redraw", "GTVn")])
+
+        # Unless skipping is turned off, which is the default
+        del events[:]
+        contour_loader = ContourLoader(self.reference_img, self.session.createLogger())
+        contour_loader.set_contours_from_label_array_dict(masks)
+        self.assertEqual(len(events), 6)
+
+    def test_unchanged_contours_are_compared_by_fingerprint(self):
+        labels = ["GTVt", "GTVn", "Brain"]
+        shape = self.reference_img.createNewContour("shape").getDims()
+        masks = {label: np.zeros(shape, dtype=bool) for label in labels}
+        for i, label in enumerate(labels):
+            masks[label][i, :10, :10] = True
+        for label in labels:
+            self.reference_img.createNewContour(label)
+
+        module = sys.modules[ContourLoader.__module__]
+        with mock.patch.object(module, "is_unchanged", wraps=module.is_unchanged) as compare:
+            # Contours without a fingerprint are copied out of MIM and compared voxelwise once
+            contour_loader = ContourLoader(self.reference_img, self.session.createLogger(), skip_unchanged=True)
+            contour_loader.set_contours_from_label_array_dict(masks)
+            self.assertEqual(compare.call_count, len(labels))
+            self.assertEqual(set(contour_loader.fingerprints), set(labels))
+
+            # Afterwards the digest of the mask written last decides, without a copy
+            compare.reset_mock()
+            contour_loader.set_contours_from_label_array_dict(masks)
+            shared = ContourLoader(self.reference_img, self.session.createLogger(), skip_unchanged=True,
+                                   fingerprints=contour_loader.fingerprints)
+            masks["GTVn"] = masks["GTVn"].copy()
+            masks["GTVn"][20, 0, 0] = True
+            shared.set_contours_from_label_array_dict(masks)
+            self.assertEqual(compare.call_count, 0)
+
+        self.assertEqual(contour_loader.skipped, labels)
+        self.assertEqual(shared.skipped, ["GTVt", "Brain"])
+        self.assertTrue(np.array_equal(self.reference_img.getContours()[2].getData().copyToNPArray(), masks["GTVn"]))
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,167 @@
+import math
+import os
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+try:  # For production
+    from MIMPython.SupportedIOTypes import XMimImage
+except ModuleNotFoundError:  # For Testing
+    from testing.mock_classes import XMimImage
+
+CROP_MODES = ["none", "contours", "body"]
+DEFAULT_MARGIN_MM = 10.0
+DEFAULT_BODY_THRESHOLD = -500  # HU. Air is around -1000, soft tissue around 0
+
+
+class CropBox:
+    """
+    A box in voxel indices (numpy order z, y, x) of the reference image grid.
+    Arrays on a finer grid, i.e. contours with a multiplier, are cropped with the box scaled by the integer ratio
+    between their shape and full_shape
+    """
+    def __init__(self, offset: Sequence[int], size: Sequence[int], full_shape: Sequence[int]) -> None:
+        self.offset = [int(o) for o in offset]
+        self.size = [int(s) for s in size]
+        self.full_shape = [int(s) for s in full_shape]
+
+    def scale_for(self, shape: Sequence[int], reference: Sequence[int] = None) -> List[int]:
+        reference = self.full_shape if reference is None else reference
+        if len(shape) != len(reference) or any(s % r for s, r in zip(shape, reference)):
+            raise ValueError("Shape {} is not a multiple of the cropped grid {}".format(tuple(shape), tuple(reference)))
+        return [s // r for s, r in zip(shape, reference)]
+
+    def slices(self, scale: Sequence[int] = None) -> Tuple[slice, ...]:
+        scale = scale or [1] * len(self.offset)
+        return tuple(slice(o * f, (o + s) * f) for o, s, f in zip(self.offset, self.size, scale))
+
+    def crop(self, arr: np.ndarray) -> np.ndarray:
+        # Copied, so the full array from MIM can be freed right away
+        return arr[self.slices(self.scale_for(arr.shape))].copy()
+
+    def crop_origin(self,
+                    origin: Sequence[float],
+                    spacing: Sequence[float],
+                    direction: Sequence[float],
+                    shape: Sequence[int]) -> List[float]:
+        """
+        Physical position of the first voxel of the cropped array. spacing, origin and direction are given in the
+        SimpleITK (x-first) convention for an array of the uncropped shape
+        """
+        offset_xyz = list(reversed([o * f for o, f in zip(self.offset, self.scale_for(shape))]))
+        rotation = np.array(direction, dtype=np.float64).reshape(3, 3)
+        shift = rotation @ (np.array(offset_xyz, dtype=np.float64) * np.array(spacing, dtype=np.float64))
+        return [float(o + s) for o, s in zip(origin, shift)]
+
+    def pad(self, arr: np.ndarray) -> np.ndarray:
+        """
+        Inverse of crop. Places arr, which covers the box, in an array of zeros covering the full grid
+        """
+        scale = self.scale_for(arr.shape, reference=self.size)
+        full = np.zeros([s * f for s, f in zip(self.full_shape, scale)], dtype=arr.dtype)
+        full[self.slices(scale)] = arr
+        return full
+
+    def to_dict(self) -> Dict:
+        return {"offset": self.offset, "size": self.size, "full_shape": self.full_shape}
+
+    @staticmethod
+    def from_dict(d: Dict) -> "CropBox":
+        return CropBox(offset=d["offset"], size=d["size"], full_shape=d["full_shape"])
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CropBox) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return "CropBox(offset={}, size={}, full_shape={})".format(self.offset, self.size, self.full_shape)
+
+
+def bounding_box(mask: np.ndarray) -> Optional[Tuple[List[int], List[int]]]:
+    """
+    Returns (start, stop) of the nonzero voxels of mask or None if it is empty
+    """
+    start, stop = [], []
+    for axis in range(mask.ndim):
+        # Reducing over the other axes is much cheaper than np.nonzero of the full mask
+        other_axes = tuple(a for a in range(mask.ndim) if a != axis)
+        hits = np.flatnonzero(np.any(mask, axis=other_axes))
+        if len(hits) == 0:
+            return None
+        start.append(int(hits[0]))
+        stop.append(int(hits[-1]) + 1)
+    return start, stop
+
+
+class CropPolicy:
+    """
+    Decides the region of interest of a TaskInput. spec is one of:
+    - "none": ship the full field of view
+    - "contours" or "contours:<margin_mm>": the bounding box of the contours named contour_names (all contours of
+      the reference image if None) plus the margin
+    - "body" or "body:<margin_mm>": the bounding box of the reference image voxels above body_threshold plus the margin
+    The default margin is 10 mm. If nothing is found, the full field of view is shipped.
+    """
+    def __init__(self,
+                 spec: str = "none",
+                 contour_names: List[str] = None,
+                 body_threshold: float = DEFAULT_BODY_THRESHOLD) -> None:
+        mode, _, margin = spec.strip().lower().partition(":")
+        if mode not in CROP_MODES:
+            raise ValueError("Crop mode must be one of {}. Got {}".format(CROP_MODES, mode))
+
+        self.mode = mode
+        self.margin_mm = float(margin) if margin else DEFAULT_MARGIN_MM
+        self.contour_names = contour_names
+        self.body_threshold = body_threshold
+
+    def __contour_box(self, reference_image: XMimImage):
+        # The image voxels are not needed here, so the shape of the image grid is taken from the contour grid
+        start, stop, image_shape = None, None, None
+        for contour in reference_image.getContours():
+            if self.contour_names is not None and contour.getInfo().getName() not in self.contour_names:
+                continue
+            arr = contour.getData().copyToNPArray()
+            box = bounding_box(arr)
+            if box is None:
+                continue
+
+            # From the contour grid to the image grid, rounding outwards
+            scale = [int(m) for m in contour.getMultiplier()]
+            image_shape = [s // f for s, f in zip(arr.shape, scale)]
+            box_start = [b // f for b, f in zip(box[0], scale)]
+            box_stop = [-(-b // f) for b, f in zip(box[1], scale)]
+            start = box_start if start is None else [min(a, b) for a, b in zip(start, box_start)]
+            stop = box_stop if stop is None else [max(a, b) for a, b in zip(stop, box_stop)]
+
+        if start is None:
+            return None, None
+        return (start, stop), image_shape
+
+    def compute(self, reference_image: XMimImage) -> Optional[CropBox]:
+        """
+        Returns the CropBox on the grid of reference_image or None if the full field of view should be shipped
+        """
+        if self.mode == "none":
+            return None
+
+        # Only "body" reads the voxels, so only it copies the image out of MIM
+        if self.mode == "body":
+            image = reference_image.getRawData().copyToNPArray()
+            box, image_shape = bounding_box(image > self.body_threshold), list(image.shape)
+        else:
+            box, image_shape = self.__contour_box(reference_image)
+        if box is None:
+            return None
+
+        # Margin in voxels per numpy axis. Spacing is x-first
+        spacing_zyx = list(reversed(list(reference_image.getSpace().getNoxSize())))
+        margin = [int(math.ceil(self.margin_mm / s)) for s in spacing_zyx]
+        start = [max(0, b - m) for b, m in zip(box[0], margin)]
+        stop = [min(s, b + m) for s, b, m in zip(image_shape, box[1], margin)]
+
+        if start == [0] * len(start) and stop == image_shape:
+            return None
+        return CropBox(offset=start, size=[b - a for a, b in zip(start, stop)], full_shape=image_shape)
@@ -0,0 +1,111 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+import SimpleITK as sitk
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from cropping.cropping import CropBox, CropPolicy, bounding_box
+from testing.mock_classes import XMimImage
+
+
+class TestCropping(unittest.TestCase):
+    def setUp(self) -> None:
+        self.box = CropBox(offset=[2, 10, 20], size=[4, 30, 40], full_shape=[64, 128, 128])
+
+    def test_bounding_box(self):
+        mask = np.zeros((10, 20, 30), dtype=bool)
+        self.assertIsNone(bounding_box(mask))
+        mask[2, 5, 7] = True
+        mask[4, 3, 9] = True
+        self.assertEqual(bounding_box(mask), ([2, 3, 7], [5, 6, 10]))
+
+    def test_crop_pad_image_grid(self):
+        arr = np.random.randint(0, 100, self.box.full_shape)
+        cropped = self.box.crop(arr)
+        self.assertEqual(list(cropped.shape), self.box.size)
+        self.assertTrue(np.array_equal(cropped, arr[2:6, 10:40, 20:60]))
+
+        padded = self.box.pad(cropped)
+        self.assertEqual(list(padded.shape), self.box.full_shape)
+        self.assertTrue(np.array_equal(padded[self.box.slices()], cropped))
+        self.assertEqual(np.count_nonzero(padded[:2]), 0)
+
+    def test_crop_pad_contour_grid(self):
+        # Contours have a multiplier of [1, 2, 2] relative to the image
+        arr = np.random.randint(0, 2, (64, 256, 256))
+        cropped = self.box.crop(arr)
+        self.assertEqual(cropped.shape, (4, 60, 80))
+        self.assertTrue(np.array_equal(cropped, arr[2:6, 20:80, 40:120]))
+        self.assertEqual(self.box.pad(cropped).shape, arr.shape)
+
+    def test_crop_not_a_multiple(self):
+        self.assertRaises(ValueError, self.box.crop, np.zeros((64, 100, 128)))
+        self.assertRaises(ValueError, self.box.pad, np.zeros((4, 31, 40)))
+
+    def test_crop_origin_matches_sitk(self):
+        arr = np.zeros(self.box.full_shape, dtype=np.int16)
+        img = sitk.GetImageFromArray(arr)
+        img.SetSpacing([1.17, 1.17, 3])
+        img.SetOrigin([-120, 120, 55])
+        direction = [0, 1, 0, -1, 0, 0, 0, 0, 1]
+        img.SetDirection(direction)
+
+        origin = self.box.crop_origin(img.GetOrigin(), img.GetSpacing(), direction, arr.shape)
+        expected = img.TransformIndexToPhysicalPoint(list(reversed(self.box.offset)))
+        self.assertTrue(np.allclose(origin, expected))
+
+    def test_dict_roundtrip(self):
+        self.assertEqual(CropBox.from_dict(self.box.to_dict()), self.box)
+
+    def test_policy_none(self):
+        self.assertIsNone(CropPolicy("none").compute(XMimImage()))
+        self.assertRaises(ValueError, CropPolicy, "lungs")
+
+    def test_policy_contours(self):
+        img = XMimImage()
+        gtv = img.createNewContour("GTVt")
+        gtv.getData().arr = np.zeros_like(gtv.getData().arr)
+        gtv.getData().arr[30:34, 101:120, 60:81] = 1
+        img.createNewContour("Body")  # Random noise all over, must be ignored
+
+        box = CropPolicy("contours:0", contour_names=["GTVt"]).compute(img)
+        # Contour grid is [1, 2, 2] finer, so y and x are rounded outwards
+        self.assertEqual(box, CropBox(offset=[30, 50, 30], size=[4, 10, 11], full_shape=[64, 128, 128]))
+
+        # Margin of 5 mm with spacing [3, 1.17, 1.17] (x-first) is [5, 5, 2] voxels in numpy order
+        box = CropPolicy("contours:5", contour_names=["GTVt"]).compute(img)
+        self.assertEqual(box.offset, [25, 45, 28])
+        self.assertEqual(box.size, [14, 20, 15])
+
+        self.assertIsNone(CropPolicy("contours", contour_names=["Missing"]).compute(img))
+
+    def test_policy_contours_does_not_copy_the_image(self):
+        img = XMimImage()
+        gtv = img.createNewContour("GTVt")
+        gtv.getData().arr = np.zeros_like(gtv.getData().arr)
+        gtv.getData().arr[30:34, 101:120, 60:81] = 1
+
+        with mock.patch.object(img.getRawData(), "copyToNPArray") as copy:
+            box = CropPolicy("contours:0").compute(img)
+        copy.assert_not_called()
+        self.assertEqual(box, CropBox(offset=[30, 50, 30], size=[4, 10, 11], full_shape=[64, 128, 128]))
+
+    def test_policy_body(self):
+        img = XMimImage()
+        img.getRawData().arr = np.full(img.getRawData().arr.shape, -1000)
+        img.getRawData().arr[10:20, 30:90, 40:100] = 40
+
+        box = CropPolicy("body:0").compute(img)
+        self.assertEqual(box, CropBox(offset=[10, 30, 40], size=[10, 60, 60], full_shape=[64, 128, 128]))
+
+        # Box grows past the field of view, so it is clipped
+        box = CropPolicy("body:1000").compute(img)
+        self.assertIsNone(box)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import List, Optional, Tuple
+
+
+class DiskCache:
+    """
+    A size-bounded least-recently-used cache of bytes on disk. Each entry is a file named by its key.
+    Recency is tracked by the modification time of the file, which is bumped on every hit, so the cache
+    survives restarts and can be shared by several processes.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int, max_age_sec: float = None) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes  # Total size of entries before the least recently used are evicted
+        self.max_age_sec = max_age_sec  # Entries not used for this long are evicted. None to keep them
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0  # Bytes served from the cache
+        self.__lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def valid_key(key: str) -> bool:
+        return re.fullmatch(r"[A-Za-z0-9_\-]+", key) is not None
+
+    def __path(self, key: str) -> str:
+        if not self.valid_key(key):
+            raise ValueError("Illegal cache key: {}".format(key))
+        return os.path.join(self.cache_dir, key + ".bin")
+
+    def __is_expired(self, mtime: float, now: float) -> bool:
+        return self.max_age_sec is not None and now - mtime > self.max_age_sec
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Returns the cached bytes for key or None
+        """
+        path = self.__path(key)
+        try:
+            if self.__is_expired(os.path.getmtime(path), time.time()):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "rb") as r:
+                data = r.read()
+        except FileNotFoundError:
+            with self.__lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:  # Evicted by someone else meanwhile
+            pass
+
+        with self.__lock:
+            self.hits += 1
+            self.hit_bytes += len(data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Stores data under key and evicts old entries if the cache has grown past max_bytes
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        # Write to a temporary file first, so readers never see a half written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.__path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def delete(self, key: str) -> None:
+        """
+        Removes the entry of key, if any
+        """
+        try:
+            os.remove(self.__path(key))
+        except FileNotFoundError:
+            pass
+
+    def __entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if not file.endswith(".bin"):
+                continue
+            path = os.path.join(self.cache_dir, file)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # Evicted by someone else meanwhile
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self) -> None:
+        """
+        Removes expired entries and then the least recently used ones until the total size is below max_bytes
+        """
+        with self.__lock:
+            now = time.time()
+            entries = self.__entries()
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if total <= self.max_bytes and not self.__is_expired(mtime, now):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.__entries())
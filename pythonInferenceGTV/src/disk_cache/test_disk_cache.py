@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from disk_cache.disk_cache import DiskCache
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_get_put(self):
+        cache = DiskCache(self.tmp_dir.name, max_bytes=1024)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", b"hest")
+        self.assertEqual(cache.get("a"), b"hest")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual((cache.hit_bytes, cache.hit_rate()), (4, 0.5))
+
+        # Survives a new instance
+        self.assertEqual(DiskCache(self.tmp_dir.name, max_bytes=1024).get("a"), b"hest")
+
+        cache.delete("a")
+        cache.delete("a")
+        self.assertIsNone(cache.get("a"))
+
+    def test_illegal_key(self):
+        cache = DiskCache(self.tmp_dir.name, max_bytes=1024)
+        self.assertRaises(ValueError, cache.put, "../a", b"hest")
+        self.assertFalse(DiskCache.valid_key("../a"))
+        self.assertTrue(DiskCache.valid_key("uid-0_A"))
+
+    def test_lru_eviction(self):
+        cache = DiskCache(self.tmp_dir.name, max_bytes=250)
+        for key in ["a", "b"]:
+            cache.put(key, bytes(100))
+            time.sleep(0.01)
+
+        cache.get("a")  # a is now more recently used than b
+        time.sleep(0.01)
+        cache.put("c", bytes(100))
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertLessEqual(cache.size(), 250)
+
+    def test_too_large_entry_not_stored(self):
+        cache = DiskCache(self.tmp_dir.name, max_bytes=10)
+        cache.put("a", bytes(100))
+        self.assertIsNone(cache.get("a"))
+
+    def test_max_age(self):
+        cache = DiskCache(self.tmp_dir.name, max_bytes=1024, max_age_sec=60)
+        cache.put("a", b"hest")
+        cache.put("b", b"ko")
+        old = time.time() - 120
+        os.utime(os.path.join(self.tmp_dir.name, "a.bin"), (old, old))
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), b"ko")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,7 +14,8 @@ except ModuleNotFoundError:  # For Testing
     from builtins import int as Integer
 
 from client_backend.client_backend import ClientBackend
-from ext_functions.ext_functions import inference_server_post, inference_server_get
+from ext_functions.ext_functions import inference_server_post, inference_server_post_to_models, inference_server_get, \
+    inference_server_post_and_load, inference_server_get_from_uids
 
 @mim_extension_entrypoint(name="InferenceServer4images",
                           author="Mathis Rasmussen",
@@ -31,7 +32,10 @@ def inferenceServer4images(session: XMimSession,
                            export_dicom_info: Integer,
                            export_contours: Integer,
                            contour_names: String,
-                           server_url: String) -> String:
+                           server_url: String,
+                           compression: String = "auto",
+                           crop: String = "none",
+                           dicom_tags: String = "") -> String:
     logger = session.createLogger()
     logger.info("Starting extension InferenceServer4images")
     try:
@@ -43,7 +47,10 @@ def inferenceServer4images(session: XMimSession,
                                     export_dicom_info=export_dicom_info,
                                     contour_names=contour_names,
                                     export_contours=export_contours,
-                                    client_backend=client_backend)
+                                    client_backend=client_backend,
+                                    compression=compression,
+                                    crop=crop,
+                                    dicom_tags=dicom_tags)
         logger.info(f"UID: {uid}")
         return uid
     except:
@@ -64,7 +71,10 @@ def inference_server_3_images(session: XMimSession,
                               export_dicom_info: Integer,
                               export_contours: Integer,
                               contour_names: String,
-                              server_url: String) -> String:
+                              server_url: String,
+                              compression: String = "auto",
+                              crop: String = "none",
+                              dicom_tags: String = "") -> String:
     logger = session.createLogger()
     logger.info("Starting extension InferenceServer4images")
     try:
@@ -76,7 +86,10 @@ def inference_server_3_images(session: XMimSession,
                                     export_dicom_info=export_dicom_info,
                                     contour_names=contour_names,
                                     export_contours=export_contours,
-                                    client_backend=client_backend)
+                                    client_backend=client_backend,
+                                    compression=compression,
+                                    crop=crop,
+                                    dicom_tags=dicom_tags)
         logger.info(f"UID: {uid}")
         return uid
     except:
@@ -96,7 +109,10 @@ def inference_server_2_images(session: XMimSession,
                               export_dicom_info: Integer,
                               export_contours: Integer,
                               contour_names: String,
-                              server_url: String) -> String:
+                              server_url: String,
+                              compression: String = "auto",
+                              crop: String = "none",
+                              dicom_tags: String = "") -> String:
     logger = session.createLogger()
     logger.info("Starting extension InferenceServer2images")
     try:
@@ -108,7 +124,10 @@ def inference_server_2_images(session: XMimSession,
                                     export_dicom_info=export_dicom_info,
                                     contour_names=contour_names,
                                     export_contours=export_contours,
-                                    client_backend=client_backend)
+                                    client_backend=client_backend,
+                                    compression=compression,
+                                    crop=crop,
+                                    dicom_tags=dicom_tags)
         logger.info(f"UID: {uid}")
         return uid
 
@@ -128,7 +147,10 @@ def inference_server_1_images(session: XMimSession,
                               export_dicom_info: Integer,
                               export_contours: Integer,
                               contour_names: String,
-                              server_url: String) -> String:
+                              server_url: String,
+                              compression: String = "auto",
+                              crop: String = "none",
+                              dicom_tags: String = "") -> String:
     logger = session.createLogger()
     logger.info("Starting extension InferenceServer4images")
     try:
@@ -140,13 +162,170 @@ def inference_server_1_images(session: XMimSession,
                                     export_dicom_info=export_dicom_info,
                                     contour_names=contour_names,
                                     export_contours=export_contours,
-                                    client_backend=client_backend)
+                                    client_backend=client_backend,
+                                    compression=compression,
+                                    crop=crop,
+                                    dicom_tags=dicom_tags)
         logger.info(f"UID: {uid}")
         return uid
     except:
         logger.error(traceback.format_exc())
 
 
+@mim_extension_entrypoint(name="InferenceServer4imagesMultiModel",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_4_images_multi_model(session: XMimSession,
+                                           img_zero: XMimImage,
+                                           img_one: XMimImage,
+                                           img_two: XMimImage,
+                                           img_three: XMimImage,
+                                           model_human_readable_ids: String,
+                                           export_dicom_info: Integer,
+                                           export_contours: Integer,
+                                           contour_names: String,
+                                           server_url: String,
+                                           compression: String = "auto",
+                                           crop: String = "none",
+                                           dicom_tags: String = "") -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServer4imagesMultiModel")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        images = [img_zero, img_one, img_two, img_three]
+        uids = inference_server_post_to_models(session=session,
+                                               images=images,
+                                               model_human_readable_ids=model_human_readable_ids,
+                                               export_dicom_info=export_dicom_info,
+                                               contour_names=contour_names,
+                                               export_contours=export_contours,
+                                               client_backend=client_backend,
+                                               compression=compression,
+                                               crop=crop,
+                                               dicom_tags=dicom_tags)
+        logger.info(f"UIDs: {uids}")
+        return uids
+    except:
+        logger.error(traceback.format_exc())
+
+
+@mim_extension_entrypoint(name="InferenceServer3imagesMultiModel",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_3_images_multi_model(session: XMimSession,
+                                           img_zero: XMimImage,
+                                           img_one: XMimImage,
+                                           img_two: XMimImage,
+                                           model_human_readable_ids: String,
+                                           export_dicom_info: Integer,
+                                           export_contours: Integer,
+                                           contour_names: String,
+                                           server_url: String,
+                                           compression: String = "auto",
+                                           crop: String = "none",
+                                           dicom_tags: String = "") -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServer3imagesMultiModel")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        images = [img_zero, img_one, img_two]
+        uids = inference_server_post_to_models(session=session,
+                                               images=images,
+                                               model_human_readable_ids=model_human_readable_ids,
+                                               export_dicom_info=export_dicom_info,
+                                               contour_names=contour_names,
+                                               export_contours=export_contours,
+                                               client_backend=client_backend,
+                                               compression=compression,
+                                               crop=crop,
+                                               dicom_tags=dicom_tags)
+        logger.info(f"UIDs: {uids}")
+        return uids
+    except:
+        logger.error(traceback.format_exc())
+
+
+@mim_extension_entrypoint(name="InferenceServer2imagesMultiModel",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_2_images_multi_model(session: XMimSession,
+                                           img_zero: XMimImage,
+                                           img_one: XMimImage,
+                                           model_human_readable_ids: String,
+                                           export_dicom_info: Integer,
+                                           export_contours: Integer,
+                                           contour_names: String,
+                                           server_url: String,
+                                           compression: String = "auto",
+                                           crop: String = "none",
+                                           dicom_tags: String = "") -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServer2imagesMultiModel")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        images = [img_zero, img_one]
+        uids = inference_server_post_to_models(session=session,
+                                               images=images,
+                                               model_human_readable_ids=model_human_readable_ids,
+                                               export_dicom_info=export_dicom_info,
+                                               contour_names=contour_names,
+                                               export_contours=export_contours,
+                                               client_backend=client_backend,
+                                               compression=compression,
+                                               crop=crop,
+                                               dicom_tags=dicom_tags)
+        logger.info(f"UIDs: {uids}")
+        return uids
+    except:
+        logger.error(traceback.format_exc())
+
+
+@mim_extension_entrypoint(name="InferenceServer1imagesMultiModel",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_1_images_multi_model(session: XMimSession,
+                                           img_zero: XMimImage,
+                                           model_human_readable_ids: String,
+                                           export_dicom_info: Integer,
+                                           export_contours: Integer,
+                                           contour_names: String,
+                                           server_url: String,
+                                           compression: String = "auto",
+                                           crop: String = "none",
+                                           dicom_tags: String = "") -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServer1imagesMultiModel")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        images = [img_zero]
+        uids = inference_server_post_to_models(session=session,
+                                               images=images,
+                                               model_human_readable_ids=model_human_readable_ids,
+                                               export_dicom_info=export_dicom_info,
+                                               contour_names=contour_names,
+                                               export_contours=export_contours,
+                                               client_backend=client_backend,
+                                               compression=compression,
+                                               crop=crop,
+                                               dicom_tags=dicom_tags)
+        logger.info(f"UIDs: {uids}")
+        return uids
+    except:
+        logger.error(traceback.format_exc())
+
+
 @mim_extension_entrypoint(name="InferenceServerGetFromUid",
                           author="Mathis Rasmussen",
                           description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
@@ -171,3 +350,217 @@ def inference_server_get_from_uid(session: XMimSession,
                              client_backend=client_backend)
     except:
         logger.error(traceback.format_exc())
+
+
+@mim_extension_entrypoint(name="InferenceServerGetFromUids",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_get_from_uids_entrypoint(session: XMimSession,
+                                              uids: String,
+                                              reference_image: XMimImage,
+                                              server_url: String,
+                                              polling_interval_sec: Integer,
+                                              timeout_sec: Integer) -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServerGetFromUids")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        failed = inference_server_get_from_uids(session=session,
+                                                uids=uids,
+                                                reference_images=[reference_image],
+                                                timeout_sec=timeout_sec,
+                                                polling_interval_sec=polling_interval_sec,
+                                                client_backend=client_backend)
+        logger.info(f"Failed UIDs: {failed}")
+        return failed
+    except:
+        logger.error(traceback.format_exc())
+
+
+@mim_extension_entrypoint(name="InferenceServer4imagesPostAndLoad",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_4_images_post_and_load(session: XMimSession,
+                                            img_zero: XMimImage,
+                                            img_one: XMimImage,
+                                            img_two: XMimImage,
+                                            img_three: XMimImage,
+                                            model_human_readable_id: String,
+                                            export_dicom_info: Integer,
+                                            export_contours: Integer,
+                                            contour_names: String,
+                                            server_url: String,
+                                            polling_interval_sec: Integer,
+                                            timeout_sec: Integer,
+                                            compression: String = "auto",
+                                            crop: String = "none",
+                                            dicom_tags: String = "",
+                                            wait_mode: String = "auto") -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServer4imagesPostAndLoad")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        images = [img_zero, img_one, img_two, img_three]
+        # Waits for the task and downloads its output on a worker thread and loads the contours onto img_zero on this
+        # thread before returning
+        uid = inference_server_post_and_load(session=session,
+                                             images=images,
+                                             model_human_readable_id=model_human_readable_id,
+                                             export_dicom_info=export_dicom_info,
+                                             contour_names=contour_names,
+                                             export_contours=export_contours,
+                                             polling_interval_sec=polling_interval_sec,
+                                             timeout_sec=timeout_sec,
+                                             client_backend=client_backend,
+                                             compression=compression,
+                                             crop=crop,
+                                             dicom_tags=dicom_tags,
+                                             wait_mode=wait_mode)
+        logger.info(f"UID: {uid}")
+        return uid
+    except:
+        logger.error(traceback.format_exc())
+
+
+@mim_extension_entrypoint(name="InferenceServer3imagesPostAndLoad",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_3_images_post_and_load(session: XMimSession,
+                                            img_zero: XMimImage,
+                                            img_one: XMimImage,
+                                            img_two: XMimImage,
+                                            model_human_readable_id: String,
+                                            export_dicom_info: Integer,
+                                            export_contours: Integer,
+                                            contour_names: String,
+                                            server_url: String,
+                                            polling_interval_sec: Integer,
+                                            timeout_sec: Integer,
+                                            compression: String = "auto",
+                                            crop: String = "none",
+                                            dicom_tags: String = "",
+                                            wait_mode: String = "auto") -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServer3imagesPostAndLoad")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        images = [img_zero, img_one, img_two]
+        # Waits for the task and downloads its output on a worker thread and loads the contours onto img_zero on this
+        # thread before returning
+        uid = inference_server_post_and_load(session=session,
+                                             images=images,
+                                             model_human_readable_id=model_human_readable_id,
+                                             export_dicom_info=export_dicom_info,
+                                             contour_names=contour_names,
+                                             export_contours=export_contours,
+                                             polling_interval_sec=polling_interval_sec,
+                                             timeout_sec=timeout_sec,
+                                             client_backend=client_backend,
+                                             compression=compression,
+                                             crop=crop,
+                                             dicom_tags=dicom_tags,
+                                             wait_mode=wait_mode)
+        logger.info(f"UID: {uid}")
+        return uid
+    except:
+        logger.error(traceback.format_exc())
+
+
+@mim_extension_entrypoint(name="InferenceServer2imagesPostAndLoad",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_2_images_post_and_load(session: XMimSession,
+                                            img_zero: XMimImage,
+                                            img_one: XMimImage,
+                                            model_human_readable_id: String,
+                                            export_dicom_info: Integer,
+                                            export_contours: Integer,
+                                            contour_names: String,
+                                            server_url: String,
+                                            polling_interval_sec: Integer,
+                                            timeout_sec: Integer,
+                                            compression: String = "auto",
+                                            crop: String = "none",
+                                            dicom_tags: String = "",
+                                            wait_mode: String = "auto") -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServer2imagesPostAndLoad")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        images = [img_zero, img_one]
+        # Waits for the task and downloads its output on a worker thread and loads the contours onto img_zero on this
+        # thread before returning
+        uid = inference_server_post_and_load(session=session,
+                                             images=images,
+                                             model_human_readable_id=model_human_readable_id,
+                                             export_dicom_info=export_dicom_info,
+                                             contour_names=contour_names,
+                                             export_contours=export_contours,
+                                             polling_interval_sec=polling_interval_sec,
+                                             timeout_sec=timeout_sec,
+                                             client_backend=client_backend,
+                                             compression=compression,
+                                             crop=crop,
+                                             dicom_tags=dicom_tags,
+                                             wait_mode=wait_mode)
+        logger.info(f"UID: {uid}")
+        return uid
+    except:
+        logger.error(traceback.format_exc())
+
+
+@mim_extension_entrypoint(name="InferenceServer1imagesPostAndLoad",
+                          author="Mathis Rasmussen",
+                          description="See https://github.com/mathiser/MIMExtensions/blob/main/pythonInferenceGTV/src/readme.md",
+                          category="Inference server model",
+                          institution="DCPT",
+                          version=1.1)
+def inference_server_1_images_post_and_load(session: XMimSession,
+                                            img_zero: XMimImage,
+                                            model_human_readable_id: String,
+                                            export_dicom_info: Integer,
+                                            export_contours: Integer,
+                                            contour_names: String,
+                                            server_url: String,
+                                            polling_interval_sec: Integer,
+                                            timeout_sec: Integer,
+                                            compression: String = "auto",
+                                            crop: String = "none",
+                                            dicom_tags: String = "",
+                                            wait_mode: String = "auto") -> String:
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServer1imagesPostAndLoad")
+    try:
+        client_backend = ClientBackend(base_url=server_url)
+        images = [img_zero]
+        # Waits for the task and downloads its output on a worker thread and loads the contours onto img_zero on this
+        # thread before returning
+        uid = inference_server_post_and_load(session=session,
+                                             images=images,
+                                             model_human_readable_id=model_human_readable_id,
+                                             export_dicom_info=export_dicom_info,
+                                             contour_names=contour_names,
+                                             export_contours=export_contours,
+                                             polling_interval_sec=polling_interval_sec,
+                                             timeout_sec=timeout_sec,
+                                             client_backend=client_backend,
+                                             compression=compression,
+                                             crop=crop,
+                                             dicom_tags=dicom_tags,
+                                             wait_mode=wait_mode)
+        logger.info(f"UID: {uid}")
+        return uid
+    except:
+        logger.error(traceback.format_exc())
@@ -1,8 +1,14 @@
+import asyncio
+import json
 import os
+import queue
 import re
 import sys
+import tempfile
+import time
 import traceback
-from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Tuple, Union
 
 from client_backend.client_backend_interface import ClientBackendInterface
 
@@ -15,11 +21,29 @@ except ModuleNotFoundError:  # For Testing
     from builtins import str as String
     from builtins import int as Integer
 
+from cropping.cropping import CropBox, CropPolicy
+from disk_cache.disk_cache import DiskCache
 from task_input.task_input import TaskInput
+from task_input.compression import CompressionPolicy, needs_server_codecs
+from task_input.info_generators import generate_image_meta_information, parse_dicom_tags
 from inference_client.inference_client import InferenceClient
+from inference_client.async_inference_client import AsyncInferenceClient, DEFAULT_MAX_CONCURRENCY
+from task_output.task_output import GRID_IMAGE, TaskOutput
 from contour_loader.contour_loader import ContourLoader
 
 
+ENCODED_VOLUME_CACHE_DIR = os.path.join(tempfile.gettempdir(), "pythonInferenceGTV", "encoded_volumes")
+ENCODED_VOLUME_CACHE_MAX_BYTES = 4 * 1024 ** 3
+CROP_STORE_DIR = os.path.join(tempfile.gettempdir(), "pythonInferenceGTV", "crops")  # CropBox of each posted UID
+CROP_STORE_MAX_AGE_SEC = 30 * 24 * 3600
+RESULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "pythonInferenceGTV", "results")  # Output zip of each UID
+RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+RESULT_CACHE_MAX_AGE_SEC = 7 * 24 * 3600
+POST_AND_LOAD_PHASES = ("post", "get", "load", "total")
+POST_AND_LOAD_THREAD_PREFIX = "InferenceServerPostAndLoad-"  # Followed by the UID of the task
+POST_AND_LOAD_RELAY_INTERVAL_SEC = 0.5  # How often the calling thread relays the messages of the worker to MIM
+
+
 def parse_contour_names(contour_names: str) -> Union[List[str], None]:
     if contour_names == "":
         return None  # Will export all contours if export_contours is true
@@ -28,51 +52,217 @@ def parse_contour_names(contour_names: str) -> Union[List[str], None]:
         return re.split(',', contour_names.strip(" "))
 
 
+def parse_model_human_readable_ids(model_human_readable_ids: str) -> List[str]:
+    # Split on comma, semicolon and/or white-space
+    return [m for m in re.split(r"[,;\s]+", model_human_readable_ids) if m]
+
+
+def build_task_input(logger,
+                     images: List[XMimImage],
+                     model_human_readable_id: str,
+                     export_dicom_info: int,
+                     export_contours: int,
+                     contour_names: str,
+                     inference_client: InferenceClient,
+                     client_backend: ClientBackendInterface,
+                     compression: str,
+                     crop: str = "none",
+                     dicom_tags: str = "") -> Tuple[TaskInput, DiskCache]:
+    # Assert allow values only
+    assert export_contours in [0, 1, 2]  # 2 packs the contours into multi-label volumes
+    assert export_dicom_info in [0, 1]
+
+    # Cast as bool
+    export_dicom_info = bool(export_dicom_info)
+    contour_export_mode = "packed" if export_contours == 2 else "separate"
+    export_contours = bool(export_contours)
+
+    # Make list none if no string given
+    contour_names = parse_contour_names(contour_names)
+
+    # Compression policy. "auto" weighs encode time against the upload throughput measured on earlier posts
+    server_codecs = ["gzip"]
+    if needs_server_codecs(compression):
+        server_codecs = inference_client.get_supported_input_codecs()
+    compression_policy = CompressionPolicy(compression,
+                                           server_codecs=server_codecs,
+                                           upload_bytes_per_sec=client_backend.get_upload_throughput())
+
+    # Connect to the server while the volumes are encoded, unless asking for its codecs above already did
+    if not needs_server_codecs(compression):
+        client_backend.preconnect()
+
+    # Cache of encoded volumes. Reposting the same images (e.g. to another model) skips the encoding
+    cache = DiskCache(cache_dir=ENCODED_VOLUME_CACHE_DIR, max_bytes=ENCODED_VOLUME_CACHE_MAX_BYTES)
+
+    # Instantiate task_input
+    task_input = TaskInput(model_human_readable_id=model_human_readable_id,
+                           export_dicom_info=export_dicom_info,
+                           compression=compression_policy,
+                           cache=cache,
+                           contour_export_mode=contour_export_mode,
+                           crop=CropPolicy(crop, contour_names=contour_names),
+                           dicom_tags=parse_dicom_tags(dicom_tags))
+
+    # set images to task_input
+    for img in images:
+        task_input.add_image(img)
+
+    # Set contours to export.
+    # contour_names=None -> export all contours else export only exact names
+    if export_contours:
+        task_input.set_contours_to_export_from_img(images[0], contour_names=contour_names)
+
+    return task_input, cache
+
+
+def crop_store() -> DiskCache:
+    # Posting and getting a task are separate runs of the extension, so the crop of each UID is kept on disk
+    return DiskCache(cache_dir=CROP_STORE_DIR, max_bytes=64 * 1024 ** 2, max_age_sec=CROP_STORE_MAX_AGE_SEC)
+
+
+def result_cache() -> DiskCache:
+    # Outputs of completed tasks, so getting a UID again (e.g. onto another reference image) does not download it again
+    return DiskCache(cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES, max_age_sec=RESULT_CACHE_MAX_AGE_SEC)
+
+
+def save_crop(uid: str, crop: CropBox) -> None:
+    if crop is not None:
+        crop_store().put(uid, json.dumps(crop.to_dict()).encode())
+
+
+def load_crop(uid: str) -> Union[CropBox, None]:
+    data = crop_store().get(uid)
+    if data is None:
+        return None
+    return CropBox.from_dict(json.loads(data))
+
+
+def load_task_output(logger, task_output: TaskOutput, reference_image: XMimImage) -> ContourLoader:
+    """
+    Sets the predictions of task_output as contours on reference_image
+    """
+    logger.info(f"Output formats: {task_output.formats}")
+
+    # Get label array_dict from task_output. Predictions on the image grid are upsampled to the contour grid ...
+    scaling_factor = None
+    if GRID_IMAGE in task_output.grids:
+        scaling_factor = generate_image_meta_information(reference_image)["scaling_factor"]
+        logger.info(f"Upsampling image grid predictions by: {scaling_factor}")
+    label_array_dict = task_output.get_output_as_label_array_dict(scaling_factor=scaling_factor)
+
+    # ... and load it into ContourLoader, which sets the contours to MIM
+    # Masks are built ahead on a worker thread and all contours are redrawn once at the end
+    contour_loader = ContourLoader(reference_image=reference_image, logger=logger, defer_redraw=True)
+    contour_loader.set_contours_from_label_array_dict(label_array_dict=label_array_dict)
+    return contour_loader
+
+
 def inference_server_post(session: XMimSession,
                           images: List[XMimImage],
                           model_human_readable_id: str,
                           export_dicom_info: int,
                           export_contours: int,
                           contour_names: str,
-                          client_backend: ClientBackendInterface) -> String:  # Funky construct. Think of a better way.
+                          client_backend: ClientBackendInterface,
+                          compression: str = "auto",
+                          crop: str = "none",
+                          dicom_tags: str = "",
+                          upload_mode: str = "chunked") -> String:  # Funky construct. Think of a better way.
 
     logger = session.createLogger()
     logger.info("Starting extension InferenceServerPost")
 
     try:
-        # Assert allow values only
-        assert export_contours in [0, 1]
-        assert export_dicom_info in [0, 1]
+        # Init Clients
+        inference_client = InferenceClient(client_backend=client_backend,
+                                           logger=logger,
+                                           upload_mode=upload_mode)
+
+        task_input, cache = build_task_input(logger=logger,
+                                             images=images,
+                                             model_human_readable_id=model_human_readable_id,
+                                             export_dicom_info=export_dicom_info,
+                                             export_contours=export_contours,
+                                             contour_names=contour_names,
+                                             inference_client=inference_client,
+                                             client_backend=client_backend,
+                                             compression=compression,
+                                             crop=crop,
+                                             dicom_tags=dicom_tags)
+
+        # Post task
+        logger.info(f"Posting task_input on: {inference_client.task_endpoint}")
+        uid = inference_client.post_task(task_input)
+        logger.info(f"Compression used: {task_input.compression_report}")
+        if task_input.crop_box is not None:
+            logger.info(f"Cropped to: {task_input.crop_box}")
+            save_crop(uid, task_input.crop_box)
+        logger.info(f"Encoded volume cache: {cache.hits} hits, {cache.misses} misses")
 
-        # Cast as bool
-        export_dicom_info = bool(export_dicom_info)
-        export_contours = bool(export_contours)
+        logger.info(uid)
+        return uid
 
-        # Make list none if no string given
-        contour_names = parse_contour_names(contour_names)
+    except Exception as e:
+        logger.error("ERROR")
+        logger.error(e)
+        logger.error(traceback.format_exc())
 
-        # Instantiate task_input
-        task_input = TaskInput(model_human_readable_id=model_human_readable_id,
-                               export_dicom_info=export_dicom_info)
 
-        # set images to task_input
-        for img in images:
-            task_input.add_image(img)
+def inference_server_post_to_models(session: XMimSession,
+                                    images: List[XMimImage],
+                                    model_human_readable_ids: str,
+                                    export_dicom_info: int,
+                                    export_contours: int,
+                                    contour_names: str,
+                                    client_backend: ClientBackendInterface,
+                                    compression: str = "auto",
+                                    crop: str = "none",
+                                    dicom_tags: str = "",
+                                    upload_mode: str = "chunked") -> String:
+    """
+    Encodes the images once and posts them to every model in model_human_readable_ids (separated by comma, semicolon
+    and/or white-space). Returns the UIDs in the same order, separated by ", ". Models the post failed on are logged and
+    left out, so the tasks created on the other models can still be fetched
+    """
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServerPostToModels")
 
-        # Set contours to export.
-        # contour_names=None -> export all contours else export only exact names
-        if export_contours:
-            task_input.set_contours_to_export_from_img(images[0], contour_names=contour_names)
+    try:
+        model_ids = parse_model_human_readable_ids(model_human_readable_ids)
+        assert model_ids, "No model_human_readable_ids given"
 
         # Init Clients
         inference_client = InferenceClient(client_backend=client_backend,
-                                           logger=logger)
-        # Post task
-        logger.info(f"Posting task_input on: {inference_client.task_endpoint}")
-        uid = inference_client.post_task(task_input)
+                                           logger=logger,
+                                           upload_mode=upload_mode)
 
-        logger.info(uid)
-        return uid
+        task_input, cache = build_task_input(logger=logger,
+                                             images=images,
+                                             model_human_readable_id=model_ids[0],
+                                             export_dicom_info=export_dicom_info,
+                                             export_contours=export_contours,
+                                             contour_names=contour_names,
+                                             inference_client=inference_client,
+                                             client_backend=client_backend,
+                                             compression=compression,
+                                             crop=crop,
+                                             dicom_tags=dicom_tags)
+
+        # Post task to all models
+        logger.info(f"Posting task_input to {len(model_ids)} models on: {inference_client.task_endpoint}")
+        uids = inference_client.post_task_to_models(task_input, model_ids)
+        logger.info(f"Compression used: {task_input.compression_report}")
+        if task_input.crop_box is not None:
+            logger.info(f"Cropped to: {task_input.crop_box}")
+            for uid in uids:
+                if uid is not None:
+                    save_crop(uid, task_input.crop_box)
+        logger.info(f"Encoded volume cache: {cache.hits} hits, {cache.misses} misses")
+
+        for model_id, uid in zip(model_ids, uids):
+            logger.info(f"{model_id}: {uid if uid is not None else 'failed'}")
+        return ", ".join(uid for uid in uids if uid is not None)
 
     except Exception as e:
         logger.error("ERROR")
@@ -85,27 +275,215 @@ def inference_server_get(session: XMimSession,
                          reference_image: XMimImage,
                          polling_interval_sec: Integer,
                          timeout_sec: Integer,
-                         client_backend: ClientBackendInterface):   # Funky construct. Think of a better way.
+                         client_backend: ClientBackendInterface,   # Funky construct. Think of a better way.
+                         wait_mode: str = "auto"):
 
     logger = session.createLogger()
     logger.info("Starting extension inferenceServerGet")
 
     try:
         # Instantiate clients
+        # Completion is awaited by long-poll or server-sent events if the server supports it, else polled
+        inference_client = InferenceClient(client_backend=client_backend,
+                                           polling_interval_sec=polling_interval_sec,
+                                           timeout_sec=timeout_sec,
+                                           logger=logger,
+                                           wait_mode=wait_mode,
+                                           result_cache=result_cache())
+
+        # Polling for output zip. Predictions of a cropped input are padded back into the full grid
+        crop = load_crop(uid)
+        if crop is not None:
+            logger.info(f"Input was cropped to: {crop}")
+        task_output = inference_client.get_task(uid, crop=crop)
+
+        load_task_output(logger=logger, task_output=task_output, reference_image=reference_image)
+
+    except Exception as e:
+        logger.error("exit")
+        logger.error(e)
+        logger.error(traceback.format_exc())
+
+
+class RelayedLogger:
+    """
+    Stands in for the session logger on a worker thread, since the session logger is a MIM object. Messages are queued
+    and written to the session logger by relay() on the calling thread
+    """
+    def __init__(self) -> None:
+        self.__messages = queue.Queue()
+
+    def info(self, msg) -> None:
+        self.__messages.put(("info", msg))
+
+    def error(self, msg) -> None:
+        self.__messages.put(("error", msg))
+
+    def relay(self, logger) -> None:
+        while True:
+            try:
+                level, msg = self.__messages.get_nowait()
+            except queue.Empty:
+                return
+            getattr(logger, level)(msg)
+
+
+def inference_server_post_and_load(session: XMimSession,
+                                   images: List[XMimImage],
+                                   model_human_readable_id: str,
+                                   export_dicom_info: int,
+                                   export_contours: int,
+                                   contour_names: str,
+                                   polling_interval_sec: int,
+                                   timeout_sec: int,
+                                   client_backend: ClientBackendInterface,
+                                   compression: str = "auto",
+                                   crop: str = "none",
+                                   dicom_tags: str = "",
+                                   wait_mode: str = "auto",
+                                   upload_mode: str = "chunked") -> String:
+    """
+    Posts images to the model, waits for the task and loads its output as contours onto images[0] in a single run.
+    Waiting for the task and downloading its output run on a worker thread, which touches no MIM objects and logs
+    through a RelayedLogger. The calling thread polls the worker every POST_AND_LOAD_RELAY_INTERVAL_SEC, relays its
+    messages to the session logger and loads the contours once the output is there, so all MIM calls stay on the
+    calling thread. The run returns after loading. The seconds spent in each of POST_AND_LOAD_PHASES are logged
+    """
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServerPostAndLoad")
+
+    try:
+        timings: Dict[str, float] = {phase: 0.0 for phase in POST_AND_LOAD_PHASES}
+        t_start = time.perf_counter()
+
         inference_client = InferenceClient(client_backend=client_backend,
                                            polling_interval_sec=polling_interval_sec,
                                            timeout_sec=timeout_sec,
-                                           logger=logger)
+                                           logger=logger,
+                                           wait_mode=wait_mode,
+                                           upload_mode=upload_mode,
+                                           result_cache=result_cache())
+
+        task_input, cache = build_task_input(logger=logger,
+                                             images=images,
+                                             model_human_readable_id=model_human_readable_id,
+                                             export_dicom_info=export_dicom_info,
+                                             export_contours=export_contours,
+                                             contour_names=contour_names,
+                                             inference_client=inference_client,
+                                             client_backend=client_backend,
+                                             compression=compression,
+                                             crop=crop,
+                                             dicom_tags=dicom_tags)
+
+        # Post task. The crop is saved as well, so the output can also be fetched later with inference_server_get
+        logger.info(f"Posting task_input on: {inference_client.task_endpoint}")
+        uid = inference_client.post_task(task_input)
+        logger.info(f"Compression used: {task_input.compression_report}")
+        if task_input.crop_box is not None:
+            logger.info(f"Cropped to: {task_input.crop_box}")
+            save_crop(uid, task_input.crop_box)
+        logger.info(f"Encoded volume cache: {cache.hits} hits, {cache.misses} misses")
+        logger.info(uid)
+        timings["post"] = time.perf_counter() - t_start
+
+        try:
+            # Wait and download on the worker ...
+            t0 = time.perf_counter()
+            relayed_logger = RelayedLogger()
+            worker_client = InferenceClient(client_backend=client_backend,
+                                            polling_interval_sec=polling_interval_sec,
+                                            timeout_sec=timeout_sec,
+                                            logger=relayed_logger,
+                                            wait_mode=wait_mode,
+                                            result_cache=inference_client.result_cache)
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix=POST_AND_LOAD_THREAD_PREFIX + uid) as pool:
+                future = pool.submit(worker_client.get_task, uid, crop=task_input.crop_box)
+                while not future.done():
+                    wait([future], timeout=POST_AND_LOAD_RELAY_INTERVAL_SEC)
+                    relayed_logger.relay(logger)
+            task_output = future.result()
+            timings["get"] = time.perf_counter() - t0
+
+            # ... and load on this thread
+            t0 = time.perf_counter()
+            load_task_output(logger=logger, task_output=task_output, reference_image=images[0])
+            timings["load"] = time.perf_counter() - t0
+        except Exception as e:  # The task is still posted, so its UID is returned to get it later
+            logger.error("exit")
+            logger.error(e)
+            logger.error(traceback.format_exc())
+        finally:
+            timings["total"] = time.perf_counter() - t_start
+            logger.info(f"Post-and-load of {uid} timings (sec): " +
+                        ", ".join("{}: {:.3f}".format(phase, timings[phase]) for phase in POST_AND_LOAD_PHASES))
+        return uid
+
+    except Exception as e:
+        logger.error("ERROR")
+        logger.error(e)
+        logger.error(traceback.format_exc())
+
+
+def inference_server_get_from_uids(session: XMimSession,
+                                   uids: str,
+                                   reference_images: List[XMimImage],
+                                   polling_interval_sec: Integer,
+                                   timeout_sec: Integer,
+                                   client_backend: ClientBackendInterface,
+                                   max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                                   wait_mode: str = "auto"):
+    """
+    Gets the outputs of several UIDs (separated by comma, semicolon and/or white-space) at once and loads each onto its
+    reference image as soon as it is ready. reference_images has one image per UID, or a single image for all of them
+    (e.g. the UIDs returned by InferenceServerXimagesMultiModel). All UIDs are polled concurrently, so the whole batch
+    takes about as long as the slowest task. Completion is awaited by wait_mode like in inference_server_get.
+    Returns the UIDs which could not be loaded, separated by ", "
+    """
+    logger = session.createLogger()
+    logger.info("Starting extension InferenceServerGetFromUids")
+
+    try:
+        uid_list = parse_model_human_readable_ids(uids)
+        assert uid_list, "No uids given"
+        if len(reference_images) == 1:
+            reference_images = reference_images * len(uid_list)
+        assert len(reference_images) == len(uid_list), \
+            f"Got {len(reference_images)} reference images for {len(uid_list)} uids"
+        reference_image_of = dict(zip(uid_list, reference_images))
+
+        inference_client = AsyncInferenceClient(client_backend=client_backend,
+                                                polling_interval_sec=polling_interval_sec,
+                                                timeout_sec=timeout_sec,
+                                                logger=logger,
+                                                max_concurrency=max_concurrency,
+                                                wait_mode=wait_mode,
+                                                result_cache=result_cache())
+        crops = [load_crop(uid) for uid in uid_list]
 
-        # Polling for output zip
-        task_output = inference_client.get_task(uid)
+        async def get_and_load() -> List[str]:
+            failed = []
+            # Contours are loaded on this thread, while the other tasks are polled and downloaded on the worker threads
+            async for uid, task_output in inference_client.get_tasks(uid_list, crops):
+                if isinstance(task_output, Exception):
+                    logger.error(f"{uid}: {task_output!r}")
+                    failed.append(uid)
+                    continue
+                try:
+                    logger.info(f"Loading output of {uid}")
+                    load_task_output(logger=logger, task_output=task_output, reference_image=reference_image_of[uid])
+                except Exception:  # One output which can not be loaded does not keep the others from loading
+                    logger.error(f"{uid}: {traceback.format_exc()}")
+                    failed.append(uid)
+            return failed
 
-        # Get label array_dict from task_output ...
-        label_array_dict = task_output.get_output_as_label_array_dict()
+        try:
+            failed = asyncio.run(get_and_load())
+        finally:
+            inference_client.close()
 
-        # ... and load it into ContourLoader, which sets the contours to MIM
-        contour_loader = ContourLoader(reference_image=reference_image, logger=logger)
-        contour_loader.set_contours_from_label_array_dict(label_array_dict=label_array_dict)
+        logger.info(f"Loaded {len(uid_list) - len(failed)} of {len(uid_list)} tasks")
+        return ", ".join(uid for uid in uid_list if uid in failed)
 
     except Exception as e:
         logger.error("exit")
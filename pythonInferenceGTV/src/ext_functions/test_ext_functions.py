@@ -1,16 +1,43 @@
+import io
+import json
 import os
 import sys
+import tempfile
+import threading
 import unittest
+import zipfile
+from unittest import mock
+
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from inference_client.test_inference_client import MockClientBackend
-from ext_functions.ext_functions import parse_contour_names, inference_server_post, inference_server_get
+from ext_functions import ext_functions
+from ext_functions.ext_functions import parse_contour_names, parse_model_human_readable_ids, inference_server_post, \
+    inference_server_post_to_models, inference_server_get, inference_server_post_and_load, load_crop, \
+    inference_server_get_from_uids, POST_AND_LOAD_THREAD_PREFIX
+from cropping.cropping import CropBox
+from nifti_codec.nifti_codec import encode_nifti_gz
 from testing.mock_classes import XMimImage, XMimSession
 
 
+def use_temporary_cache_dirs(test_case: unittest.TestCase) -> None:
+    """
+    Points the encoded volume cache, the crop store and the result cache to a temporary directory for the rest of
+    test_case, so tests neither fill the system temp dir nor see each other's UIDs
+    """
+    tmp_dir = tempfile.TemporaryDirectory()
+    test_case.addCleanup(tmp_dir.cleanup)
+    for name in ["ENCODED_VOLUME_CACHE_DIR", "CROP_STORE_DIR", "RESULT_CACHE_DIR"]:
+        patcher = mock.patch.object(ext_functions, name, os.path.join(tmp_dir.name, name))
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
 class TestExtFunctions(unittest.TestCase):
     def setUp(self) -> None:
         self.client_backend = MockClientBackend("https://test-hest.org")
+        use_temporary_cache_dirs(self)
 
     def test_parse_contour_names_none(self):
         contour_names = ""
@@ -121,6 +148,26 @@ class TestExtFunctions(unittest.TestCase):
         self.assertIsInstance(uid, str)
         return uid
 
+    def test_parse_model_human_readable_ids(self):
+        model_ids = parse_model_human_readable_ids(" GTV,OAR; Brain  Lung ")
+        self.assertEqual(model_ids, ["GTV", "OAR", "Brain", "Lung"])
+
+    def test_inferenceServerPostToModels(self):
+        images = [XMimImage(), XMimImage()]
+
+        uids = inference_server_post_to_models(session=XMimSession(),
+                                               images=images,
+                                               model_human_readable_ids="GTV, OAR",
+                                               export_dicom_info=0,
+                                               contour_names="",
+                                               export_contours=0,
+                                               client_backend=self.client_backend)
+        self.assertIsInstance(uids, str)
+        uids = uids.split(", ")
+        self.assertEqual(len(uids), 2)
+        tasks = {task["uid"]: task for task in self.client_backend.tasks}
+        self.assertEqual([tasks[uid]["model_human_readable_id"] for uid in uids], ["GTV", "OAR"])
+
     def test_inferenceServerGet(self):
         uid = self.test_inferenceServerPost_1_images()
         ref_img = XMimImage()
@@ -130,3 +177,150 @@ class TestExtFunctions(unittest.TestCase):
                              reference_image=ref_img,
                              client_backend=self.client_backend,
                              uid=uid)
+
+    def test_inferenceServerGet_upsamples_image_grid_predictions(self):
+        uid = self.test_inferenceServerPost_1_images()
+        ref_img = XMimImage()
+        pred = np.zeros(ref_img.getRawData().arr.shape, dtype=np.uint8)
+        pred[10:20, 30:60, 40:70] = 1
+
+        output_zip = io.BytesIO()
+        with zipfile.ZipFile(output_zip, "w") as zip:
+            zip.writestr("pred.json", json.dumps({"1": "GTVt", "grid": "image"}))
+            zip.writestr("pred.nii.gz", encode_nifti_gz(pred, spacing=[1, 1, 1], origin=[0, 0, 0]))
+        self.client_backend.output_zip_bytes = output_zip.getvalue()
+
+        inference_server_get(session=XMimSession(),
+                             polling_interval_sec=1,
+                             timeout_sec=5,
+                             reference_image=ref_img,
+                             client_backend=self.client_backend,
+                             uid=uid)
+
+        contour = [c for c in ref_img.getContours() if c.getInfo().getName() == "GTVt"][0]
+        expected = np.repeat(np.repeat(pred == 1, 2, axis=1), 2, axis=2)
+        self.assertTrue(np.array_equal(contour.getData().copyToNPArray(), expected))
+
+    def test_inferenceServerGet_again_is_served_from_result_cache(self):
+        uid = self.test_inferenceServerPost_1_images()
+        self.get_onto(uid, XMimImage())
+
+        # Reloading onto another reference image works without the server
+        self.client_backend.tasks = []
+        self.get_onto(uid, XMimImage())
+
+    def get_onto(self, uid: str, ref_img: XMimImage):
+        inference_server_get(session=XMimSession(),
+                             polling_interval_sec=1,
+                             timeout_sec=2,
+                             reference_image=ref_img,
+                             client_backend=self.client_backend,
+                             uid=uid)
+        self.assertIn("GTVt", [c.getInfo().getName() for c in ref_img.getContours()])
+
+    def test_inferenceServerPost_crop_is_saved_for_get(self):
+        img = XMimImage()
+        img.getRawData().arr = np.full(img.getRawData().arr.shape, -1000)
+        img.getRawData().arr[10:20, 30:90, 40:100] = 40
+
+        uid = inference_server_post(session=XMimSession(),
+                                    images=[img],
+                                    model_human_readable_id="model_human_readable_id",
+                                    export_dicom_info=0,
+                                    contour_names="",
+                                    export_contours=0,
+                                    client_backend=self.client_backend,
+                                    crop="body:0")
+        self.assertEqual(load_crop(uid), CropBox(offset=[10, 30, 40], size=[10, 60, 60], full_shape=[64, 128, 128]))
+        self.assertIsNone(load_crop(self.test_inferenceServerPost_1_images()))
+
+    def post_and_load(self, img: XMimImage) -> str:
+        return inference_server_post_and_load(session=XMimSession(),
+                                              images=[img],
+                                              model_human_readable_id="model_human_readable_id",
+                                              export_dicom_info=0,
+                                              contour_names="",
+                                              export_contours=0,
+                                              polling_interval_sec=1,
+                                              timeout_sec=5,
+                                              client_backend=self.client_backend)
+
+    def test_inferenceServerPostAndLoad(self):
+        img = XMimImage()
+        with self.assertLogs(level="INFO") as logs:
+            uid = self.post_and_load(img)
+        self.assertIsInstance(uid, str)
+        self.assertIn(uid, [t["uid"] for t in self.client_backend.tasks])
+        self.assertIn("GTVt", [c.getInfo().getName() for c in img.getContours()])
+
+        timings = [line for line in logs.output if "Post-and-load of {} timings".format(uid) in line]
+        self.assertEqual(len(timings), 1)
+        for phase in ["post", "get", "load", "total"]:
+            self.assertIn(phase + ": ", timings[0])
+
+    def test_inferenceServerPostAndLoad_waits_on_a_worker(self):
+        img = XMimImage()
+        get_threads = []
+        get = self.client_backend.get
+
+        def record_get(endpoint, *args, **kwargs):
+            get_threads.append((endpoint, threading.current_thread().name))
+            return get(endpoint, *args, **kwargs)
+        self.client_backend.get = record_get
+
+        session_logger = XMimSession().createLogger().name
+        with self.assertLogs(session_logger, level="INFO") as logs:
+            uid = self.post_and_load(img)
+
+        # The task is awaited and downloaded on the worker ...
+        task_threads = [name for endpoint, name in get_threads if uid in endpoint]
+        self.assertTrue(task_threads)
+        self.assertTrue(all(name.startswith(POST_AND_LOAD_THREAD_PREFIX + uid) for name in task_threads))
+        # ... whose messages reach the session logger on the calling thread, which loads the contours
+        self.assertTrue(any("Result cache:" in line for line in logs.output))
+        self.assertEqual({r.threadName for r in logs.records}, {threading.current_thread().name})
+        self.assertIn("GTVt", [c.getInfo().getName() for c in img.getContours()])
+
+    def test_inferenceServerGetFromUids(self):
+        uids = [self.test_inferenceServerPost_1_images() for _ in range(3)]
+        ref_imgs = [XMimImage() for _ in uids]
+
+        failed = inference_server_get_from_uids(session=XMimSession(),
+                                                uids=", ".join(uids[:2] + ["does_not_exist"] + uids[2:]),
+                                                reference_images=ref_imgs[:2] + [XMimImage()] + ref_imgs[2:],
+                                                polling_interval_sec=1,
+                                                timeout_sec=2,
+                                                client_backend=self.client_backend)
+
+        self.assertEqual(failed, "does_not_exist")
+        for ref_img in ref_imgs:
+            self.assertIn("GTVt", [c.getInfo().getName() for c in ref_img.getContours()])
+
+    def test_inferenceServerGetFromUids_load_error_does_not_end_the_batch(self):
+        uids = [self.test_inferenceServerPost_1_images() for _ in range(3)]
+        ref_imgs = [XMimImage(), None, XMimImage()]  # Loading onto None fails
+
+        failed = inference_server_get_from_uids(session=XMimSession(),
+                                                uids=", ".join(uids),
+                                                reference_images=ref_imgs,
+                                                polling_interval_sec=1,
+                                                timeout_sec=2,
+                                                client_backend=self.client_backend)
+
+        self.assertEqual(failed, uids[1])
+        for ref_img in [ref_imgs[0], ref_imgs[2]]:
+            self.assertIn("GTVt", [c.getInfo().getName() for c in ref_img.getContours()])
+
+    def test_inferenceServerGetFromUids_one_reference_image(self):
+        uids = [self.test_inferenceServerPost_1_images() for _ in range(2)]
+        ref_img = XMimImage()
+
+        failed = inference_server_get_from_uids(session=XMimSession(),
+                                                uids=" ".join(uids),
+                                                reference_images=[ref_img],
+                                                polling_interval_sec=1,
+                                                timeout_sec=2,
+                                                client_backend=self.client_backend)
+
+        self.assertEqual(failed, "")
+        self.assertIn("GTVt", [c.getInfo().getName() for c in ref_img.getContours()])
@@ -0,0 +1,274 @@
+import asyncio
+import functools
+import io
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from task_input.task_input import TaskInput
+from cropping.cropping import CropBox
+from disk_cache.disk_cache import DiskCache
+from task_output.task_output import TaskOutput
+from inference_client.exceptions import InferenceServerError, JobExecError
+from inference_client.inference_client import collect_model_posts, zip_fits_in_memory
+from inference_client.polling import PollingStrategy
+from inference_client.result_download import ResultDownload, log_result_cache
+from inference_client.task_waiting import TaskWaiter, WAIT_MODES
+from inference_client.chunked_upload import ChunkedUpload, UPLOAD_MODES
+from client_backend.client_backend_interface import ClientBackendInterface
+from .inference_client_interface import AsyncInferenceClientInterface
+
+DEFAULT_MAX_CONCURRENCY = 8  # Matches the connection pool of ClientBackend, so no request waits for a connection
+DEFAULT_MAX_WAITING = 32  # Tasks awaited by long-poll or server-sent events at once. Each holds a thread and a connection
+
+
+class AsyncInferenceClient(AsyncInferenceClientInterface):
+    """
+    asyncio counterpart of InferenceClient for many tasks at once. Requests are made with the (blocking)
+    client_backend on a pool of max_concurrency threads, so at most max_concurrency requests are in flight and they
+    share the connections of client_backend. upload_mode is honored like in InferenceClient.
+    get_tasks polls all outstanding UIDs in one loop, each on its own PollingStrategy, and yields every output as soon
+    as it has downloaded. Unless wait_mode is "poll", completion of each task is awaited by long-poll or server-sent
+    events first, on a separate pool of max_waiting threads, so waiting tasks do not hold up the polls and downloads
+    of the others. Tasks beyond max_waiting start waiting as earlier ones complete.
+    """
+    def __init__(self,
+                 logger,
+                 client_backend: ClientBackendInterface,
+                 polling_interval_sec: int = 5,
+                 timeout_sec: int = 500,
+                 polling: PollingStrategy = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 result_cache: DiskCache = None,
+                 wait_mode: str = "poll",
+                 upload_mode: str = "single",
+                 max_waiting: int = DEFAULT_MAX_WAITING,
+                 ):
+        if upload_mode not in UPLOAD_MODES:
+            raise ValueError("Upload mode must be one of {}. Got {}".format(UPLOAD_MODES, upload_mode))
+        if wait_mode not in WAIT_MODES:
+            raise ValueError("Wait mode must be one of {}. Got {}".format(WAIT_MODES, wait_mode))
+
+        self.logger = logger
+        self.task_endpoint = "/api/tasks/"
+        self.client_backend = client_backend
+        self.polling = polling or PollingStrategy(interval_sec=polling_interval_sec, timeout_sec=timeout_sec)
+        self.max_concurrency = max_concurrency
+        self.result_cache = result_cache  # Output zips of completed tasks by UID. None to always download
+        self.wait_mode = wait_mode  # "poll", "long_poll", "sse" or "auto". See task_waiting.py
+        self.upload_mode = upload_mode  # "single" or "chunked". See chunked_upload.py
+        self.__executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="AsyncInferenceClient")
+        self.__wait_executor = ThreadPoolExecutor(max_workers=max(1, max_waiting),
+                                                  thread_name_prefix="AsyncInferenceClient-wait")
+
+    def close(self) -> None:
+        self.__executor.shutdown(wait=False)
+        self.__wait_executor.shutdown(wait=False)
+
+    async def __run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, functools.partial(fn, *args, **kwargs))
+
+    def __post_zip(self, zip_file, model_human_readable_id: str) -> str:
+        if self.upload_mode == "chunked":
+            uid = ChunkedUpload(client_backend=self.client_backend, logger=self.logger).post(zip_file,
+                                                                                            model_human_readable_id)
+            if uid is not None:
+                return uid
+            zip_file.seek(0)
+
+        res = self.client_backend.post(endpoint=self.task_endpoint,
+                                       params={"model_human_readable_id": model_human_readable_id},
+                                       files={"zip_file": zip_file})
+        self.logger.info(res)
+        self.logger.info(str(res.content))
+        if res.ok:
+            return str(json.loads(res.content))
+        else:
+            raise HTTPException
+
+    def __post_from_start(self, zip_file, model_human_readable_id: str) -> str:
+        zip_file.seek(0)
+        return self.__post_zip(zip_file, model_human_readable_id)
+
+    def __post_task(self, task: TaskInput, model_human_readable_id: str) -> str:
+        with task.get_input_zip() as zip:
+            return self.__post_zip(zip, model_human_readable_id)
+
+    async def post_task(self, task: TaskInput) -> str:
+        try:
+            return await self.__run(self.__post_task, task, task.model_human_readable_id)
+
+        except Exception as e:
+            self.logger.error(traceback.format_exc())
+            raise e
+
+    async def post_tasks(self, tasks: List[TaskInput]) -> List[str]:
+        """
+        Posts all tasks concurrently. Returns UIDs in the order of tasks
+        """
+        return list(await asyncio.gather(*[self.post_task(task) for task in tasks]))
+
+    async def post_task_to_models(self, task: TaskInput, model_human_readable_ids: List[str]) -> List[Optional[str]]:
+        """
+        Builds the input zip of task once and posts it to all models. Returns UIDs in the order of
+        model_human_readable_ids, with None for each model the post failed on. See collect_model_posts.
+        Zips within task.spool_max_size are posted to all models concurrently. Larger ones stay on disk and are posted
+        from there to one model after the other. task.model_human_readable_id is ignored
+        """
+        try:
+            zip = await self.__run(task.get_input_zip)
+            try:
+                if await self.__run(zip_fits_in_memory, zip, task.spool_max_size):
+                    zip_bytes = await self.__run(zip.read)
+                    results = await asyncio.gather(*[self.__run(self.__post_zip, io.BytesIO(zip_bytes), model_id)
+                                                     for model_id in model_human_readable_ids],
+                                                   return_exceptions=True)
+                else:
+                    results = []
+                    for model_id in model_human_readable_ids:
+                        try:
+                            results.append(await self.__run(self.__post_from_start, zip, model_id))
+                        except Exception as e:
+                            results.append(e)
+            finally:
+                zip.close()
+            return collect_model_posts(self.logger, model_human_readable_ids, list(results))
+
+        except Exception as e:
+            self.logger.error(traceback.format_exc())
+            raise e
+
+    async def get_task(self, uid: str, crop: CropBox = None) -> TaskOutput:
+        async for _, task_output in self.get_tasks([uid], [crop]):
+            if isinstance(task_output, Exception):
+                raise task_output
+            return task_output
+
+    def __cache_for(self, uid: str) -> Optional[DiskCache]:
+        return self.result_cache if self.result_cache is not None and DiskCache.valid_key(uid) else None
+
+    def __cached_output(self, uid: str, crop: CropBox) -> Optional[TaskOutput]:
+        cache = self.__cache_for(uid)
+        output_zip = cache.get(uid)
+        if output_zip is None:
+            return None
+        try:
+            return TaskOutput(output_zip, crop=crop)
+        except Exception:  # E.g. written by an older version. Downloaded again instead
+            self.logger.info("Output of {} in result cache can not be read".format(uid))
+            self.logger.info(traceback.format_exc())
+            cache.delete(uid)
+            return None
+
+    async def __download(self, uid: str, res, crop: CropBox) -> Tuple[str, Union[TaskOutput, Exception]]:
+        download = ResultDownload(client_backend=self.client_backend,
+                                  endpoint=self.task_endpoint + uid,
+                                  logger=self.logger,
+                                  cache=self.__cache_for(uid),
+                                  cache_key=uid)
+        try:
+            return uid, await self.__run(download.run, res, crop=crop)
+        except Exception as e:
+            return uid, e
+
+    async def __wait(self, uid: str, polling: PollingStrategy) -> Tuple[str, Optional[Exception]]:
+        # Returns once uid is done, or its server supports none of the wait modes, i.e. it is polled instead
+        waiter = TaskWaiter(client_backend=self.client_backend,
+                            task_endpoint=self.task_endpoint,
+                            logger=self.logger,
+                            mode=self.wait_mode)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.__wait_executor, waiter.wait, uid, polling)
+            return uid, None
+        except Exception as e:
+            return uid, e
+
+    def __poll(self, uid: str):
+        res = self.client_backend.get(endpoint=self.task_endpoint + uid, stream=True)
+        if not res.ok:
+            res.content  # Reads the short error body, so the connection goes back to the pool for the next poll
+            res.close()
+        return res
+
+    async def get_tasks(self,
+                        uids: List[str],
+                        crops: List[CropBox] = None) -> AsyncIterator[Tuple[str, Union[TaskOutput, Exception]]]:
+        """
+        Polls for the outputs of uids (with the crop of the input of each, if any) and yields (uid, TaskOutput) in the
+        order the outputs become ready. A task which failed or was not done before its deadline yields
+        (uid, exception) instead, so one bad task does not end the batch
+        Outputs in the result_cache are yielded first, without any request
+        Unless wait_mode is "poll", each task is only polled once it is done by long-poll or server-sent events, or
+        its server supports neither
+        """
+        crops = crops or [None] * len(uids)
+        crop_of: Dict[str, CropBox] = dict(zip(uids, crops))
+        pollings = {uid: self.polling.start() for uid in uids}
+        clock = self.polling.clock
+        due = {uid: clock() for uid in uids}  # When each outstanding UID is polled next
+        downloads = set()
+
+        for uid in [uid for uid in uids if self.__cache_for(uid) is not None]:
+            try:
+                task_output = await self.__run(self.__cached_output, uid, crop_of[uid])
+            except Exception as e:
+                task_output = e
+            if task_output is not None:
+                del due[uid]
+                yield uid, task_output
+        if self.result_cache is not None:
+            log_result_cache(self.logger, self.result_cache)
+
+        waiting = set()
+        if self.wait_mode != "poll":
+            waiting = {asyncio.ensure_future(self.__wait(uid, pollings[uid])) for uid in due}
+            due = {}
+
+        while due or downloads or waiting:
+            now = clock()
+            polled = [uid for uid, when in due.items() if when <= now]
+            responses = await asyncio.gather(*[self.__run(self.__poll, uid) for uid in polled], return_exceptions=True)
+            for uid, res in zip(polled, responses):
+                del due[uid]
+                if isinstance(res, Exception):
+                    yield uid, res
+                elif res.ok:
+                    downloads.add(asyncio.ensure_future(self.__download(uid, res, crop_of[uid])))
+                else:
+                    if res.status_code == 500:
+                        yield uid, InferenceServerError()
+                    elif res.status_code == 552:
+                        yield uid, JobExecError()
+                    elif pollings[uid].remaining() <= 0:
+                        yield uid, TimeoutError()
+                    else:
+                        due[uid] = clock() + pollings[uid].next_delay(res.headers)
+            if polled:
+                self.logger.info("... Polled {} tasks. {} pending, {} downloading".format(len(polled), len(due),
+                                                                                         len(downloads)))
+
+            # Sleep until the next poll is due, unless an output finishes downloading or a task completes first
+            timeout = max(0.0, min(due.values()) - clock()) if due else None
+            if downloads or waiting:
+                done, _ = await asyncio.wait(downloads | waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future in downloads:
+                        downloads.remove(future)
+                        yield future.result()
+                        continue
+                    waiting.remove(future)
+                    uid, error = future.result()
+                    if error is not None:
+                        yield uid, error
+                    else:
+                        due[uid] = clock()  # Done (or not supported), so its output is fetched right away
+            elif timeout:
+                await asyncio.sleep(timeout)
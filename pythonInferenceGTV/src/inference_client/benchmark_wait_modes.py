@@ -0,0 +1,56 @@
+import io
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import zipfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend import ClientBackend
+from inference_client.inference_client import InferenceClient
+from inference_client.polling import PollingStrategy
+from testing.stand_in_server import StandInInferenceServer
+
+"""
+Measures the time from completion of a task on the stand-in server until get_task has returned its output, for polling
+and the wait modes. Run from src with: python -m inference_client.benchmark_wait_modes
+"""
+
+POLLING_INTERVAL_SEC = 2.0
+REPEATS = 5
+
+
+def make_output_zip() -> bytes:
+    # No predictions. Only the arrival of the output matters here
+    buffer = io.BytesIO()
+    zipfile.ZipFile(buffer, "w").close()
+    return buffer.getvalue()
+
+
+def completion_latency(server: StandInInferenceServer, wait_mode: str, uid: str) -> float:
+    client = InferenceClient(logger=logging.getLogger(__file__),
+                             client_backend=ClientBackend(server.base_url),
+                             polling=PollingStrategy(interval_sec=POLLING_INTERVAL_SEC, timeout_sec=60),
+                             wait_mode=wait_mode)
+    # Complete at a random point of the polling interval
+    threading.Timer(1 + random.uniform(0, POLLING_INTERVAL_SEC), server.add_task, args=(uid, make_output_zip())).start()
+    client.get_task(uid)
+    return time.monotonic() - server.completed_at[uid]
+
+
+def main():
+    print("{:>10} {:>16} {:>10}".format("mode", "mean latency [s]", "requests"))
+    with StandInInferenceServer() as server:
+        for wait_mode in ["poll", "long_poll", "sse"]:
+            n_requests = len(server.requests)
+            latencies = [completion_latency(server, wait_mode, "{}_{}".format(wait_mode, i)) for i in range(REPEATS)]
+            print("{:>10} {:>16.3f} {:>10.1f}".format(wait_mode,
+                                                     sum(latencies) / REPEATS,
+                                                     (len(server.requests) - n_requests) / REPEATS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+import time
+import traceback
+from typing import BinaryIO, Optional, Set, Tuple
+
+import os
+import sys
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend_interface import ClientBackendInterface
+from inference_client.exceptions import UploadError
+
+"""
+Uploads an input zip in chunks, so a dropped connection only costs the chunk in flight:
+- POST {upload_endpoint}?model_human_readable_id=<id>&size=<bytes>&sha256=<hex> starts an upload. Answers
+  {"upload_id": <id>}
+- POST {upload_endpoint}{upload_id}?offset=<bytes> with a chunk as body and its sha256 in X-Chunk-Sha256. Answers
+  {"offset": <bytes received>}. A chunk not starting at the received offset is answered with 409, a chunk not matching
+  its checksum with 422. Both carry the received offset as well
+- GET {upload_endpoint}{upload_id} answers {"offset": <bytes received>}
+- POST {upload_endpoint}{upload_id}/finalize checks size and sha256 of the whole zip and answers the UID of the task,
+  like a POST to the task endpoint
+After a failed chunk, the received offset is queried and the upload resumes from there.
+A server answering 404, 405 or 501 to the start lacks the endpoints. This is remembered for the rest of the process.
+"""
+
+UPLOAD_MODES = ["single", "chunked"]
+UPLOAD_ENDPOINT = "/api/uploads/"
+DEFAULT_CHUNK_SIZE = 8 * 1024 ** 2
+DEFAULT_MAX_RETRIES = 5  # Failed chunks in a row
+DEFAULT_RETRY_BACKOFF_SEC = 0.5
+CHUNK_SHA256_HEADER = "X-Chunk-Sha256"
+UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+
+# base_url of the servers found to lack chunked uploads
+_unsupported_servers: Set[str] = set()
+_unsupported_servers_lock = threading.Lock()
+
+
+def file_size_and_sha256(fileobj: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[int, str]:
+    fileobj.seek(0)
+    sha256, size = hashlib.sha256(), 0
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        sha256.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return size, sha256.hexdigest()
+
+
+class ChunkedUpload:
+    """
+    Posts an input zip by the chunked upload protocol above. Each chunk is retried up to max_retries times, waiting
+    retry_backoff_sec, doubled after every further failure
+    """
+    def __init__(self,
+                 client_backend: ClientBackendInterface,
+                 logger,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 retry_backoff_sec: float = DEFAULT_RETRY_BACKOFF_SEC) -> None:
+        self.client_backend = client_backend
+        self.logger = logger
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.retry_backoff_sec = retry_backoff_sec
+        self.resumes = 0  # Number of times the last post() queried the offset to resume
+
+    def __key(self) -> str:
+        return getattr(self.client_backend, "base_url", None)
+
+    def post(self, zip_file: BinaryIO, model_human_readable_id: str) -> Optional[str]:
+        """
+        Uploads zip_file and returns the UID of the task, or None if the server lacks the endpoints, i.e. post it in
+        one request instead. Raises UploadError if a chunk still fails after max_retries
+        """
+        with _unsupported_servers_lock:
+            if self.__key() in _unsupported_servers:
+                return None
+
+        size, sha256 = file_size_and_sha256(zip_file, self.chunk_size)
+        res = self.client_backend.post(endpoint=UPLOAD_ENDPOINT,
+                                       params={"model_human_readable_id": model_human_readable_id,
+                                               "size": size,
+                                               "sha256": sha256})
+        if res.status_code in UNSUPPORTED_STATUS_CODES:
+            self.logger.info("Server does not support chunked uploads")
+            with _unsupported_servers_lock:
+                _unsupported_servers.add(self.__key())
+            return None
+        if not res.ok:
+            raise UploadError("Could not start upload: {} {}".format(res.status_code, res.content))
+        upload_id = str(json.loads(res.content)["upload_id"])
+
+        self.resumes = 0
+        offset = self.__send_chunks(zip_file, upload_id, size)
+        self.logger.info("Uploaded {} bytes as {} with {} resumes".format(offset, upload_id, self.resumes))
+
+        res = self.client_backend.post(endpoint=UPLOAD_ENDPOINT + upload_id + "/finalize", params=None)
+        if not res.ok:
+            raise UploadError("Could not finalize upload {}: {} {}".format(upload_id, res.status_code, res.content))
+        return str(json.loads(res.content))
+
+    def __send_chunks(self, zip_file: BinaryIO, upload_id: str, size: int) -> int:
+        offset, failures = 0, 0
+        while offset < size:
+            zip_file.seek(offset)
+            chunk = zip_file.read(self.chunk_size)
+            try:
+                res = self.client_backend.post(endpoint=UPLOAD_ENDPOINT + upload_id,
+                                               params={"offset": offset},
+                                               data=chunk,
+                                               headers={CHUNK_SHA256_HEADER: hashlib.sha256(chunk).hexdigest()})
+                if res.ok:
+                    received = int(json.loads(res.content)["offset"])
+                    failures = 0 if received > offset else failures + 1
+                    offset = received
+                    continue
+                error = "{} {}".format(res.status_code, res.content)
+            except requests.exceptions.RequestException as e:
+                error = repr(e)
+
+            failures += 1
+            if failures > self.max_retries:
+                raise UploadError("Chunk at {} of upload {} failed {} times: {}".format(offset, upload_id, failures,
+                                                                                       error))
+            self.logger.info("Chunk at {} of upload {} failed: {}".format(offset, upload_id, error))
+            time.sleep(self.retry_backoff_sec * 2 ** (failures - 1))
+            offset = self.__received_offset(upload_id, offset)
+            self.resumes += 1
+        return offset
+
+    def __received_offset(self, upload_id: str, offset: int) -> int:
+        # Where to resume. The last known offset, if the server cannot be asked either
+        try:
+            res = self.client_backend.get(endpoint=UPLOAD_ENDPOINT + upload_id)
+            if res.ok:
+                return int(json.loads(res.content)["offset"])
+        except requests.exceptions.RequestException:
+            self.logger.info(traceback.format_exc())
+        return offset
@@ -2,4 +2,10 @@ class InferenceServerError(Exception):
     pass
 
 class JobExecError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ChecksumError(Exception):
+    pass
+
+class UploadError(Exception):
+    pass
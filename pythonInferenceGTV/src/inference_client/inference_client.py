@@ -1,6 +1,8 @@
+import io
 import json
-import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
 
 import os
 import sys
@@ -9,59 +11,204 @@ from http.client import HTTPException
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from task_input.task_input import TaskInput
+from cropping.cropping import CropBox
+from disk_cache.disk_cache import DiskCache
 from task_output.task_output import TaskOutput
 from inference_client.exceptions import InferenceServerError, JobExecError
+from inference_client.polling import PollingStrategy
+from inference_client.result_download import ResultDownload, log_result_cache
+from inference_client.task_waiting import TaskWaiter
+from inference_client.chunked_upload import ChunkedUpload, UPLOAD_MODES
 from client_backend.client_backend_interface import ClientBackendInterface
 from .inference_client_interface import InferenceClientInterface
 
 
+def collect_model_posts(logger, model_human_readable_ids: List[str],
+                        results: List[Union[str, Exception]]) -> List[Optional[str]]:
+    """
+    Turns the results of posting one task to several models into their UIDs, with None for each model whose post
+    failed. Failures are logged per model, along with the UIDs of the tasks created on the other models, so these can
+    still be fetched. Raises the first error if every post failed
+    """
+    uids = [None if isinstance(result, Exception) else result for result in results]
+    errors = [(model_id, result) for model_id, result in zip(model_human_readable_ids, results)
+              if isinstance(result, Exception)]
+    if not errors:
+        return uids
+
+    for model_id, error in errors:
+        logger.error("Posting to {} failed: {!r}".format(model_id, error))
+    if all(uid is None for uid in uids):
+        raise errors[0][1]
+    logger.error("Tasks were still created on the other models: " +
+                 ", ".join("{}: {}".format(model_id, uid)
+                           for model_id, uid in zip(model_human_readable_ids, uids) if uid is not None))
+    return uids
+
+
+def zip_fits_in_memory(zip_file, spool_max_size: int) -> bool:
+    """
+    True if the input zip of a TaskInput with spool_max_size is still held in RAM, i.e. it can be read into bytes and
+    posted to several models at once. Zips rolled over to disk are posted from the file itself, one model at a time
+    """
+    zip_file.seek(0, io.SEEK_END)
+    size = zip_file.tell()  # SpooledTemporaryFile.seek returns None before Python 3.11
+    zip_file.seek(0)
+    return size <= spool_max_size
+
+
 class InferenceClient(InferenceClientInterface):
     def __init__(self,
                  logger,
                  client_backend: ClientBackendInterface,
                  polling_interval_sec: int = 5,
                  timeout_sec: int = 500,
+                 polling: PollingStrategy = None,
+                 wait_mode: str = "poll",
+                 upload_mode: str = "single",
+                 result_cache: DiskCache = None,
                  ):
+        if upload_mode not in UPLOAD_MODES:
+            raise ValueError("Upload mode must be one of {}. Got {}".format(UPLOAD_MODES, upload_mode))
 
         self.logger = logger
         self.task_endpoint = "/api/tasks/"
+        self.capabilities_endpoint = "/api/capabilities/"
         self.client_backend = client_backend
         self.polling_interval_sec = polling_interval_sec
         self.timeout_sec = timeout_sec
+        # When to poll in get_task. Replaces polling_interval_sec and timeout_sec if given
+        self.polling = polling or PollingStrategy(interval_sec=polling_interval_sec, timeout_sec=timeout_sec)
+        self.wait_mode = wait_mode  # "poll", "long_poll", "sse" or "auto". See task_waiting.py
+        self.upload_mode = upload_mode  # "single" or "chunked". See chunked_upload.py
+        self.result_cache = result_cache  # Output zips of completed tasks by UID. None to always download
+
+    def get_supported_input_codecs(self) -> List[str]:
+        """
+        Asks the server which codecs it accepts for input volumes. Servers without the endpoint only get gzip
+        """
+        try:
+            res = self.client_backend.get(endpoint=self.capabilities_endpoint)
+            if res.ok:
+                return list(json.loads(res.content).get("input_codecs", ["gzip"]))
+        except Exception:
+            self.logger.info("Could not get server capabilities. Falling back to gzip")
+            self.logger.info(traceback.format_exc())
+        return ["gzip"]
+
+    def post_input_zip(self, zip_file, model_human_readable_id: str) -> str:
+        """
+        Posts an input zip built by TaskInput.get_input_zip to the model. Returns the UID of the task
+        With upload_mode "chunked", the zip is uploaded in resumable chunks if the server supports it
+        """
+        if self.upload_mode == "chunked":
+            uid = ChunkedUpload(client_backend=self.client_backend, logger=self.logger).post(zip_file,
+                                                                                            model_human_readable_id)
+            if uid is not None:
+                return uid
+            zip_file.seek(0)
+
+        params = {"model_human_readable_id": model_human_readable_id}
+        files = {"zip_file": zip_file}
+
+        res = self.client_backend.post(endpoint=self.task_endpoint,
+                                       params=params,
+                                       files=files)
+        self.logger.info(res)
+        self.logger.info(str(res.content))
+        if res.ok:
+            return str(json.loads(res.content))
+        else:
+            raise HTTPException
 
     def post_task(self, task: TaskInput) -> str:
         try:
             with task.get_input_zip() as zip:  # zip is opened and automatically closed
-                params = {"model_human_readable_id": task.model_human_readable_id}
-                files = {"zip_file": zip}
-
-                res = self.client_backend.post(endpoint=self.task_endpoint,
-                                               params=params,
-                                               files=files)
-                self.logger.info(res)
-                self.logger.info(str(res.content))
-                if res.ok:
-                    return str(json.loads(res.content))
+                return self.post_input_zip(zip, task.model_human_readable_id)
+
+        except Exception as e:
+            self.logger.error(traceback.format_exc())
+            raise e
+
+    def post_task_to_models(self, task: TaskInput, model_human_readable_ids: List[str]) -> List[Optional[str]]:
+        """
+        Builds the input zip of task once and posts it to all models. Returns UIDs in the order of
+        model_human_readable_ids, with None for each model the post failed on. See collect_model_posts.
+        Zips within task.spool_max_size are posted to all models concurrently. Larger ones stay on disk and are posted
+        from there to one model after the other. task.model_human_readable_id is ignored
+        """
+        try:
+            with task.get_input_zip() as zip:
+                if zip_fits_in_memory(zip, task.spool_max_size):
+                    zip_bytes = zip.read()
+                    with ThreadPoolExecutor(max_workers=max(1, len(model_human_readable_ids))) as pool:
+                        futures = [pool.submit(self.post_input_zip, io.BytesIO(zip_bytes), model_id)
+                                   for model_id in model_human_readable_ids]
+                        results = [self.__result(future.result) for future in futures]
                 else:
-                    raise HTTPException
+                    results = [self.__result(self.__post_from_start, zip, model_id)
+                               for model_id in model_human_readable_ids]
+            return collect_model_posts(self.logger, model_human_readable_ids, results)
 
         except Exception as e:
             self.logger.error(traceback.format_exc())
             raise e
 
-    def get_task(self, uid: str) -> TaskOutput:
-        counter = 0
-        while counter < self.timeout_sec:
-            res = self.client_backend.get(endpoint=self.task_endpoint + uid)
+    def __post_from_start(self, zip_file, model_human_readable_id: str) -> str:
+        zip_file.seek(0)
+        return self.post_input_zip(zip_file, model_human_readable_id)
+
+    def __result(self, fn, *args) -> Union[str, Exception]:
+        # The UID returned by fn, or the exception it raised
+        try:
+            return fn(*args)
+        except Exception as e:
+            self.logger.error(traceback.format_exc())
+            return e
+
+    def get_task(self, uid: str, crop: CropBox = None) -> TaskOutput:
+        """
+        Polls for the output of uid as set by self.polling, until its deadline. The output is streamed and decoded
+        while it downloads, and resumed if the connection drops. See ResultDownload
+        Unless wait_mode is "poll", completion is awaited by long-poll or server-sent events first, if the server
+        supports it, so the output is fetched right when it is ready
+        Outputs in the result_cache are served from there without any request
+        """
+        cache = self.result_cache if self.result_cache is not None and DiskCache.valid_key(uid) else None
+        if cache is not None:
+            output_zip = cache.get(uid)
+            log_result_cache(self.logger, cache)
+            if output_zip is not None:
+                try:
+                    task_output = TaskOutput(output_zip, crop=crop)
+                    self.logger.info("Output of {} found in result cache".format(uid))
+                    return task_output
+                except Exception:  # E.g. written by an older version. Downloaded again below
+                    self.logger.info("Output of {} in result cache can not be read".format(uid))
+                    self.logger.info(traceback.format_exc())
+                    cache.delete(uid)
+
+        polling = self.polling.start()
+        endpoint = self.task_endpoint + uid
+        if self.wait_mode != "poll":
+            TaskWaiter(client_backend=self.client_backend,
+                       task_endpoint=self.task_endpoint,
+                       logger=self.logger,
+                       mode=self.wait_mode).wait(uid, polling)
+        while True:
+            res = self.client_backend.get(endpoint=endpoint, stream=True)
             if res.ok:
-                return TaskOutput(res.content)
-            elif res.status_code == 500:
+                return ResultDownload(client_backend=self.client_backend,
+                                      endpoint=endpoint,
+                                      logger=self.logger,
+                                      cache=cache,
+                                      cache_key=uid).run(res, crop=crop)
+
+            res.close()
+            if res.status_code == 500:
                 raise InferenceServerError
             elif res.status_code == 552:
                 raise JobExecError
-            else:
-                time.sleep(self.polling_interval_sec)
-                counter += self.polling_interval_sec
-                self.logger.info("... Waited for {} seconds".format(counter))
-        else:
-            raise TimeoutError
+            elif not polling.wait(res.headers):
+                raise TimeoutError
+            self.logger.info("... Waited for {:.1f} seconds".format(polling.elapsed()))
@@ -1,10 +1,12 @@
 from abc import abstractmethod
 import os
 import sys
+from typing import AsyncIterator, List, Optional, Tuple, Union
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from task_input.task_input import TaskInput
+from cropping.cropping import CropBox
 from task_output.task_output import TaskOutput
 
 
@@ -13,6 +15,34 @@ class InferenceClientInterface:
     def post_task(self, task: TaskInput) -> str:
         pass
     
+    @abstractmethod
+    def post_task_to_models(self, task: TaskInput, model_human_readable_ids: List[str]) -> List[Optional[str]]:
+        pass
+
     @abstractmethod        
-    def get_task(self, uid: str) -> TaskOutput:
-        pass
\ No newline at end of file
+    def get_task(self, uid: str, crop: CropBox = None) -> TaskOutput:
+        pass
+
+
+class AsyncInferenceClientInterface:
+    """
+    asyncio counterpart of InferenceClientInterface. The methods are coroutines, and get_tasks yields the outputs of
+    several UIDs as they become ready
+    """
+    @abstractmethod
+    async def post_task(self, task: TaskInput) -> str:
+        pass
+
+    @abstractmethod
+    async def post_task_to_models(self, task: TaskInput, model_human_readable_ids: List[str]) -> List[Optional[str]]:
+        pass
+
+    @abstractmethod
+    async def get_task(self, uid: str, crop: CropBox = None) -> TaskOutput:
+        pass
+
+    @abstractmethod
+    def get_tasks(self,
+                  uids: List[str],
+                  crops: List[CropBox] = None) -> AsyncIterator[Tuple[str, Union[TaskOutput, Exception]]]:
+        pass
@@ -0,0 +1,121 @@
+import copy
+import datetime
+import email.utils
+import random
+import time
+from typing import Callable, Mapping, Optional
+
+"""
+When to poll the inference server for the output of a task. Besides the fixed interval, the server may steer polling
+with these response headers:
+- Retry-After: seconds or an HTTP date. The next poll is made then
+- X-Task-ETA-Sec: seconds until the task is expected to finish. Polling pauses until shortly before and is fast around it
+- X-Queue-Position: tasks ahead of this one. Polling slows down with the length of the queue
+"""
+
+RETRY_AFTER_HEADER = "Retry-After"
+ETA_HEADER = "X-Task-ETA-Sec"
+QUEUE_POSITION_HEADER = "X-Queue-Position"
+
+DEFAULT_FAST_INTERVAL_SEC = 0.5  # Interval around the expected completion time
+DEFAULT_ETA_LEAD_SEC = 2.0  # Fast polling starts this long before the expected completion time
+DEFAULT_JITTER = 0.1  # Relative random spread of each delay, so several clients do not poll in lockstep
+
+
+def _header_seconds(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    if name != RETRY_AFTER_HEADER:
+        return None
+    try:  # Retry-After may also be an HTTP date
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when is None:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class PollingStrategy:
+    """
+    Delays between polls for one task, within a deadline of timeout_sec on the monotonic clock from start().
+    Without hints from the server, the delay starts at interval_sec and grows by backoff after every poll up to
+    max_interval_sec (backoff 1 polls at a fixed interval). Every delay is spread by +-jitter and cut at the deadline.
+    A strategy is a template: start() returns a started copy for one task, so one strategy can serve concurrent polls
+    """
+    def __init__(self,
+                 interval_sec: float = 5,
+                 timeout_sec: float = 500,
+                 backoff: float = 1.0,
+                 max_interval_sec: float = None,
+                 jitter: float = DEFAULT_JITTER,
+                 fast_interval_sec: float = DEFAULT_FAST_INTERVAL_SEC,
+                 eta_lead_sec: float = DEFAULT_ETA_LEAD_SEC,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.interval_sec = float(interval_sec)
+        self.timeout_sec = float(timeout_sec)
+        self.backoff = max(1.0, float(backoff))
+        self.max_interval_sec = float(max_interval_sec) if max_interval_sec is not None else max(self.interval_sec, 60.0)
+        self.jitter = min(max(0.0, float(jitter)), 1.0)
+        self.fast_interval_sec = min(float(fast_interval_sec), self.interval_sec)
+        self.eta_lead_sec = float(eta_lead_sec)
+        self.clock = clock
+        self.sleep = sleep
+
+        self.started = None
+        self.polls = 0
+
+    def start(self) -> "PollingStrategy":
+        polling = copy.copy(self)
+        polling.started = self.clock()
+        polling.polls = 0
+        return polling
+
+    def elapsed(self) -> float:
+        return self.clock() - self.started
+
+    def remaining(self) -> float:
+        return self.timeout_sec - self.elapsed()
+
+    def next_delay(self, headers: Mapping[str, str] = None) -> float:
+        """
+        Seconds to wait before the next poll, given the headers of the last response
+        """
+        headers = headers or {}
+        base = min(self.interval_sec * self.backoff ** self.polls, self.max_interval_sec)
+        self.polls += 1
+
+        retry_after = _header_seconds(headers, RETRY_AFTER_HEADER)
+        eta = _header_seconds(headers, ETA_HEADER)
+        queue_position = _header_seconds(headers, QUEUE_POSITION_HEADER)
+        if retry_after is not None:
+            return min(retry_after, self.remaining())  # The server knows best. No jitter
+        if eta is not None:
+            if eta > self.eta_lead_sec:
+                delay = min(eta - self.eta_lead_sec, self.max_interval_sec)
+            else:
+                delay = self.fast_interval_sec
+        elif queue_position is not None:
+            delay = min(base * (1 + queue_position), self.max_interval_sec)
+        else:
+            delay = base
+
+        delay *= 1 + self.jitter * (2 * random.random() - 1)
+        return max(0.0, min(delay, self.remaining()))
+
+    def wait(self, headers: Mapping[str, str] = None) -> bool:
+        """
+        Sleeps until the next poll. Returns False without sleeping if the deadline has passed
+        """
+        if self.remaining() <= 0:
+            return False
+        self.sleep(self.next_delay(headers))
+        return True
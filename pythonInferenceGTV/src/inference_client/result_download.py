@@ -0,0 +1,174 @@
+import base64
+import binascii
+import hashlib
+import re
+import tempfile
+import traceback
+from http.client import HTTPException
+from typing import Any, Dict, Optional
+
+import os
+import sys
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend_interface import ClientBackendInterface
+from cropping.cropping import CropBox
+from disk_cache.disk_cache import DiskCache
+from inference_client.exceptions import ChecksumError
+from task_output.streaming_zip import StreamingZipReader
+from task_output.task_output import TaskOutput, decode_output_member
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_SPOOL_MAX_SIZE = 512 * 1024 * 1024  # Bytes of the result kept in RAM before spilling to a temporary file
+DEFAULT_MAX_RESUMES = 5
+
+
+def log_result_cache(logger, cache: DiskCache) -> None:
+    logger.info("Result cache: {} hits, {} misses ({:.0%} hit rate), {:.1f} MB saved".format(
+        cache.hits, cache.misses, cache.hit_rate(), cache.hit_bytes / 1024 ** 2))
+
+
+def expected_sha256(headers) -> Optional[str]:
+    """
+    The sha256 of the body announced by the server as hex, from "Digest: sha-256=<base64>" or
+    "X-Checksum-Sha256: <hex>". None if there is none
+    """
+    digest = headers.get("Digest")
+    if digest:
+        match = re.search(r"sha-256=([A-Za-z0-9+/=]+)", digest, flags=re.IGNORECASE)
+        if match:
+            try:
+                return binascii.hexlify(base64.b64decode(match.group(1))).decode()
+            except binascii.Error:
+                pass
+    checksum = headers.get("X-Checksum-Sha256")
+    return checksum.strip().lower() if checksum else None
+
+
+class ResultDownload:
+    """
+    Streams the output zip of a task into a spooled file. Members are decoded as soon as their bytes have arrived.
+    A dropped connection is resumed with a Range request from the last byte received. If the server ignores the Range
+    header, or the body has a Content-Encoding (so the bytes received do not give the offset in it), the download
+    starts over. The body is checked against the sha256 the server announces, if any.
+    If a cache is given, the body is stored in it under cache_key once it is complete, checked and decoded
+    """
+    def __init__(self,
+                 client_backend: ClientBackendInterface,
+                 endpoint: str,
+                 logger,
+                 max_resumes: int = DEFAULT_MAX_RESUMES,
+                 chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 spool_max_size: int = DOWNLOAD_SPOOL_MAX_SIZE,
+                 cache: DiskCache = None,
+                 cache_key: str = None) -> None:
+        self.client_backend = client_backend
+        self.endpoint = endpoint
+        self.logger = logger
+        self.max_resumes = max_resumes
+        self.chunk_size = chunk_size
+        self.spool_max_size = spool_max_size
+        self.cache = cache
+        self.cache_key = cache_key
+        self.resumes = 0  # Number of Range requests made by the last run()
+
+        self.__spool = None
+        self.__sha256 = None
+        self.__reader = None
+        self.__members: Dict[str, Any] = {}
+        self.__offset = 0
+        self.__total = None
+        self.__encoded = False
+        self.__expected_sha256 = None
+
+    def __start(self, res: requests.Response) -> None:
+        # (Re)starts from the first byte of the body of res
+        self.__spool.seek(0)
+        self.__spool.truncate()
+        self.__sha256 = hashlib.sha256()
+        self.__reader = StreamingZipReader()
+        self.__members = {}
+        self.__offset = 0
+        length = res.headers.get("Content-Length")
+        # Length and offsets are of the encoded body then, while the decoded bytes are counted
+        self.__encoded = res.headers.get("Content-Encoding", "identity") != "identity"
+        self.__total = int(length) if length is not None and not self.__encoded else None
+        self.__expected_sha256 = expected_sha256(res.headers)
+
+    def __consume(self, chunk: bytes) -> None:
+        self.__spool.write(chunk)
+        self.__sha256.update(chunk)
+        self.__offset += len(chunk)
+        for name, data in self.__reader.feed(chunk):
+            try:
+                self.__members[name] = decode_output_member(name, data)
+            except Exception as e:  # Raised by TaskOutput when the member is used, like for a zip read at once
+                self.__members[name] = e
+
+    def __resume(self) -> requests.Response:
+        headers = None if self.__encoded else {"Range": "bytes={}-".format(self.__offset)}
+        res = self.client_backend.get(endpoint=self.endpoint, stream=True, headers=headers)
+        content_range = res.headers.get("Content-Range", "")
+        if headers is not None and res.status_code == 206 and \
+                content_range.startswith("bytes {}-".format(self.__offset)):
+            self.logger.info("Resuming download of {} at byte {}".format(self.endpoint, self.__offset))
+        elif res.status_code == 200:
+            if headers is None:
+                self.logger.info("Body is encoded. Restarting download of {}".format(self.endpoint))
+            else:
+                self.logger.info("Server ignored the Range request. Restarting download of {}".format(self.endpoint))
+            self.__start(res)
+        else:
+            res.close()
+            raise HTTPException("Could not resume download of {}: {}".format(self.endpoint, res.status_code))
+        return res
+
+    def run(self, res: requests.Response, crop: CropBox = None) -> TaskOutput:
+        """
+        Downloads the body of res, an ok response of a get with stream=True, and returns it as TaskOutput
+        """
+        self.resumes = 0
+        self.__spool = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)
+        try:
+            self.__start(res)
+            while True:
+                try:
+                    for chunk in res.iter_content(chunk_size=self.chunk_size):
+                        self.__consume(chunk)
+                    res.close()
+                    if self.__total is None or self.__offset >= self.__total:
+                        break
+                    raise requests.exceptions.ChunkedEncodingError(
+                        "Connection closed after {} of {} bytes".format(self.__offset, self.__total))
+                except requests.exceptions.RequestException:
+                    res.close()
+                    if self.resumes >= self.max_resumes:
+                        raise
+                    self.logger.info(traceback.format_exc())
+                    self.resumes += 1
+                    res = self.__resume()
+
+            digest = self.__sha256.hexdigest()
+            if self.__expected_sha256 is not None and digest != self.__expected_sha256:
+                raise ChecksumError("sha256 of {} is {}. Expected {}".format(self.endpoint, digest,
+                                                                             self.__expected_sha256))
+
+            self.__reader.close()
+            if self.__reader.streamable:
+                task_output = TaskOutput(members=self.__members, crop=crop)
+            else:
+                # Members the stream reader can not handle. Fall back to reading the downloaded zip as a whole
+                self.__spool.seek(0)
+                task_output = TaskOutput(self.__spool, crop=crop)
+
+            # Only an archive which was complete and decoded is cached, so a broken one is downloaded again next time
+            if self.cache is not None:
+                self.__spool.seek(0)
+                self.cache.put(self.cache_key, self.__spool.read())
+            return task_output
+        finally:
+            self.__spool.close()
+            self.__members = {}
@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+import traceback
+from typing import Iterable, Iterator, Set, Tuple
+
+import os
+import sys
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend_interface import ClientBackendInterface
+from inference_client.exceptions import InferenceServerError, JobExecError
+from inference_client.polling import PollingStrategy
+
+"""
+Waiting for a task to complete without polling its output:
+- "long_poll": GET {task_endpoint}{uid}/wait?timeout=<sec> is held by the server until the task is done, answering
+  {"status": "done" | "failed"}, or until timeout, answering 204 (or {"status": "pending"})
+- "sse": GET {task_endpoint}{uid}/events streams server-sent events with {"status": ...} as data
+- "auto": long-poll, else server-sent events, else plain polling
+A server answering 404, 405 or 501 (or an event stream of another Content-Type) lacks the endpoint. This is remembered
+for the rest of the process. Other errors fall back to polling for the task at hand only.
+"""
+
+WAIT_MODES = ["poll", "long_poll", "sse", "auto"]
+LONG_POLL_HOLD_SEC = 30.0  # Kept below the read timeout of ClientBackend
+UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# (base_url, mode) of the servers found to lack a wait mode
+_unsupported_modes: Set[Tuple[str, str]] = set()
+_unsupported_modes_lock = threading.Lock()
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def iter_server_sent_events(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (event, data) of a text/event-stream given line by line. Comments are skipped
+    """
+    event, data = "message", []
+    for line in lines:
+        if line == "":
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+
+
+def _status(body) -> str:
+    try:
+        return str(json.loads(body).get("status", "")).lower()
+    except (ValueError, AttributeError):
+        return ""
+
+
+class TaskWaiter:
+    """
+    Blocks until a task is done with one of the wait modes the server supports, so the output can be fetched with a
+    single request right after. The deadline of the given PollingStrategy applies
+    """
+    def __init__(self,
+                 client_backend: ClientBackendInterface,
+                 task_endpoint: str,
+                 logger,
+                 mode: str = "auto",
+                 hold_sec: float = LONG_POLL_HOLD_SEC) -> None:
+        if mode not in WAIT_MODES:
+            raise ValueError("Wait mode must be one of {}. Got {}".format(WAIT_MODES, mode))
+        self.client_backend = client_backend
+        self.task_endpoint = task_endpoint
+        self.logger = logger
+        self.mode = mode
+        self.hold_sec = hold_sec
+
+    def __key(self, mode: str) -> Tuple[str, str]:
+        return getattr(self.client_backend, "base_url", None), mode
+
+    def wait(self, uid: str, polling: PollingStrategy) -> bool:
+        """
+        Returns True once the task is done, or False if the server supports none of the modes, i.e. poll instead.
+        Raises JobExecError if the task failed, InferenceServerError on a server error and TimeoutError at the deadline
+        """
+        modes = ["long_poll", "sse"] if self.mode == "auto" else [m for m in [self.mode] if m != "poll"]
+        for mode in modes:
+            with _unsupported_modes_lock:
+                if self.__key(mode) in _unsupported_modes:
+                    continue
+            try:
+                if mode == "long_poll":
+                    return self.__long_poll(uid, polling)
+                return self.__server_sent_events(uid, polling)
+            except _Unsupported:
+                self.logger.info("Server does not support waiting by {}".format(mode))
+                with _unsupported_modes_lock:
+                    _unsupported_modes.add(self.__key(mode))
+        return False
+
+    @staticmethod
+    def __check(res: requests.Response) -> None:
+        if res.status_code in UNSUPPORTED_STATUS_CODES:
+            res.close()
+            raise _Unsupported
+        if res.status_code == 500:
+            res.close()
+            raise InferenceServerError
+
+    def __long_poll(self, uid: str, polling: PollingStrategy) -> bool:
+        endpoint = "{}{}/wait".format(self.task_endpoint, uid)
+        while True:
+            remaining = polling.remaining()
+            if remaining <= 0:
+                raise TimeoutError
+            hold = min(self.hold_sec, remaining)
+            t0 = time.monotonic()
+            res = self.client_backend.get(endpoint="{}?timeout={:.3f}".format(endpoint, hold))
+            self.__check(res)
+
+            status = _status(res.content) if res.status_code == 200 else ""
+            if status == STATUS_DONE:
+                return True
+            if status == STATUS_FAILED or res.status_code == 552:
+                raise JobExecError
+            if res.status_code not in (200, 204, 408):
+                self.logger.info("Long-poll answered {}. Polling instead".format(res.status_code))
+                return False
+
+            # A server answering before the hold is over gets polled as usual, so it is not hammered
+            if time.monotonic() - t0 < hold / 2 and not polling.wait(res.headers):
+                raise TimeoutError
+
+    def __server_sent_events(self, uid: str, polling: PollingStrategy) -> bool:
+        endpoint = "{}{}/events".format(self.task_endpoint, uid)
+        while True:
+            remaining = polling.remaining()
+            if remaining <= 0:
+                raise TimeoutError
+            t0 = time.monotonic()
+            res = self.client_backend.get(endpoint=endpoint, stream=True, headers={"Accept": "text/event-stream"})
+            self.__check(res)
+            if res.status_code == 552:
+                res.close()
+                raise JobExecError
+            if not res.ok:
+                # Not a sign of a missing endpoint, so the next task may use it again
+                self.logger.info("Event stream answered {}. Polling instead".format(res.status_code))
+                res.close()
+                return False
+            if not res.headers.get("Content-Type", "").startswith("text/event-stream"):
+                res.close()
+                raise _Unsupported
+
+            # The stream blocks until the next event, so it is closed from a timer at the deadline
+            deadline = threading.Timer(remaining, res.close)
+            deadline.daemon = True
+            deadline.start()
+            try:
+                lines = res.iter_lines(chunk_size=1, decode_unicode=True)
+                for event, data in iter_server_sent_events(lines):
+                    status = _status(data)
+                    if status == STATUS_DONE:
+                        return True
+                    if status == STATUS_FAILED:
+                        raise JobExecError
+            except (requests.exceptions.RequestException, ValueError, AttributeError, OSError):
+                # Dropped, or closed at the deadline. Reconnected below if there is time left
+                self.logger.info(traceback.format_exc())
+            finally:
+                deadline.cancel()
+                res.close()
+
+            if time.monotonic() - t0 < 1 and not polling.wait(res.headers):
+                raise TimeoutError
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend import ClientBackend
+from inference_client.async_inference_client import AsyncInferenceClient
+from inference_client.benchmark_wait_modes import make_output_zip
+from inference_client.polling import PollingStrategy
+from inference_client.test_inference_client import FailingModelClientBackend, MockClientBackend
+from task_input.test_task_input import TestTaskInput
+from task_output.task_output import TaskOutput
+from testing.stand_in_server import StandInInferenceServer
+
+
+async def collect(client: AsyncInferenceClient, uids):
+    results = []
+    async for uid, task_output in client.get_tasks(uids):
+        results.append((uid, task_output, time.monotonic()))
+    return results
+
+
+class TestAsyncInferenceClient(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client_backend = MockClientBackend(base_url="jadajada")
+        self.client = AsyncInferenceClient(client_backend=self.client_backend,
+                                           polling=PollingStrategy(interval_sec=0.2, timeout_sec=1),
+                                           logger=logging.getLogger(__name__))
+
+    def tearDown(self) -> None:
+        self.client.close()
+
+    def task_input(self):
+        test_task_input = TestTaskInput()
+        test_task_input.setUp()
+        return test_task_input.test_task_input_no_dicom_info()
+
+    def test_post_tasks(self):
+        tasks = [self.task_input() for _ in range(3)]
+        uids = asyncio.run(self.client.post_tasks(tasks))
+
+        self.assertEqual(len(set(uids)), 3)
+        self.assertEqual(sorted(uids), sorted(task["uid"] for task in self.client_backend.tasks))
+        return uids
+
+    def test_post_task_to_models(self):
+        model_ids = ["GTV", "OAR", "Brain"]
+        uids = asyncio.run(self.client.post_task_to_models(self.task_input(), model_ids))
+
+        tasks = {task["uid"]: task for task in self.client_backend.tasks}
+        self.assertEqual([tasks[uid]["model_human_readable_id"] for uid in uids], model_ids)
+
+    def test_post_task_to_models_from_disk(self):
+        task_input = self.task_input()
+        task_input.spool_max_size = 1  # Rolls the zip over to disk
+        self.client.client_backend = FailingModelClientBackend(base_url="jadajada", failing_models=["OAR"])
+        uids = asyncio.run(self.client.post_task_to_models(task_input, ["GTV", "OAR", "Brain"]))
+
+        self.assertIsNone(uids[1])
+        tasks = {task["uid"]: task for task in self.client.client_backend.tasks}
+        zips = [tasks[uid]["zip_file"].read() for uid in [uids[0], uids[2]]]
+        self.assertEqual(zips[0], zips[1])
+        self.assertGreater(len(zips[0]), 0)
+
+    def test_post_task_to_models_one_fails(self):
+        self.client.client_backend = FailingModelClientBackend(base_url="jadajada", failing_models=["OAR"])
+        uids = asyncio.run(self.client.post_task_to_models(self.task_input(), ["GTV", "OAR", "Brain"]))
+
+        self.assertIsNone(uids[1])
+        tasks = {task["uid"]: task for task in self.client.client_backend.tasks}
+        self.assertEqual([tasks[uid]["model_human_readable_id"] for uid in [uids[0], uids[2]]], ["GTV", "Brain"])
+
+    def test_get_task(self):
+        uid = asyncio.run(self.client.post_task(self.task_input()))
+        self.assertIsInstance(asyncio.run(self.client.get_task(uid)), TaskOutput)
+
+    def test_get_task_TimeoutError(self):
+        self.assertRaises(TimeoutError, asyncio.run, self.client.get_task("This task does not exist"))
+
+    def test_get_tasks_yields_errors_without_ending_the_batch(self):
+        uids = self.test_post_tasks()
+        results = asyncio.run(collect(self.client, uids[:1] + ["This task does not exist"] + uids[1:]))
+
+        outputs = {uid: task_output for uid, task_output, _ in results}
+        self.assertEqual(len(results), 4)
+        self.assertIsInstance(outputs.pop("This task does not exist"), TimeoutError)
+        self.assertEqual(sorted(outputs), sorted(uids))
+        self.assertTrue(all(isinstance(task_output, TaskOutput) for task_output in outputs.values()))
+
+
+class TestAsyncInferenceClientConcurrency(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = StandInInferenceServer().start()
+        self.client = AsyncInferenceClient(client_backend=ClientBackend(self.server.base_url),
+                                           polling=PollingStrategy(interval_sec=0.25, timeout_sec=10, jitter=0),
+                                           logger=logging.getLogger(__name__))
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.stop()
+
+    def test_batch_takes_as_long_as_the_slowest_task(self):
+        # 20 tasks finishing one after another over 2 seconds, polled in one loop
+        uids = ["uid_{}".format(i) for i in range(20)]
+        completes_after = {uid: 0.1 * (20 - i) for i, uid in enumerate(uids)}
+        output_zip = make_output_zip()
+        for uid, delay in completes_after.items():
+            threading.Timer(delay, self.server.add_task, args=(uid, output_zip)).start()
+
+        t0 = time.monotonic()
+        results = asyncio.run(collect(self.client, uids))
+        elapsed = time.monotonic() - t0
+
+        self.assertEqual(sorted(uid for uid, _, _ in results), sorted(uids))
+        self.assertTrue(all(isinstance(task_output, TaskOutput) for _, task_output, _ in results))
+        self.assertLess(elapsed, max(completes_after.values()) + 1)
+
+        # Each output is yielded within a polling interval of its completion, i.e. in order of completion
+        for uid, _, yielded_at in results:
+            self.assertLess(yielded_at - self.server.completed_at[uid], 0.5)
+
+    def test_wait_modes(self):
+        output_zip = make_output_zip()
+        for wait_mode in ["long_poll", "sse"]:
+            client = AsyncInferenceClient(client_backend=ClientBackend(self.server.base_url),
+                                          polling=PollingStrategy(interval_sec=30, timeout_sec=10),
+                                          logger=logging.getLogger(__name__),
+                                          wait_mode=wait_mode)
+            uids = ["{}_{}".format(wait_mode, i) for i in range(5)]
+            for i, uid in enumerate(uids):
+                threading.Timer(0.3 + 0.1 * i, self.server.add_task, args=(uid, output_zip)).start()
+            try:
+                results = asyncio.run(collect(client, uids))
+            finally:
+                client.close()
+
+            # Fetched right at completion with a single request each. Polling would have waited for 30 sec
+            self.assertEqual(sorted(uid for uid, _, _ in results), uids)
+            for uid, task_output, yielded_at in results:
+                self.assertIsInstance(task_output, TaskOutput)
+                self.assertLess(yielded_at - self.server.completed_at[uid], 1, wait_mode)
+                self.assertEqual(len(self.server.requests_to("/api/tasks/" + uid)), 1, wait_mode)
+
+    def test_chunked_upload(self):
+        client = AsyncInferenceClient(client_backend=ClientBackend(self.server.base_url),
+                                      logger=logging.getLogger(__name__),
+                                      upload_mode="chunked")
+        try:
+            test_task_input = TestTaskInput()
+            test_task_input.setUp()
+            uids = asyncio.run(client.post_task_to_models(test_task_input.test_task_input_no_dicom_info(),
+                                                          ["GTV", "OAR"]))
+        finally:
+            client.close()
+
+        self.assertEqual(len(self.server.uploads), 2)
+        self.assertFalse(any(method == "POST" and path.startswith("/api/tasks/") for method, path, _ in self.server.requests))
+        self.assertEqual([self.server.posted[uid][0] for uid in uids], ["GTV", "OAR"])
+
+    def test_illegal_modes(self):
+        for kwargs in [{"wait_mode": "push"}, {"upload_mode": "carrier_pigeon"}]:
+            self.assertRaises(ValueError, AsyncInferenceClient, client_backend=ClientBackend(self.server.base_url),
+                              logger=logging.getLogger(__name__), **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
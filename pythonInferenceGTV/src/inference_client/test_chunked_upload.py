@@ -0,0 +1,104 @@
+import io
+import logging
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend import ClientBackend
+from inference_client.chunked_upload import ChunkedUpload, UPLOAD_ENDPOINT
+from inference_client.exceptions import UploadError
+from inference_client.inference_client import InferenceClient
+from testing.stand_in_server import StandInInferenceServer
+
+CHUNK_SIZE = 64 * 1024
+
+
+class TestChunkedUpload(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = StandInInferenceServer().start()
+        self.client_backend = ClientBackend(self.server.base_url)
+        self.data = os.urandom(10 * CHUNK_SIZE + 123)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+
+    def upload(self, **kwargs) -> ChunkedUpload:
+        return ChunkedUpload(client_backend=self.client_backend,
+                             logger=logging.getLogger(__file__),
+                             chunk_size=CHUNK_SIZE,
+                             retry_backoff_sec=0,
+                             **kwargs)
+
+    def chunk_offsets(self):
+        return [int(path.rsplit("offset=", 1)[1]) for method, path, _ in self.server.requests
+                if method == "POST" and "offset=" in path]
+
+    def test_upload(self):
+        upload = self.upload()
+        uid = upload.post(io.BytesIO(self.data), "model")
+
+        self.assertEqual(self.server.posted[uid], ("model", self.data))
+        self.assertEqual(self.chunk_offsets(), list(range(0, len(self.data), CHUNK_SIZE)))
+        self.assertEqual(upload.resumes, 0)
+
+    def test_empty_upload(self):
+        uid = self.upload().post(io.BytesIO(b""), "model")
+        self.assertEqual(self.server.posted[uid], ("model", b""))
+
+    def test_resume_after_dropped_chunk(self):
+        self.server.drop_chunks_left = 2
+        upload = self.upload()
+        uid = upload.post(io.BytesIO(self.data), "model")
+
+        self.assertEqual(self.server.posted[uid], ("model", self.data))
+        self.assertEqual(upload.resumes, 2)
+        # Only the lost half of each dropped chunk is sent again
+        offsets = self.chunk_offsets()
+        self.assertEqual(offsets[:4], [0, CHUNK_SIZE // 2, CHUNK_SIZE, 2 * CHUNK_SIZE])
+        upload_id = list(self.server.uploads)[0]
+        self.assertEqual(len(self.server.requests_to(UPLOAD_ENDPOINT + upload_id)), 2)
+
+    def test_corrupt_chunk_is_sent_again(self):
+        self.server.corrupt_chunks_left = 1
+        upload = self.upload()
+        uid = upload.post(io.BytesIO(self.data), "model")
+
+        self.assertEqual(self.server.posted[uid], ("model", self.data))
+        self.assertEqual(upload.resumes, 1)
+        self.assertEqual(self.chunk_offsets()[:2], [0, 0])
+
+    def test_gives_up_after_max_retries(self):
+        self.server.drop_chunks_left = 100
+        self.assertRaises(UploadError, self.upload(max_retries=2).post, io.BytesIO(self.data), "model")
+        self.assertEqual(len(self.chunk_offsets()), 3)
+
+    def test_inference_client_falls_back_to_single_post(self):
+        self.server.chunked_uploads = False
+        client = InferenceClient(logger=logging.getLogger(__file__),
+                                 client_backend=self.client_backend,
+                                 upload_mode="chunked")
+
+        uids = [client.post_input_zip(io.BytesIO(self.data), "model") for _ in range(2)]
+
+        for uid in uids:
+            model, body = self.server.posted[uid]
+            self.assertEqual(model, "model")
+            self.assertIn(self.data, body)  # The multipart body of a POST to /api/tasks/
+        # The missing endpoint is only tried once
+        self.assertEqual(len([p for m, p, _ in self.server.requests if m == "POST" and p.startswith(UPLOAD_ENDPOINT)]),
+                         1)
+
+    def test_inference_client_uploads_in_chunks(self):
+        client = InferenceClient(logger=logging.getLogger(__file__),
+                                 client_backend=self.client_backend,
+                                 upload_mode="chunked")
+        uid = client.post_input_zip(io.BytesIO(self.data), "model")
+
+        self.assertEqual(self.server.posted[uid], ("model", self.data))
+        self.assertEqual(len(self.server.requests_to("/api/tasks/", method="POST")), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,7 @@ import sys
 import tempfile
 import unittest
 import zipfile
+from http.client import HTTPException
 
 import SimpleITK
 import requests
@@ -24,7 +25,6 @@ class MockClientBackend(ClientBackendInterface):
     def __init__(self, base_url):
         self.tasks = []
         self.base_url = base_url
-        self.output_zip = tempfile.TemporaryFile(suffix=".zip")
         with tempfile.TemporaryDirectory() as output_dir:
             # Make a mock labels.json
             with open(os.path.join(output_dir, "pred.json"), "w") as f:
@@ -36,12 +36,14 @@ class MockClientBackend(ClientBackendInterface):
             img = SimpleITK.GetImageFromArray(arr)
             SimpleITK.WriteImage(img, os.path.join(output_dir, "pred.nii.gz"))
 
-            # Zip to self.output_zip tempfile
-            with zipfile.ZipFile(self.output_zip, "w", zipfile.ZIP_DEFLATED) as zip:
-                for file in os.listdir(output_dir):
-                    path = os.path.join(output_dir, file)
-                    zip.write(path, arcname=file)
-        self.output_zip.seek(0)
+            # Zip to self.output_zip_bytes. Every get serves these bytes, so concurrent gets do not share a file position
+            with tempfile.TemporaryFile(suffix=".zip") as output_zip:
+                with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zip:
+                    for file in os.listdir(output_dir):
+                        path = os.path.join(output_dir, file)
+                        zip.write(path, arcname=file)
+                output_zip.seek(0)
+                self.output_zip_bytes = output_zip.read()
 
     def __del__(self):
         for t in self.tasks:
@@ -50,28 +52,30 @@ class MockClientBackend(ClientBackendInterface):
             except Exception as e:
                 print(e)
 
-        self.output_zip.close()
-
-    def __get_output_zip(self):
-        self.output_zip.seek(0)
-        return self.output_zip
-
-    def get(self, endpoint: str) -> requests.Response:
+    def get(self, endpoint: str, stream: bool = False, headers=None) -> requests.Response:
         endpoint, uid = endpoint.rsplit("/", maxsplit=1)
 
         for task in self.tasks:
             if uid == task["uid"]:
                 res = requests.Response()
                 res.status_code = 200
-                res._content = self.__get_output_zip().read()
+                res._content = self.output_zip_bytes
+                res._content_consumed = True  # Lets iter_content serve _content when streamed
                 return res
         else:
             res = requests.Response()
             res.status_code = 404
             res._content = b"Task not found"
+            res._content_consumed = True
+            return res
+
+    def post(self, endpoint, params=None, files=None, data=None, headers=None):
+        if files is None:  # Only posting the whole zip is mocked, like a server without chunked uploads
+            res = requests.Response()
+            res.status_code = 404
+            res._content = b"Not found"
             return res
 
-    def post(self, endpoint, params=None, files=None):
         tmp_file = tempfile.TemporaryFile()
         tmp_file.write(files["zip_file"].read())
         tmp_file.seek(0)
@@ -89,6 +93,23 @@ class MockClientBackend(ClientBackendInterface):
         return res
 
 
+class FailingModelClientBackend(MockClientBackend):
+    """
+    Answers 500 to every post to one of failing_models
+    """
+    def __init__(self, base_url, failing_models):
+        super().__init__(base_url)
+        self.failing_models = failing_models
+
+    def post(self, endpoint, params=None, files=None, data=None, headers=None):
+        if params is not None and params.get("model_human_readable_id") in self.failing_models:
+            res = requests.Response()
+            res.status_code = 500
+            res._content = b"Internal server error"
+            return res
+        return super().post(endpoint, params, files, data, headers)
+
+
 class TestInferenceClient(unittest.TestCase):
     def setUp(self) -> None:
         self.client_backend = MockClientBackend(base_url="jadajada")
@@ -107,6 +128,73 @@ class TestInferenceClient(unittest.TestCase):
         self.assertIsInstance(uid, str)
         return uid
 
+    def test_post_task_to_models(self):
+        test_task_input = TestTaskInput()
+        test_task_input.setUp()
+        task_input = test_task_input.test_task_input_no_dicom_info()
+
+        model_ids = ["GTV", "OAR", "Brain"]
+        uids = self.client.post_task_to_models(task_input, model_ids)
+
+        self.assertEqual(len(uids), 3)
+        self.assertEqual(len(set(uids)), 3)
+        tasks = {task["uid"]: task for task in self.client_backend.tasks}
+        self.assertEqual([tasks[uid]["model_human_readable_id"] for uid in uids], model_ids)
+
+        # Every model received the same archive
+        zips = [tasks[uid]["zip_file"].read() for uid in uids]
+        self.assertTrue(all(z == zips[0] for z in zips))
+        self.assertGreater(len(zips[0]), 0)
+
+    def test_post_task_to_models_from_disk(self):
+        test_task_input = TestTaskInput()
+        test_task_input.setUp()
+        task_input = test_task_input.test_task_input_no_dicom_info()
+        task_input.spool_max_size = 1  # Rolls the zip over to disk
+
+        posted = []
+        post = self.client_backend.post
+
+        def record_post(endpoint, params=None, files=None, data=None, headers=None):
+            posted.append(files["zip_file"])
+            return post(endpoint, params, files, data, headers)
+        self.client_backend.post = record_post
+
+        model_ids = ["GTV", "OAR", "Brain"]
+        uids = self.client.post_task_to_models(task_input, model_ids)
+
+        # Posted from the spooled file, not from a copy in memory, and every model received the whole archive
+        self.assertEqual(len(posted), 3)
+        self.assertTrue(all(isinstance(f, tempfile.SpooledTemporaryFile) and f is posted[0] for f in posted))
+        tasks = {task["uid"]: task for task in self.client_backend.tasks}
+        self.assertEqual([tasks[uid]["model_human_readable_id"] for uid in uids], model_ids)
+        zips = [tasks[uid]["zip_file"].read() for uid in uids]
+        self.assertTrue(all(z == zips[0] for z in zips))
+        self.assertTrue(zipfile.is_zipfile(tasks[uids[0]]["zip_file"]))
+
+    def test_post_task_to_models_one_fails(self):
+        test_task_input = TestTaskInput()
+        test_task_input.setUp()
+        task_input = test_task_input.test_task_input_no_dicom_info()
+        self.client.client_backend = FailingModelClientBackend(base_url="jadajada", failing_models=["OAR"])
+
+        with self.assertLogs(level="ERROR") as logs:
+            uids = self.client.post_task_to_models(task_input, ["GTV", "OAR", "Brain"])
+
+        self.assertIsNone(uids[1])
+        tasks = {task["uid"]: task for task in self.client.client_backend.tasks}
+        self.assertEqual([tasks[uid]["model_human_readable_id"] for uid in [uids[0], uids[2]]], ["GTV", "Brain"])
+        self.assertTrue(any("OAR" in line for line in logs.output))
+        self.assertTrue(any(uids[0] in line and uids[2] in line for line in logs.output))
+
+    def test_post_task_to_models_all_fail(self):
+        test_task_input = TestTaskInput()
+        test_task_input.setUp()
+        task_input = test_task_input.test_task_input_no_dicom_info()
+        self.client.client_backend = FailingModelClientBackend(base_url="jadajada", failing_models=["GTV", "OAR"])
+
+        self.assertRaises(HTTPException, self.client.post_task_to_models, task_input, ["GTV", "OAR"])
+
     def test_get_task_intended(self):
         uid = self.test_post_task_intended()
         self.assertIsInstance(uid, str)
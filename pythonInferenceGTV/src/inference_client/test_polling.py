@@ -0,0 +1,103 @@
+import email.utils
+import logging
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend import ClientBackend
+from inference_client.inference_client import InferenceClient
+from inference_client.polling import PollingStrategy
+from testing.stand_in_server import StandInInferenceServer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, sec):
+        self.sleeps.append(sec)
+        self.now += sec
+
+
+class TestPollingStrategy(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+
+    def make(self, **kwargs):
+        kwargs.setdefault("jitter", 0)
+        return PollingStrategy(clock=self.clock, sleep=self.clock.sleep, **kwargs).start()
+
+    def test_fixed_interval_until_deadline(self):
+        polling = self.make(interval_sec=3, timeout_sec=8)
+        while polling.wait():
+            self.clock.now += 0.5  # Time spent on each request counts against the deadline
+        self.assertEqual(self.clock.sleeps, [3, 3, 1])  # The last poll is made at the deadline
+        self.assertEqual(polling.elapsed(), 8.5)
+
+    def test_backoff_with_jitter(self):
+        polling = self.make(interval_sec=1, timeout_sec=1000, backoff=2, max_interval_sec=5)
+        self.assertEqual([polling.next_delay() for _ in range(5)], [1, 2, 4, 5, 5])
+
+        polling = self.make(interval_sec=10, timeout_sec=1000, jitter=0.2)
+        delays = [polling.next_delay() for _ in range(50)]
+        self.assertTrue(all(8 <= d <= 12 for d in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_retry_after(self):
+        polling = self.make(interval_sec=5, timeout_sec=100)
+        self.assertEqual(polling.next_delay({"Retry-After": "12"}), 12)
+        date = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(polling.next_delay({"Retry-After": date}), 30, delta=2)
+        self.assertEqual(polling.next_delay({"Retry-After": "in a while"}), 5)
+        self.assertEqual(polling.next_delay({"Retry-After": "1000"}), 100)  # Cut at the deadline
+
+    def test_eta_and_queue_position(self):
+        polling = self.make(interval_sec=5, timeout_sec=1000, fast_interval_sec=0.5, eta_lead_sec=2)
+        self.assertEqual(polling.next_delay({"X-Task-ETA-Sec": "30"}), 28)
+        self.assertEqual(polling.next_delay({"X-Task-ETA-Sec": "1.5"}), 0.5)
+        self.assertEqual(polling.next_delay({"X-Task-ETA-Sec": "0"}), 0.5)
+        self.assertEqual(polling.next_delay({"X-Queue-Position": "3"}), 20)
+
+    def test_start_returns_independent_polls(self):
+        strategy = PollingStrategy(interval_sec=1, timeout_sec=10, backoff=2, jitter=0, clock=self.clock)
+        first = strategy.start()
+        first.next_delay()
+        self.assertEqual(strategy.start().next_delay(), 1)
+
+
+class TestGetTaskPolling(unittest.TestCase):
+    def test_polls_fast_around_eta(self):
+        with StandInInferenceServer() as server:
+            server.pending["uid"] = {"X-Task-ETA-Sec": "0.3"}
+            threading.Timer(0.5, server.add_task, args=("uid", b"not a zip")).start()
+
+            client = InferenceClient(logger=logging.getLogger(__file__),
+                                     client_backend=ClientBackend(server.base_url),
+                                     polling=PollingStrategy(interval_sec=30, timeout_sec=10, fast_interval_sec=0.2))
+            t0 = time.monotonic()
+            self.assertRaises(Exception, client.get_task, "uid")  # Found, but not a valid output zip
+            self.assertLess(time.monotonic() - t0, 5)
+            self.assertGreater(len(server.requests_to("/api/tasks/uid")), 1)
+
+    def test_timeout_is_wall_clock(self):
+        with StandInInferenceServer() as server:
+            server.stall_sec = 0.3  # Slow responses count against the timeout
+            client = InferenceClient(logger=logging.getLogger(__file__),
+                                     client_backend=ClientBackend(server.base_url),
+                                     polling_interval_sec=0.5,
+                                     timeout_sec=2)
+            t0 = time.monotonic()
+            self.assertRaises(TimeoutError, client.get_task, "missing")
+            self.assertLess(time.monotonic() - t0, 3.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import asyncio
+import sys
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend import ClientBackend
+from disk_cache.disk_cache import DiskCache
+from inference_client.async_inference_client import AsyncInferenceClient
+from inference_client.exceptions import ChecksumError
+from inference_client.inference_client import InferenceClient
+from inference_client.result_download import ResultDownload, expected_sha256
+from nifti_codec.nifti_codec import encode_nifti_gz
+from testing.stand_in_server import StandInInferenceServer
+
+
+class TestResultDownload(unittest.TestCase):
+    def setUp(self) -> None:
+        self.logger = logging.getLogger(__file__)
+        self.pred = np.random.RandomState(0).randint(0, 3, (32, 128, 128)).astype(np.uint8)
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip:
+            zip.writestr("pred.json", json.dumps({"1": "GTVt", "2": "GTVn"}))
+            zip.writestr("pred.nii.gz", encode_nifti_gz(self.pred, spacing=[1, 1, 1], origin=[0, 0, 0]))
+        self.output_zip = buffer.getvalue()
+
+        self.server = StandInInferenceServer().start()
+        self.server.add_task("uid", self.output_zip)
+        self.client_backend = ClientBackend(base_url=self.server.base_url)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+
+    def download(self, **kwargs):
+        res = self.client_backend.get(endpoint="/api/tasks/uid", stream=True)
+        self.assertTrue(res.ok)
+        download = ResultDownload(client_backend=self.client_backend,
+                                  endpoint="/api/tasks/uid",
+                                  logger=self.logger,
+                                  chunk_size=4096,
+                                  **kwargs)
+        return download, download.run(res)
+
+    def assertOutput(self, task_output):
+        label_array_dict = task_output.get_output_as_label_array_dict()
+        self.assertTrue(np.array_equal(label_array_dict["GTVt"], self.pred == 1))
+        self.assertTrue(np.array_equal(label_array_dict["GTVn"], self.pred == 2))
+
+    def test_expected_sha256(self):
+        digest = hashlib.sha256(b"hest").digest()
+        self.assertEqual(expected_sha256({"Digest": "SHA-256=" + base64.b64encode(digest).decode()}),
+                         digest.hex())
+        self.assertEqual(expected_sha256({"X-Checksum-Sha256": digest.hex().upper()}), digest.hex())
+        self.assertIsNone(expected_sha256({}))
+
+    def test_download(self):
+        download, task_output = self.download()
+        self.assertEqual(download.resumes, 0)
+        self.assertOutput(task_output)
+
+    def test_download_resumes_after_cut(self):
+        self.server.cut_after_bytes = len(self.output_zip) // 5
+        self.server.cuts_left = 3
+
+        download, task_output = self.download()
+        self.assertOutput(task_output)
+        self.assertEqual(download.resumes, 3)
+
+        # Each resume starts where the received bytes ended, which is at most where the server cut the connection
+        ranges = [h.get("Range") for h in self.server.requests_to("/api/tasks/uid")]
+        self.assertIsNone(ranges[0])
+        offsets = [int(r[len("bytes="):-1]) for r in ranges[1:]]
+        self.assertEqual(len(offsets), 3)
+        step = len(self.output_zip) // 5
+        for i, offset in enumerate(offsets):
+            previous = offsets[i - 1] if i else 0
+            self.assertTrue(previous < offset <= previous + step)
+
+    def test_download_restarts_if_range_is_ignored(self):
+        self.server.honor_range = False
+        self.server.cut_after_bytes = len(self.output_zip) // 2
+        self.server.cuts_left = 1
+
+        download, task_output = self.download()
+        self.assertOutput(task_output)
+        self.assertEqual(download.resumes, 1)
+
+    def test_download_restarts_if_body_is_encoded(self):
+        # The offset of the decoded bytes received is not an offset in the gzip encoded body
+        self.server.gzip_bodies = True
+        self.server.cut_after_bytes = len(self.output_zip) // 4
+        self.server.cuts_left = 1
+
+        download, task_output = self.download()
+        self.assertOutput(task_output)
+        self.assertEqual(download.resumes, 1)
+        self.assertEqual([h.get("Range") for h in self.server.requests_to("/api/tasks/uid")], [None, None])
+
+    def test_empty_body_is_not_an_output(self):
+        self.server.add_task("uid", b"")
+        self.assertRaises(zipfile.BadZipFile, self.download)
+
+    def test_download_gives_up(self):
+        self.server.cut_after_bytes = 1000
+        self.server.cuts_left = 10
+        self.assertRaises(requests.exceptions.RequestException, self.download, max_resumes=2)
+
+    def test_download_checksum_mismatch(self):
+        self.server.digest_override = hashlib.sha256(b"something else").digest()
+        self.assertRaises(ChecksumError, self.download)
+
+    def test_get_task_streams(self):
+        self.server.cut_after_bytes = 10000
+        self.server.cuts_left = 1
+        client = InferenceClient(logger=self.logger, client_backend=self.client_backend, polling_interval_sec=1,
+                                 timeout_sec=2)
+        self.assertOutput(client.get_task("uid"))
+        self.assertRaises(TimeoutError, client.get_task, "missing")
+
+    def test_get_task_result_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = DiskCache(tmp_dir, max_bytes=1024 ** 3)
+            client = InferenceClient(logger=self.logger, client_backend=self.client_backend, polling_interval_sec=1,
+                                     timeout_sec=2, result_cache=cache)
+            self.assertOutput(client.get_task("uid"))
+            n_requests = len(self.server.requests)
+
+            # A hit skips the network entirely
+            self.assertOutput(client.get_task("uid"))
+            self.assertEqual(len(self.server.requests), n_requests)
+            self.assertEqual((cache.hits, cache.misses, cache.hit_bytes), (1, 1, len(self.output_zip)))
+
+            # So does the async client
+            async_client = AsyncInferenceClient(logger=self.logger, client_backend=self.client_backend,
+                                                result_cache=cache)
+            self.assertOutput(asyncio.run(async_client.get_task("uid")))
+            async_client.close()
+            self.assertEqual(len(self.server.requests), n_requests)
+
+    def test_result_cache_only_stores_checked_outputs(self):
+        self.server.digest_override = hashlib.sha256(b"something else").digest()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = DiskCache(tmp_dir, max_bytes=1024 ** 3)
+            self.assertRaises(ChecksumError, self.download, cache=cache, cache_key="uid")
+            self.assertIsNone(cache.get("uid"))
+
+            self.server.digest_override = None
+            self.download(cache=cache, cache_key="uid")
+            self.assertEqual(cache.get("uid"), self.output_zip)
+
+    def test_result_cache_does_not_store_truncated_outputs(self):
+        self.server.send_digest = False
+        self.server.add_task("uid", self.output_zip[:len(self.output_zip) // 2])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = DiskCache(tmp_dir, max_bytes=1024 ** 3)
+            self.assertRaises(zipfile.BadZipFile, self.download, cache=cache, cache_key="uid")
+            self.assertIsNone(cache.get("uid"))
+
+    def test_unreadable_cached_output_is_downloaded_again(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = DiskCache(tmp_dir, max_bytes=1024 ** 3)
+            cache.put("uid", self.output_zip[:len(self.output_zip) // 2])
+            client = InferenceClient(logger=self.logger, client_backend=self.client_backend, polling_interval_sec=1,
+                                     timeout_sec=2, result_cache=cache)
+            self.assertOutput(client.get_task("uid"))
+            self.assertEqual(cache.get("uid"), self.output_zip)
+
+            cache.put("uid", b"")
+            async_client = AsyncInferenceClient(logger=self.logger, client_backend=self.client_backend,
+                                                result_cache=cache)
+            self.assertOutput(asyncio.run(async_client.get_task("uid")))
+            async_client.close()
+            self.assertEqual(cache.get("uid"), self.output_zip)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import logging
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from client_backend.client_backend import ClientBackend
+from inference_client.benchmark_wait_modes import make_output_zip
+from inference_client.exceptions import JobExecError
+from inference_client.inference_client import InferenceClient
+from inference_client.polling import PollingStrategy
+from inference_client.task_waiting import iter_server_sent_events
+from testing.stand_in_server import StandInInferenceServer
+
+
+class TestTaskWaiting(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = StandInInferenceServer().start()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+
+    def client(self, wait_mode: str, interval_sec: float = 30, timeout_sec: float = 10) -> InferenceClient:
+        return InferenceClient(logger=logging.getLogger(__file__),
+                               client_backend=ClientBackend(self.server.base_url),
+                               polling=PollingStrategy(interval_sec=interval_sec, timeout_sec=timeout_sec),
+                               wait_mode=wait_mode)
+
+    def test_iter_server_sent_events(self):
+        lines = [": keep-alive", "", "event: status", 'data: {"status":', 'data:  "done"}', "", "data: x", ""]
+        self.assertEqual(list(iter_server_sent_events(lines)),
+                         [("status", '{"status":\n "done"}'), ("message", "x")])
+
+    def test_output_is_fetched_on_completion(self):
+        for wait_mode in ["long_poll", "sse", "auto"]:
+            uid = "uid_" + wait_mode
+            threading.Timer(0.5, self.server.add_task, args=(uid, make_output_zip())).start()
+
+            self.client(wait_mode).get_task(uid)
+            latency = time.monotonic() - self.server.completed_at[uid]
+            self.assertLess(latency, 1, wait_mode)  # Polling would have waited for up to 30 sec
+            self.assertEqual(len(self.server.requests_to("/api/tasks/" + uid)), 1, wait_mode)
+
+    def test_failed_task(self):
+        for wait_mode in ["long_poll", "sse"]:
+            uid = "uid_" + wait_mode
+            threading.Timer(0.3, self.server.fail_task, args=(uid,)).start()
+            self.assertRaises(JobExecError, self.client(wait_mode).get_task, uid)
+
+    def test_deadline(self):
+        self.server.keep_alive_sec = 0.2
+        for wait_mode in ["long_poll", "sse"]:
+            t0 = time.monotonic()
+            self.assertRaises(TimeoutError, self.client(wait_mode, timeout_sec=1).get_task, "never_done")
+            self.assertLess(time.monotonic() - t0, 3, wait_mode)
+
+    def test_falls_back_to_polling(self):
+        self.server.long_poll = False
+        self.server.sse = False
+        self.server.add_task("uid", make_output_zip())
+
+        for _ in range(2):
+            self.client("auto", interval_sec=0.2).get_task("uid")
+        paths = [path for _, path, _ in self.server.requests]
+        # The endpoints were only tried once, as the server lacks them
+        self.assertEqual(sum("/wait" in path for path in paths), 1)
+        self.assertEqual(sum("/events" in path for path in paths), 1)
+        self.assertEqual(paths.count("/api/tasks/uid"), 2)
+
+    def test_event_stream_error_is_not_unsupported(self):
+        self.server.long_poll = False
+        self.server.events_error = 503
+        self.server.add_task("uid", make_output_zip())
+
+        for _ in range(2):
+            self.client("sse", interval_sec=0.2).get_task("uid")
+        # Polled instead, but the event stream is tried again for the next task
+        paths = [path for _, path, _ in self.server.requests]
+        self.assertEqual(sum("/events" in path for path in paths), 2)
+        self.assertEqual(paths.count("/api/tasks/uid"), 2)
+
+        self.server.events_error = 552
+        self.assertRaises(JobExecError, self.client("sse").get_task, "uid")
+
+
+if __name__ == '__main__':
+    unittest.main()
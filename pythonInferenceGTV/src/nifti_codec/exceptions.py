@@ -0,0 +1,2 @@
+class UnsupportedNiftiError(Exception):
+    pass
@@ -0,0 +1,255 @@
+import gzip
+import io
+import math
+import struct
+from typing import BinaryIO, Sequence
+
+import numpy as np
+
+from nifti_codec.exceptions import UnsupportedNiftiError
+
+"""
+Minimal NIfTI-1 writer used to encode volumes straight into memory or into an open zip member.
+Files written here are read back by SimpleITK exactly like the ones written by sitk.WriteImage.
+The reader handles the plain single file NIfTI-1 volumes inference servers return. Anything more exotic raises
+UnsupportedNiftiError, so the caller can fall back to SimpleITK.
+"""
+
+NIFTI1_HEADER_FORMAT = "<i10s18sihbB8h3f4h8f3fhBB4f2i80s24s2h6f4f4f4f16s4s"
+NIFTI1_HEADER_SIZE = 348
+NIFTI1_VOX_OFFSET = 352  # Header + 4 bytes of (empty) extension flags
+
+# numpy dtype -> (NIfTI datatype code, bitpix)
+NIFTI_DATATYPES = {
+    np.dtype(np.uint8): (2, 8),
+    np.dtype(np.int16): (4, 16),
+    np.dtype(np.int32): (8, 32),
+    np.dtype(np.float32): (16, 32),
+    np.dtype(np.float64): (64, 64),
+    np.dtype(np.int8): (256, 8),
+    np.dtype(np.uint16): (512, 16),
+    np.dtype(np.uint32): (768, 32),
+    np.dtype(np.int64): (1024, 64),
+    np.dtype(np.uint64): (1280, 64),
+}
+
+NIFTI_DTYPES = {code: dtype for dtype, (code, _) in NIFTI_DATATYPES.items()}  # NIfTI datatype code -> numpy dtype
+
+DEFAULT_COMPRESSLEVEL = 6  # zlib default, which is what sitk.WriteImage(..., useCompression=True) uses
+WRITE_CHUNK_BYTES = 1 << 22
+
+
+def _rotation_to_quatern(rotation: np.ndarray):
+    """
+    Port of nifti_mat44_to_quatern for an orthonormal rotation matrix. Returns (b, c, d, qfac)
+    """
+    r = np.array(rotation, dtype=np.float64)
+    qfac = 1.0
+    if np.linalg.det(r) < 0:
+        qfac = -1.0
+        r[:, 2] = -r[:, 2]
+
+    a = r[0, 0] + r[1, 1] + r[2, 2] + 1.0
+    if a > 0.5:
+        a = 0.5 * math.sqrt(a)
+        b = 0.25 * (r[2, 1] - r[1, 2]) / a
+        c = 0.25 * (r[0, 2] - r[2, 0]) / a
+        d = 0.25 * (r[1, 0] - r[0, 1]) / a
+    else:
+        xd = 1.0 + r[0, 0] - (r[1, 1] + r[2, 2])
+        yd = 1.0 + r[1, 1] - (r[0, 0] + r[2, 2])
+        zd = 1.0 + r[2, 2] - (r[0, 0] + r[1, 1])
+        if xd > 1.0:
+            b = 0.5 * math.sqrt(xd)
+            c = 0.25 * (r[0, 1] + r[1, 0]) / b
+            d = 0.25 * (r[0, 2] + r[2, 0]) / b
+            a = 0.25 * (r[2, 1] - r[1, 2]) / b
+        elif yd > 1.0:
+            c = 0.5 * math.sqrt(yd)
+            b = 0.25 * (r[0, 1] + r[1, 0]) / c
+            d = 0.25 * (r[1, 2] + r[2, 1]) / c
+            a = 0.25 * (r[0, 2] - r[2, 0]) / c
+        else:
+            d = 0.5 * math.sqrt(zd)
+            b = 0.25 * (r[0, 2] + r[2, 0]) / d
+            c = 0.25 * (r[1, 2] + r[2, 1]) / d
+            a = 0.25 * (r[1, 0] - r[0, 1]) / d
+        if a < 0.0:
+            b, c, d = -b, -c, -d
+
+    return b, c, d, qfac
+
+
+def encode_nifti_header(shape: Sequence[int],
+                        dtype: np.dtype,
+                        spacing: Sequence[float],
+                        origin: Sequence[float],
+                        direction: Sequence[float] = None) -> bytes:
+    """
+    Builds the 352 byte NIfTI-1 header (incl. extension flags) for a volume of numpy shape (z, y, x).
+    spacing, origin and direction are given in the SimpleITK (LPS, x-first) convention and converted to RAS like ITK does.
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in NIFTI_DATATYPES:
+        raise TypeError("Unsupported dtype for NIfTI encoding: {}".format(dtype))
+    datatype, bitpix = NIFTI_DATATYPES[dtype]
+
+    size_xyz = list(reversed([int(s) for s in shape]))
+    if len(size_xyz) != 3:
+        raise ValueError("Only 3D volumes can be encoded. Got shape {}".format(tuple(shape)))
+
+    spacing = [float(s) for s in spacing]
+    if direction is None:
+        direction = [1, 0, 0, 0, 1, 0, 0, 0, 1]
+    lps_to_ras = np.diag([-1.0, -1.0, 1.0])
+    rotation = lps_to_ras @ np.array(direction, dtype=np.float64).reshape(3, 3)
+    offset = lps_to_ras @ np.array(origin, dtype=np.float64)
+    affine = rotation @ np.diag(spacing)
+
+    b, c, d, qfac = _rotation_to_quatern(rotation)
+
+    dim = [3] + size_xyz + [1, 1, 1, 1]
+    pixdim = [qfac] + spacing + [0.0, 0.0, 0.0, 0.0]
+
+    header = struct.pack(NIFTI1_HEADER_FORMAT,
+                         NIFTI1_HEADER_SIZE,
+                         b"", b"", 0, 0, ord("r"), 0,
+                         *dim,
+                         0.0, 0.0, 0.0,  # intent_p1..3
+                         0, datatype, bitpix, 0,  # intent_code, datatype, bitpix, slice_start
+                         *pixdim,
+                         float(NIFTI1_VOX_OFFSET), 1.0, 0.0,  # vox_offset, scl_slope, scl_inter
+                         0, 0, 10,  # slice_end, slice_code, xyzt_units (mm + sec)
+                         0.0, 0.0, 0.0, 0.0,  # cal_max, cal_min, slice_duration, toffset
+                         0, 0,  # glmax, glmin
+                         b"", b"",  # descrip, aux_file
+                         1, 1,  # qform_code, sform_code (scanner anat)
+                         b, c, d, offset[0], offset[1], offset[2],
+                         *affine[0], offset[0],
+                         *affine[1], offset[1],
+                         *affine[2], offset[2],
+                         b"", b"n+1\0")
+    return header + b"\0\0\0\0"
+
+
+def write_nifti(fileobj: BinaryIO,
+                arr: np.ndarray,
+                spacing: Sequence[float],
+                origin: Sequence[float],
+                direction: Sequence[float] = None) -> None:
+    """
+    Writes arr as an uncompressed NIfTI-1 (.nii) stream to fileobj.
+    """
+    if arr.dtype == bool:
+        arr = arr.view(np.uint8)
+    arr = np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder("<"))
+
+    fileobj.write(encode_nifti_header(arr.shape, arr.dtype, spacing, origin, direction))
+
+    # Write voxel data in slabs to avoid duplicating the full volume in memory
+    buffer = memoryview(arr.reshape(-1).view(np.uint8))
+    for start in range(0, len(buffer), WRITE_CHUNK_BYTES):
+        fileobj.write(buffer[start:start + WRITE_CHUNK_BYTES])
+
+
+def write_nifti_gz(fileobj: BinaryIO,
+                   arr: np.ndarray,
+                   spacing: Sequence[float],
+                   origin: Sequence[float],
+                   direction: Sequence[float] = None,
+                   compresslevel: int = DEFAULT_COMPRESSLEVEL) -> None:
+    """
+    Writes arr as a gzipped NIfTI-1 (.nii.gz) stream to fileobj
+    """
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=compresslevel, mtime=0) as gz:
+        write_nifti(gz, arr, spacing, origin, direction)
+
+
+def encode_nifti_gz(arr: np.ndarray,
+                    spacing: Sequence[float],
+                    origin: Sequence[float],
+                    direction: Sequence[float] = None,
+                    compresslevel: int = DEFAULT_COMPRESSLEVEL) -> bytes:
+    """
+    Returns arr encoded as .nii.gz bytes
+    """
+    buffer = io.BytesIO()
+    write_nifti_gz(buffer, arr, spacing, origin, direction, compresslevel)
+    return buffer.getvalue()
+
+
+def _read_exactly(fileobj: BinaryIO, n: int) -> bytes:
+    data = fileobj.read(n)
+    if len(data) != n:
+        raise EOFError("NIfTI stream ended after {} of {} bytes".format(len(data), n))
+    return data
+
+
+def read_nifti_header(fileobj: BinaryIO):
+    """
+    Reads the 348 byte NIfTI-1 header from fileobj. Returns (shape, dtype, vox_offset) with shape in numpy order (z, y, x)
+    and dtype in the byte order of the file
+    """
+    raw = _read_exactly(fileobj, NIFTI1_HEADER_SIZE)
+    for endian in "<>":
+        if struct.unpack(endian + "i", raw[:4])[0] == NIFTI1_HEADER_SIZE:
+            break
+    else:
+        raise UnsupportedNiftiError("Not a NIfTI-1 header (sizeof_hdr is not 348)")
+
+    fields = struct.unpack(endian + NIFTI1_HEADER_FORMAT[1:], raw)
+    dim, datatype, magic = fields[7:15], fields[19], fields[65]
+    vox_offset, scl_slope, scl_inter = fields[30:33]
+    if magic != b"n+1\0":
+        raise UnsupportedNiftiError("Only single file NIfTI-1 (n+1) is supported. Got magic {}".format(magic))
+    if datatype not in NIFTI_DTYPES:
+        raise UnsupportedNiftiError("Unsupported NIfTI datatype: {}".format(datatype))
+    if scl_slope not in (0.0, 1.0) or (scl_slope != 0.0 and scl_inter != 0.0):
+        raise UnsupportedNiftiError("Scaled voxel values (scl_slope={}, scl_inter={})".format(scl_slope, scl_inter))
+
+    ndim = dim[0]
+    if not 3 <= ndim <= 7 or any(d != 1 for d in dim[4:ndim + 1]):
+        raise UnsupportedNiftiError("Only 3D volumes are supported. Got dim {}".format(dim))
+    if any(d < 1 for d in dim[1:4]) or vox_offset < NIFTI1_HEADER_SIZE:
+        raise UnsupportedNiftiError("Invalid dim {} or vox_offset {}".format(dim, vox_offset))
+
+    shape = tuple(reversed(dim[1:4]))
+    dtype = NIFTI_DTYPES[datatype].newbyteorder(endian)
+    return shape, dtype, int(vox_offset)
+
+
+def read_nifti(fileobj: BinaryIO) -> np.ndarray:
+    """
+    Reads an uncompressed NIfTI-1 (.nii) stream into an array of numpy shape (z, y, x), like sitk.GetArrayFromImage
+    """
+    shape, dtype, vox_offset = read_nifti_header(fileobj)
+    _read_exactly(fileobj, vox_offset - NIFTI1_HEADER_SIZE)  # Extensions, if any
+
+    # Read straight into the array, so the voxels are not held twice
+    arr = np.empty(shape, dtype=dtype)
+    buffer = memoryview(arr.reshape(-1).view(np.uint8))
+    filled = 0
+    while filled < len(buffer):
+        n = fileobj.readinto(buffer[filled:filled + WRITE_CHUNK_BYTES])
+        if not n:
+            raise EOFError("NIfTI stream ended after {} of {} voxel bytes".format(filled, len(buffer)))
+        filled += n
+
+    if not dtype.isnative:
+        arr = arr.astype(dtype.newbyteorder("="))
+    return arr
+
+
+def read_nifti_gz(fileobj: BinaryIO) -> np.ndarray:
+    """
+    Reads a gzipped NIfTI-1 (.nii.gz) stream into an array of numpy shape (z, y, x)
+    """
+    with gzip.GzipFile(fileobj=fileobj, mode="rb") as gz:
+        return read_nifti(gz)
+
+
+def decode_nifti_gz(data: bytes) -> np.ndarray:
+    """
+    Returns the array of .nii.gz bytes
+    """
+    return read_nifti_gz(io.BytesIO(data))
@@ -0,0 +1,117 @@
+import gzip
+import io
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+import SimpleITK as sitk
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from nifti_codec.exceptions import UnsupportedNiftiError
+from nifti_codec.nifti_codec import encode_nifti_gz, decode_nifti_gz, read_nifti, NIFTI1_HEADER_FORMAT
+
+
+class TestNiftiCodec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.spacing = [3, 1.17, 1.17]
+        self.origin = [-120.0, 120.0, 55.0]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def read_with_sitk(self, data: bytes) -> sitk.Image:
+        path = os.path.join(self.tmp_dir.name, "tmp.nii.gz")
+        with open(path, "wb") as f:
+            f.write(data)
+        return sitk.ReadImage(path)
+
+    def test_encode_nifti_gz_header_matches_sitk(self):
+        arr = np.random.randint(-1000, 1200, size=(8, 16, 12)).astype(np.int16)
+
+        img = sitk.GetImageFromArray(arr)
+        img.SetSpacing(self.spacing)
+        img.SetOrigin(self.origin)
+        path = os.path.join(self.tmp_dir.name, "sitk.nii.gz")
+        sitk.WriteImage(img, path, useCompression=True)
+
+        with gzip.open(path) as r:
+            expected = r.read()
+
+        self.assertEqual(gzip.decompress(encode_nifti_gz(arr, self.spacing, self.origin)), expected)
+
+    def test_encode_nifti_gz_round_trip(self):
+        for dtype in [np.uint8, np.int16, np.int32, np.int64, np.float32, np.float64]:
+            arr = np.random.randint(0, 100, size=(4, 6, 5)).astype(dtype)
+            img = self.read_with_sitk(encode_nifti_gz(arr, self.spacing, self.origin))
+
+            self.assertTrue(np.array_equal(sitk.GetArrayFromImage(img), arr))
+            self.assertEqual(sitk.GetArrayFromImage(img).dtype, np.dtype(dtype))
+            np.testing.assert_allclose(img.GetSpacing(), self.spacing, rtol=1e-6)
+            np.testing.assert_allclose(img.GetOrigin(), self.origin, rtol=1e-6)
+
+    def test_encode_nifti_gz_bool(self):
+        arr = np.random.randint(0, 2, size=(4, 6, 5)).astype(bool)
+        img = self.read_with_sitk(encode_nifti_gz(arr, self.spacing, self.origin))
+        self.assertTrue(np.array_equal(sitk.GetArrayFromImage(img), arr.astype(np.uint8)))
+
+    def test_encode_nifti_gz_direction(self):
+        arr = np.zeros((4, 6, 5), dtype=np.uint8)
+        direction = [0, 1, 0, 1, 0, 0, 0, 0, -1]
+        img = self.read_with_sitk(encode_nifti_gz(arr, self.spacing, self.origin, direction=direction))
+        np.testing.assert_allclose(img.GetDirection(), direction, atol=1e-6)
+        np.testing.assert_allclose(img.GetOrigin(), self.origin, rtol=1e-6)
+
+    def test_encode_nifti_gz_unsupported_dtype(self):
+        arr = np.zeros((4, 6, 5), dtype=np.complex64)
+        self.assertRaises(TypeError, encode_nifti_gz, arr, self.spacing, self.origin)
+
+    def test_decode_nifti_gz_roundtrip(self):
+        for dtype in [np.uint8, np.int16, np.uint16, np.int32, np.float32, np.float64, np.int64]:
+            arr = np.random.randint(0, 100, size=(5, 7, 9)).astype(dtype)
+            decoded = decode_nifti_gz(encode_nifti_gz(arr, self.spacing, self.origin))
+            self.assertEqual(decoded.dtype, arr.dtype)
+            self.assertTrue(np.array_equal(decoded, arr))
+
+    def test_decode_nifti_gz_matches_sitk(self):
+        arr = np.random.randint(0, 5, size=(8, 16, 12)).astype(np.uint8)
+        img = sitk.GetImageFromArray(arr)
+        img.SetSpacing(self.spacing)
+        path = os.path.join(self.tmp_dir.name, "sitk.nii.gz")
+        sitk.WriteImage(img, path, useCompression=True)
+
+        with open(path, "rb") as r:
+            decoded = decode_nifti_gz(r.read())
+        self.assertTrue(np.array_equal(decoded, sitk.GetArrayFromImage(sitk.ReadImage(path))))
+
+    def test_decode_nifti_big_endian(self):
+        arr = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+        raw = gzip.decompress(encode_nifti_gz(arr, self.spacing, self.origin))
+        header = struct.unpack(NIFTI1_HEADER_FORMAT, raw[:348])
+        swapped = struct.pack(">" + NIFTI1_HEADER_FORMAT[1:], *header) + raw[348:352] + arr.astype(">i2").tobytes()
+
+        decoded = read_nifti(io.BytesIO(swapped))
+        self.assertTrue(decoded.dtype.isnative)
+        self.assertTrue(np.array_equal(decoded, arr))
+
+    def test_decode_nifti_unsupported(self):
+        arr = np.zeros((2, 3, 4), dtype=np.int16)
+        raw = bytearray(gzip.decompress(encode_nifti_gz(arr, self.spacing, self.origin)))
+
+        scaled = bytearray(raw)
+        scaled[112:116] = struct.pack("<f", 2.0)  # scl_slope
+        self.assertRaises(UnsupportedNiftiError, read_nifti, io.BytesIO(bytes(scaled)))
+
+        nifti2 = bytearray(raw)
+        nifti2[:4] = struct.pack("<i", 540)
+        self.assertRaises(UnsupportedNiftiError, read_nifti, io.BytesIO(bytes(nifti2)))
+
+        self.assertRaises(EOFError, read_nifti, io.BytesIO(bytes(raw[:-1])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import io
+import threading
+import time
+from typing import Iterable, List, Sequence
+
+import numpy as np
+
+try:  # Optional, faster codec. Only used when installed and advertised by the server
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from nifti_codec.nifti_codec import DEFAULT_COMPRESSLEVEL, encode_nifti_gz, write_nifti
+
+CODEC_SUFFIXES = {"gzip": ".nii.gz", "zstd": ".nii.zst"}
+DEFAULT_ZSTD_LEVEL = 3
+AUTO_SAMPLE_BYTES = 4 * 1024 * 1024  # Raw bytes of each volume which are test-compressed to estimate cost in "auto"
+
+
+def needs_server_codecs(spec: str) -> bool:
+    """
+    True if the compression picked for spec depends on which codecs the server supports, i.e. it is worth asking
+    """
+    spec = spec.strip().lower()
+    return zstandard is not None and (spec == "auto" or spec.startswith("zstd"))
+
+
+class Compression:
+    """
+    A single codec and level used to encode a volume. "none" is gzip at level 0, which keeps the .nii.gz naming
+    the inference server expects while skipping the actual compression work.
+    """
+    def __init__(self, codec: str = "gzip", level: int = None) -> None:
+        if codec == "none":
+            codec, level = "gzip", 0
+        if codec not in CODEC_SUFFIXES:
+            raise ValueError("Unknown compression codec: {}".format(codec))
+
+        self.codec = codec
+        if level is None:
+            level = DEFAULT_COMPRESSLEVEL if codec == "gzip" else DEFAULT_ZSTD_LEVEL
+        self.level = int(level)
+
+    @property
+    def suffix(self) -> str:
+        return CODEC_SUFFIXES[self.codec]
+
+    def encode(self, arr: np.ndarray, spacing: Sequence[float], origin: Sequence[float],
+               direction: Sequence[float] = None) -> bytes:
+        if self.codec == "gzip":
+            return encode_nifti_gz(arr, spacing=spacing, origin=origin, direction=direction, compresslevel=self.level)
+
+        buffer = io.BytesIO()
+        compressor = zstandard.ZstdCompressor(level=self.level)
+        with compressor.stream_writer(buffer, closefd=False) as writer:
+            write_nifti(writer, arr, spacing=spacing, origin=origin, direction=direction)
+        return buffer.getvalue()
+
+    def __repr__(self) -> str:
+        return "{}:{}".format(self.codec, self.level)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Compression) and (self.codec, self.level) == (other.codec, other.level)
+
+    def __hash__(self) -> int:
+        return hash((self.codec, self.level))
+
+
+class CompressionPolicy:
+    """
+    Decides how each volume of a TaskInput is compressed. spec is one of:
+    - "none": no compression (gzip level 0)
+    - "gzip" or "gzip:<level>": gzip with an explicit level (default 6, like sitk.WriteImage)
+    - "zstd" or "zstd:<level>": zstandard, if the module is installed and the server lists "zstd" in server_codecs.
+      Otherwise gzip is used.
+    - "auto": test-compress a sample of each volume with every available option and pick the one minimising
+      encode time + transfer time at upload_bytes_per_sec. Without a throughput measurement, gzip is used.
+    """
+    def __init__(self,
+                 spec: str = "gzip",
+                 server_codecs: Iterable[str] = ("gzip",),
+                 upload_bytes_per_sec: float = None) -> None:
+        self.spec = spec.strip().lower()
+        self.server_codecs = set(server_codecs)
+        self.upload_bytes_per_sec = upload_bytes_per_sec
+
+        self.fixed = None  # Set if spec is not "auto"
+        self.__selected = {}  # dtype -> Compression chosen by "auto"
+        self.__selected_lock = threading.Lock()  # select() is called from the encoder's worker threads
+        if self.spec != "auto":
+            codec, _, level = self.spec.partition(":")
+            fixed = Compression(codec, int(level) if level else None)
+            if not self.codec_available(fixed.codec):
+                fixed = Compression("gzip")
+            self.fixed = fixed
+
+    def codec_available(self, codec: str) -> bool:
+        if codec == "gzip":
+            return True
+        return codec == "zstd" and zstandard is not None and codec in self.server_codecs
+
+    def candidates(self) -> List[Compression]:
+        candidates = [Compression("none"), Compression("gzip", 1), Compression("gzip")]
+        if self.codec_available("zstd"):
+            candidates.append(Compression("zstd", 1))
+            candidates.append(Compression("zstd", DEFAULT_ZSTD_LEVEL))
+        return candidates
+
+    def select(self, arr: np.ndarray) -> Compression:
+        if self.fixed is not None:
+            return self.fixed
+        if not self.upload_bytes_per_sec:
+            return Compression("gzip")
+
+        # Volumes of the same dtype (all images, all contours) compress alike, so each dtype is only measured once
+        with self.__selected_lock:
+            if arr.dtype.str not in self.__selected:
+                self.__selected[arr.dtype.str] = self.__measure(arr)
+            return self.__selected[arr.dtype.str]
+
+    def __measure(self, arr: np.ndarray) -> Compression:
+        sample = self.__sample(arr)
+        scale = arr.nbytes / max(sample.nbytes, 1)
+
+        best, best_cost = None, None
+        for candidate in self.candidates():
+            t0 = time.perf_counter()
+            size = len(candidate.encode(sample, spacing=[1, 1, 1], origin=[0, 0, 0]))
+            encode_sec = time.perf_counter() - t0
+
+            cost = scale * (encode_sec + size / self.upload_bytes_per_sec)
+            if best_cost is None or cost < best_cost:
+                best, best_cost = candidate, cost
+        return best
+
+    @staticmethod
+    def __sample(arr: np.ndarray) -> np.ndarray:
+        # Whole slices around the middle of the volume are more representative than the (often empty) first ones
+        n_slices = max(1, min(len(arr), AUTO_SAMPLE_BYTES // max(arr[0].nbytes, 1)))
+        start = max(0, (len(arr) - n_slices) // 2)
+        return arr[start:start + n_slices]
@@ -0,0 +1,73 @@
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+"""
+Packs several binary contour masks of the same grid into one volume, so they can be shipped as a single NIfTI.
+- "label_map": the masks are disjoint. Voxels of mask i have the value i + 1, background is 0.
+- "bitmask": the masks overlap. Bit i of a voxel is set if the voxel is in mask i.
+"""
+
+LABEL_MAP = "label_map"
+BITMASK = "bitmask"
+MAX_MASKS_PER_VOLUME = 64  # Bits in the widest integer type NIfTI supports
+
+
+def label_map_dtype(n_masks: int) -> np.dtype:
+    return np.dtype(np.uint8) if n_masks <= np.iinfo(np.uint8).max else np.dtype(np.uint16)
+
+
+def bitmask_dtype(n_masks: int) -> np.dtype:
+    for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+        if n_masks <= np.iinfo(dtype).bits:
+            return np.dtype(dtype)
+    raise ValueError("At most {} masks can be packed as a bitmask. Got {}".format(MAX_MASKS_PER_VOLUME, n_masks))
+
+
+def _label_map_to_bitmask(label_map: np.ndarray, n_masks: int) -> np.ndarray:
+    dtype = bitmask_dtype(n_masks)
+    bitmask = np.zeros(label_map.shape, dtype=dtype)
+    labelled = label_map > 0
+    bitmask[labelled] = np.left_shift(dtype.type(1), (label_map[labelled] - 1).astype(dtype))
+    return bitmask
+
+
+def pack_masks(masks: Iterable[np.ndarray], n_masks: int) -> Tuple[np.ndarray, str]:
+    """
+    Packs n_masks masks into one volume and returns it with its encoding (LABEL_MAP or BITMASK).
+    masks may be a generator, so only one mask needs to be in memory at a time. A label map is built until the first
+    overlap is found. Then it is converted to a bitmask once, and the remaining masks are OR'ed in.
+    """
+    label_map, bitmask = None, None
+    for i, mask in enumerate(masks):
+        mask = np.asarray(mask) != 0
+
+        if label_map is None and bitmask is None:
+            label_map = np.zeros(mask.shape, dtype=label_map_dtype(n_masks))
+        packed = label_map if bitmask is None else bitmask
+        if mask.shape != packed.shape:
+            raise ValueError("Contours must share one grid to be packed. Got {} and {}".format(packed.shape, mask.shape))
+
+        if bitmask is None and label_map[mask].any():
+            bitmask = _label_map_to_bitmask(label_map, n_masks)
+            label_map = None
+
+        if bitmask is None:
+            label_map[mask] = i + 1
+        else:
+            bitmask[mask] |= bitmask.dtype.type(1) << bitmask.dtype.type(i)
+
+    if bitmask is not None:
+        return bitmask, BITMASK
+    return label_map, LABEL_MAP
+
+
+def unpack_masks(packed: np.ndarray, encoding: str, n_masks: int) -> List[np.ndarray]:
+    """
+    Inverse of pack_masks
+    """
+    if encoding == LABEL_MAP:
+        return [packed == i + 1 for i in range(n_masks)]
+    elif encoding == BITMASK:
+        return [(packed & packed.dtype.type(1 << i)) != 0 for i in range(n_masks)]
+    raise ValueError("Unknown encoding: {}".format(encoding))
@@ -1,4 +1,7 @@
-from typing import Dict
+import collections
+import re
+import threading
+from typing import Dict, Iterable, Optional, Set
 import os
 import sys
 
@@ -10,6 +13,27 @@ try:  # For production
 except ModuleNotFoundError:  # For Testing
     from testing.mock_classes import XMimImage, XMimContour
 
+SERIES_INSTANCE_UID = 0x0020000E
+DICOM_CACHE_MAX_SERIES = 64  # Series whose tags are kept between posts in this session
+
+# Named groups of tags which can be selected for export instead of listing tag numbers
+DICOM_TAG_GROUPS = {
+    "patient": [0x00100010, 0x00100020, 0x00100030, 0x00100040, 0x00101010, 0x00101020, 0x00101030],
+    "study": [0x0020000D, 0x00200010, 0x00080020, 0x00080030, 0x00081030, 0x00080050],
+    "series": [0x0020000E, 0x00200011, 0x00080060, 0x0008103E, 0x00080021, 0x00200052, 0x00080008],
+    "geometry": [0x00200032, 0x00200037, 0x00280030, 0x00180050, 0x00180088, 0x00280010, 0x00280011,
+                 0x00185100, 0x00201041],
+    "acquisition": [0x00080070, 0x00081090, 0x00180015, 0x00180020, 0x00180022, 0x00180060, 0x00180080,
+                    0x00180081, 0x00180087, 0x00181030, 0x00181150, 0x00181151, 0x00181152, 0x00181210,
+                    0x00180010, 0x00181040],
+    "pixel": [0x00280004, 0x00280100, 0x00280101, 0x00280102, 0x00280103, 0x00281050, 0x00281051,
+              0x00281052, 0x00281053],
+}
+
+# SeriesInstanceUID -> {"available": set of tags, "values": {tag: value}} of the tags fetched so far
+_dicom_cache = collections.OrderedDict()
+_dicom_cache_lock = threading.Lock()
+
 
 def generate_image_meta_information(reference_image: XMimImage) -> Dict:
     """
@@ -29,13 +53,73 @@ def generate_image_meta_information(reference_image: XMimImage) -> Dict:
 
     return meta
 
-def generate_dicom_meta(reference_image: XMimImage) -> Dict:
+def parse_dicom_tags(dicom_tags: str) -> Optional[Set[int]]:
     """
-    Generates a dict with all dicom tags and values
+    Parses a selection of dicom tags separated by comma, semicolon and/or white-space. Each entry is a group name of
+    DICOM_TAG_GROUPS, a tag as "(0018,0050)", "0x00180050" or "00180050", or a decimal tag number like the keys of
+    the exported json. Returns None, i.e. all tags, for "" and "all"
     """
-    tags = reference_image.getInfo().getDicomInfo().getTags()
-    tag_dict = {tag: str(reference_image.getInfo().getDicomInfo().getValue(tag)) for tag in tags}
-    return tag_dict
+    dicom_tags = dicom_tags.strip().lower()
+    if dicom_tags in ["", "all"]:
+        return None
+
+    tags = set()
+    # "(gggg,eeee)" contains a comma, so it is taken out before splitting
+    for group, element in re.findall(r"\(\s*([0-9a-f]{4})\s*,\s*([0-9a-f]{4})\s*\)", dicom_tags):
+        tags.add(int(group + element, 16))
+    dicom_tags = re.sub(r"\([^)]*\)", " ", dicom_tags)
+
+    for entry in re.split(r"[,;\s]+", dicom_tags):
+        if not entry:
+            continue
+        if entry in DICOM_TAG_GROUPS:
+            tags.update(DICOM_TAG_GROUPS[entry])
+        elif entry.startswith("0x"):
+            tags.add(int(entry, 16))
+        elif re.fullmatch(r"[0-9a-f]{8}", entry):
+            tags.add(int(entry, 16))
+        elif entry.isdigit():
+            tags.add(int(entry))
+        else:
+            raise ValueError("Unknown dicom tag or group: {}. Groups are {}".format(entry, list(DICOM_TAG_GROUPS)))
+    return tags
+
+
+def clear_dicom_cache() -> None:
+    with _dicom_cache_lock:
+        _dicom_cache.clear()
+
+
+def generate_dicom_meta(reference_image: XMimImage, tags: Iterable[int] = None) -> Dict:
+    """
+    Generates a dict with dicom tags and values. All tags if tags is None, else those of tags the image has.
+    Values are cached per SeriesInstanceUID for the session, so each tag crosses the MIM bridge only once per series
+    """
+    dicom_info = reference_image.getInfo().getDicomInfo()  # Every call on the MIM objects is a round trip, so fetch once
+    available = set(dicom_info.getTags())
+
+    series_uid = str(dicom_info.getValue(SERIES_INSTANCE_UID)) if SERIES_INSTANCE_UID in available else None
+    with _dicom_cache_lock:
+        entry = _dicom_cache.get(series_uid) if series_uid is not None else None
+        if entry is not None:
+            _dicom_cache.move_to_end(series_uid)
+    if entry is None:
+        entry = {"available": available, "values": {}}
+
+    wanted = entry["available"] if tags is None else entry["available"].intersection(tags)
+    values = entry["values"]
+    for tag in wanted:
+        if tag not in values:
+            values[tag] = str(dicom_info.getValue(tag))
+
+    if series_uid is not None:
+        with _dicom_cache_lock:
+            _dicom_cache[series_uid] = entry
+            _dicom_cache.move_to_end(series_uid)
+            while len(_dicom_cache) > DICOM_CACHE_MAX_SERIES:
+                _dicom_cache.popitem(last=False)
+
+    return {tag: values[tag] for tag in sorted(wanted)}
 
 
 def generate_meta_for_contour(contour: XMimContour) -> Dict:
@@ -0,0 +1,52 @@
+from typing import Optional
+
+import numpy as np
+
+"""
+Lossless downcasting of volumes before they are encoded. MIM hands out wide integer or float64 arrays,
+but CT fits in int16, binary contours in uint8 and most MR in float32.
+"""
+
+# Tried in order. The first one holding the full value range is used
+NARROW_INTEGER_DTYPES = [np.dtype(np.uint8), np.dtype(np.int8), np.dtype(np.uint16), np.dtype(np.int16),
+                         np.dtype(np.uint32), np.dtype(np.int32)]
+
+
+def narrowest_integer_dtype(lo, hi) -> Optional[np.dtype]:
+    for dtype in NARROW_INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return None
+
+
+def narrow(arr: np.ndarray) -> np.ndarray:
+    """
+    Returns arr in the smallest dtype which holds every value exactly, or arr itself if none is smaller.
+    Integer valued floats become integers, other floats become float32 if that is exact.
+    """
+    if arr.dtype == bool:
+        return arr.view(np.uint8)
+    if arr.size == 0 or arr.dtype.kind not in "iuf":
+        return arr
+
+    lo, hi = arr.min(), arr.max()
+    if arr.dtype.kind in "iu":
+        dtype = narrowest_integer_dtype(lo, hi)
+        if dtype is None or dtype.itemsize >= arr.dtype.itemsize:
+            return arr
+        return arr.astype(dtype)
+
+    # Floats. NaN and inf can only be kept as floats
+    if np.isfinite(lo) and np.isfinite(hi):
+        dtype = narrowest_integer_dtype(lo, hi)
+        if dtype is not None and dtype.itemsize < arr.dtype.itemsize:
+            candidate = arr.astype(dtype)
+            if np.array_equal(candidate, arr):
+                return candidate
+
+    if arr.dtype.itemsize > 4:
+        candidate = arr.astype(np.float32)
+        if np.array_equal(candidate, arr):
+            return candidate
+    return arr
@@ -1,12 +1,17 @@
+import collections
+import functools
+import hashlib
 import json
 import os
 import re
 import sys
 import tempfile
+import time
 import zipfile
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
-import SimpleITK as sitk
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
@@ -15,16 +20,77 @@ try:  # For production
 except ModuleNotFoundError:  # For Testing
     from testing.mock_classes import XMimImage, XMimContour
 
+from cropping.cropping import CropBox, CropPolicy
+from disk_cache.disk_cache import DiskCache
+from .compression import Compression, CompressionPolicy
+from .contour_packing import LABEL_MAP, MAX_MASKS_PER_VOLUME, pack_masks
+from .narrowing import narrow
 from .info_generators import generate_image_meta_information, generate_dicom_meta, generate_meta_for_contour
 
+DEFAULT_SPOOL_MAX_SIZE = 512 * 1024 * 1024  # Bytes of zip kept in RAM before spilling to a temporary file on disk
+DEFAULT_MAX_IN_FLIGHT = 4  # Enough to encode all four images of InferenceServer4images at once
+CONTOUR_EXPORT_MODES = ["separate", "packed"]
+
+
+class VolumeJob:
+    """
+    A volume copied out of MIM which is waiting to be encoded and written to the input zip along with its json members
+    """
+    def __init__(self, name: str, arr: np.ndarray, spacing: List[float], origin: List[float],
+                 json_members: List[Tuple[str, Dict]], meta: Dict = None, direction: List[float] = None) -> None:
+        self.name = name  # Member name without suffix. The suffix depends on the compression chosen for the volume
+        self.arr = arr
+        self.spacing = spacing
+        self.origin = origin
+        self.direction = direction  # Row-major 3x3 direction cosines. None for identity
+        self.json_members = json_members
+        self.meta = meta  # The json member describing the volume. The dtype it is encoded with is recorded here
+
+
+def volume_fingerprint(arr: np.ndarray, spacing, origin, direction=None, compression: Compression = None) -> str:
+    """
+    Fast content hash of a volume incl. its geometry and the compression it is encoded with.
+    Used as key in the cache of encoded volumes
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps([arr.dtype.str, list(arr.shape), list(spacing), list(origin),
+                         list(direction) if direction is not None else None, repr(compression)]).encode())
+    h.update(memoryview(np.ascontiguousarray(arr).reshape(-1).view(np.uint8)))
+    return h.hexdigest()
+
 
 class TaskInput:
-    def __init__(self, model_human_readable_id: str, export_dicom_info: bool = False) -> None:
+    def __init__(self,
+                 model_human_readable_id: str,
+                 export_dicom_info: bool = False,
+                 spool_max_size: int = DEFAULT_SPOOL_MAX_SIZE,
+                 max_workers: int = None,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 compression: CompressionPolicy = None,
+                 cache: DiskCache = None,
+                 contour_export_mode: str = "separate",
+                 crop: CropPolicy = None,
+                 narrow_dtypes: bool = True,
+                 dicom_tags: Set[int] = None) -> None:
+        if contour_export_mode not in CONTOUR_EXPORT_MODES:
+            raise ValueError("contour_export_mode must be one of {}. Got {}".format(CONTOUR_EXPORT_MODES, contour_export_mode))
+
         self.model_human_readable_id = model_human_readable_id  # the human_readable_id of the model
         self.export_dicom_info = export_dicom_info  # Bool if dicom should be exported
+        self.dicom_tags = dicom_tags  # Tags to export if export_dicom_info. None for all. See parse_dicom_tags
         self.images: List[XMimImage] = []  # Container for np arrays of images. Added through self.add_array
         self.contours: List[XMimContour] = []  # Container for contours to export
         self.meta_information = None  # Meta information on img_zero. Generated when first image is added with add_image()
+        self.spool_max_size = spool_max_size  # Size in bytes before the input zip is rolled over from RAM to disk
+        self.max_in_flight = max(1, max_in_flight)  # Max volumes held in memory between MIM copy and zip write
+        self.max_workers = max_workers or min(self.max_in_flight, os.cpu_count() or 1)  # Threads encoding volumes
+        self.compression = compression or CompressionPolicy("gzip")  # Codec and level used for each volume
+        self.compression_report: Dict[str, str] = {}  # Member name -> compression used. Filled by get_input_zip()
+        self.cache = cache  # Optional cache of encoded volumes, so unchanged volumes are not re-encoded between posts
+        self.contour_export_mode = contour_export_mode  # "separate": one volume per contour. "packed": up to 64 per volume
+        self.crop = crop  # Optional region of interest. All images and contours are cropped to it before upload
+        self.crop_box: Optional[CropBox] = None  # Box used by the last get_input_zip(). Needed to pad the predictions
+        self.narrow_dtypes = narrow_dtypes  # Downcast volumes losslessly (e.g. int64 -> int16) before encoding
 
 
     def add_image(self, image: XMimImage) -> None:
@@ -40,84 +106,171 @@ class TaskInput:
                         self.contours.append(existing_contour)
                         break
 
-    def __dump_contour(self, contour: XMimContour, out_dir):
+    @staticmethod
+    def __zip_info(arcname: str) -> zipfile.ZipInfo:
+        zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = zipfile.ZIP_STORED  # Volumes are already gzipped, so no DEFLATE on top
+        zinfo.external_attr = 0o600 << 16
+        return zinfo
+
+    def __crop(self, arr: np.ndarray, meta: Dict) -> np.ndarray:
+        # Crops arr to self.crop_box and moves the origin in meta to the first voxel of the cropped array
+        if self.crop_box is None:
+            return arr
+        meta["origin"] = self.crop_box.crop_origin(meta["origin"], meta["spacing"], meta["direction"], arr.shape)
+        meta["crop"] = self.crop_box.to_dict()
+        return self.crop_box.crop(arr)
+
+    def __fetch_contour(self, contour: XMimContour) -> VolumeJob:
         # Dump contours
         meta = generate_meta_for_contour(contour)
-        arr = contour.getData().copyToNPArray()
-        img = sitk.GetImageFromArray(arr)
-        img.SetOrigin(meta["origin"])
-        img.SetSpacing(meta["spacing"])
-        
-        filename = "{}.nii.gz".format(meta["name"])
-        filename = re.sub(r'[<>:"/\\?*]', '.', filename)
-        path = os.path.join(out_dir, filename)
-        sitk.WriteImage(img, path, useCompression=True)
-
-        with open(path.replace(".nii.gz", ".json"), "w") as f:
-            f.write(json.dumps(meta))
-
-    def __dump_image(self, image: XMimImage, index: int, out_dir):
+        arr = self.__crop(contour.getData().copyToNPArray(), meta)
+
+        name = re.sub(r'[<>:"/\\?*]', '.', meta["name"])
+        return VolumeJob(name=name,
+                         arr=arr,
+                         spacing=meta["spacing"],
+                         origin=meta["origin"],
+                         json_members=[("{}.json".format(name), meta)],
+                         meta=meta,
+                         direction=meta["direction"])
+
+    def __fetch_packed_contours(self, contours: List[XMimContour], index: int) -> VolumeJob:
+        # Contours are copied from MIM one at a time and folded into the packed volume right away
+        metas = [generate_meta_for_contour(contour) for contour in contours]
+        masks = (self.__crop(contour.getData().copyToNPArray(), meta) for contour, meta in zip(contours, metas))
+        arr, encoding = pack_masks(masks, len(contours))
+
+        if encoding == LABEL_MAP:
+            labels = {str(i + 1): meta["name"] for i, meta in enumerate(metas)}
+        else:
+            labels = {str(i): meta["name"] for i, meta in enumerate(metas)}
+
+        name = "contours_{}".format(str(10000 + index)[1:])
+        meta = {"encoding": encoding, "labels": labels, "contours": metas}
+        return VolumeJob(name=name,
+                         arr=arr,
+                         spacing=metas[0]["spacing"],
+                         origin=metas[0]["origin"],
+                         json_members=[("{}.json".format(name), meta)],
+                         meta=meta,
+                         direction=metas[0]["direction"])
+
+    def __fetch_image(self, image: XMimImage, index: int) -> VolumeJob:
         # To follow nnUNet convention of id_0000.nii.gz, id_0001.nii.gz, etc.
         scan_id = str(10000 + index)[1:]
 
         # Get np array
         arr = image.getRawData().copyToNPArray()
-        img = sitk.GetImageFromArray(arr)
 
+        # Sets spacing and origin from the image itself
         meta_information = generate_image_meta_information(image)
-        img.SetSpacing(meta_information["spacing"])  # Sets spacing from reference image img_zero
-        img.SetOrigin(meta_information["origin"])
+        if self.crop_box is not None and list(arr.shape) != self.crop_box.full_shape:
+            raise ValueError("Cropping requires all images on the grid of the first image. Got {} and {}"
+                             .format(tuple(arr.shape), tuple(self.crop_box.full_shape)))
+        arr = self.__crop(arr, meta_information)
+        json_members = [("tmp_{}.meta.json".format(scan_id), meta_information)]
+
+        # If export dicom_info is set, dump dicom info
+        if self.export_dicom_info:
+            json_members.append(("tmp_{}.dicom_info.json".format(scan_id), generate_dicom_meta(image, tags=self.dicom_tags)))
 
-        # Make the full path
-        path = os.path.join(out_dir, "tmp_{}.nii.gz".format(scan_id))
+        return VolumeJob(name="tmp_{}".format(scan_id),
+                         arr=arr,
+                         spacing=meta_information["spacing"],
+                         origin=meta_information["origin"],
+                         json_members=json_members,
+                         meta=meta_information,
+                         direction=meta_information["direction"])
 
-        # Write image
-        sitk.WriteImage(img, path, useCompression=True)  # Dumps to tmp_dir
+    def __iter_fetchers(self) -> Iterator[Callable[[], VolumeJob]]:
+        # Images first, in order, then contours if any added
+        for i, image in enumerate(self.images):
+            yield functools.partial(self.__fetch_image, image, i)
+        if self.contour_export_mode == "packed":
+            for i, start in enumerate(range(0, len(self.contours), MAX_MASKS_PER_VOLUME)):
+                yield functools.partial(self.__fetch_packed_contours, self.contours[start:start + MAX_MASKS_PER_VOLUME], i)
+        else:
+            for contour in self.contours:
+                yield functools.partial(self.__fetch_contour, contour)
 
-        # Dump meta
-        with open(os.path.join(out_dir, "tmp_{}.meta.json".format(scan_id)), "w") as f:
-            f.write(json.dumps(meta_information))
+    def __encode(self, job: VolumeJob) -> Tuple[Compression, bytes]:
+        # Runs on a worker thread. zlib releases the GIL, so several volumes are compressed in parallel
+        if self.narrow_dtypes:
+            job.arr = narrow(job.arr)  # Drops the wide copy before encoding
+        if job.meta is not None:
+            job.meta["dtype"] = job.arr.dtype.name
 
-        # If export dicom_info is set, dump dicom info
-        if self.export_dicom_info:
-            dicom_info = generate_dicom_meta(image)
-            dicom_info_str = json.dumps(dicom_info)
-            with open(os.path.join(out_dir, "tmp_{}.dicom_info.json".format(scan_id)), "w") as f:
-                f.write(dicom_info_str)
+        compression = self.compression.select(job.arr)
+        if self.cache is None:
+            return compression, compression.encode(job.arr, spacing=job.spacing, origin=job.origin, direction=job.direction)
 
-    # def __dump_meta(self, out_dir):
-    #     assert self.meta_information
-    #     with open(os.path.join(out_dir, "meta.json"), "w") as f:
-    #         f.write(json.dumps(self.meta_information))
+        key = volume_fingerprint(job.arr, spacing=job.spacing, origin=job.origin, direction=job.direction,
+                                 compression=compression)
+        data = self.cache.get(key)
+        if data is None:
+            data = compression.encode(job.arr, spacing=job.spacing, origin=job.origin, direction=job.direction)
+            self.cache.put(key, data)
+        return compression, data
 
-    def get_input_zip(self) -> tempfile.TemporaryFile:
-        """ 
-        Serves images as a temporary zip file that must be closed manually
-        Images are in order written as tmp_0000.nii.gz, tmp_0001.nii.gz etc.
-        Meta informations is dumped as json in 'meta.json'
-        """
+    def __write(self, z: zipfile.ZipFile, job: VolumeJob, encoded: Future) -> None:
+        compression, data = encoded.result()
+        arcname = job.name + compression.suffix
+        z.writestr(self.__zip_info(arcname), data)
+        self.compression_report[arcname] = repr(compression)
+        for arcname, obj in job.json_members:
+            z.writestr(self.__zip_info(arcname), json.dumps(obj))
 
-        # Tmp dir to save the task elements - is eventually zipped
-        with tempfile.TemporaryDirectory() as tmp_dir:
+    def __compute_crop_box(self) -> None:
+        self.crop_box = self.crop.compute(self.images[0]) if self.crop is not None and self.images else None
 
-            # # Dump meta information as json to tmp_dir
-            # self.__dump_meta(tmp_dir)
+    def fetch_volumes(self) -> List[VolumeJob]:
+        """
+        Copies all volumes, incl. their meta information and crop, out of MIM at once. Call it on the thread MIM is
+        called from, and pass the result to get_input_zip to encode the volumes on any other thread
+        """
+        self.__compute_crop_box()
+        return [fetch() for fetch in self.__iter_fetchers()]
 
-            # Dump images as .nii.gz to tmp_array
-            for i, image in enumerate(self.images):
-                self.__dump_image(image, i, tmp_dir)
+    @staticmethod
+    def __take(jobs: List[VolumeJob]) -> Iterator[Callable[[], VolumeJob]]:
+        # Hands out the jobs fetched before, removing each from jobs, so its volume is freed once written
+        while jobs:
+            yield functools.partial(jobs.pop, 0)
 
-            # Export contours if any added
-            for contour in self.contours:
-                self.__dump_contour(contour, tmp_dir)
+    def get_input_zip(self, jobs: List[VolumeJob] = None) -> tempfile.SpooledTemporaryFile:
+        """ 
+        Serves images as a temporary zip file that must be closed manually
+        Images are in order written as tmp_0000.nii.gz, tmp_0001.nii.gz etc. with meta information in tmp_0000.meta.json etc.
+        Volumes are copied from MIM on the calling thread while up to max_in_flight earlier volumes are encoded on
+        a pool of max_workers threads. The zip is kept in memory until it grows past spool_max_size
+        Given the jobs of fetch_volumes, these are encoded instead (and removed from the list) without any MIM call
+        If a crop is set, every volume is cropped to the box found on the first image and the box is recorded as "crop"
+        in the json members
+        """
+        self.compression_report = {}
+        if jobs is None:
+            self.__compute_crop_box()
+        fetchers = self.__iter_fetchers() if jobs is None else self.__take(jobs)
+        tmp_file = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)  # This is returned and should be closed manually!
+        try:
+            with zipfile.ZipFile(tmp_file, "w", zipfile.ZIP_STORED) as z, \
+                    ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                in_flight = collections.deque()
+                for fetch in fetchers:
+                    # Bound peak memory: the oldest volume must be written before the next one is copied from MIM
+                    while len(in_flight) >= self.max_in_flight:
+                        self.__write(z, *in_flight.popleft())
 
-            # tmp_file is used to make a ZipFile to return
-            tmp_file = tempfile.TemporaryFile()  # This is returned and should be closed manually!
-            with zipfile.ZipFile(tmp_file, "w") as z:
-                for file in os.listdir(tmp_dir):
-                    z.write(os.path.join(tmp_dir, file), arcname=file)
+                    job = fetch()
+                    in_flight.append((job, pool.submit(self.__encode, job)))
 
-        # Here tmp_dir is deleted.
+                # Members are written in submission order, so the zip layout does not depend on thread timing
+                while in_flight:
+                    self.__write(z, *in_flight.popleft())
+        except Exception:
+            tmp_file.close()
+            raise
 
         tmp_file.seek(0)  # Reset tmp_file pointer to allow read anew
         return tmp_file
@@ -0,0 +1,83 @@
+import gzip
+import os
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from task_input.compression import Compression, CompressionPolicy, zstandard
+from testing.mock_classes import XMimImage
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self) -> None:
+        self.arr = XMimImage().getRawData().copyToNPArray()
+        self.spacing = [3, 1.17, 1.17]
+        self.origin = [-120, 120, 55]
+
+    def test_compression_none_is_gzip_level_0(self):
+        none = Compression("none")
+        self.assertEqual((none.codec, none.level, none.suffix), ("gzip", 0, ".nii.gz"))
+
+        raw = gzip.decompress(none.encode(self.arr, self.spacing, self.origin))
+        default = gzip.decompress(Compression("gzip").encode(self.arr, self.spacing, self.origin))
+        self.assertEqual(raw, default)
+        self.assertEqual(len(raw), 352 + self.arr.nbytes)
+
+    def test_compression_unknown_codec(self):
+        self.assertRaises(ValueError, Compression, "lzma")
+
+    def test_policy_fixed(self):
+        self.assertEqual(CompressionPolicy("gzip:1").select(self.arr), Compression("gzip", 1))
+        self.assertEqual(CompressionPolicy("gzip").select(self.arr), Compression("gzip", 6))
+        self.assertEqual(CompressionPolicy("none").select(self.arr), Compression("gzip", 0))
+
+    def test_policy_zstd_not_advertised(self):
+        policy = CompressionPolicy("zstd", server_codecs=["gzip"])
+        self.assertEqual(policy.select(self.arr), Compression("gzip"))
+
+    @unittest.skipIf(zstandard is None, "zstandard not installed")
+    def test_policy_zstd_advertised(self):
+        policy = CompressionPolicy("zstd:1", server_codecs=["gzip", "zstd"])
+        self.assertEqual(policy.select(self.arr), Compression("zstd", 1))
+        self.assertEqual(policy.select(self.arr).suffix, ".nii.zst")
+
+    def test_policy_auto_without_throughput(self):
+        self.assertEqual(CompressionPolicy("auto").select(self.arr), Compression("gzip"))
+
+    def test_policy_auto_fast_link(self):
+        # At (practically) infinite bandwidth only encode time counts
+        policy = CompressionPolicy("auto", upload_bytes_per_sec=1e15)
+        self.assertEqual(policy.select(self.arr), Compression("none"))
+
+    def test_policy_auto_slow_link(self):
+        # At a very slow link only the size counts
+        arr = np.zeros((64, 128, 128), dtype=np.int16)
+        arr[20:40, 30:90, 30:90] = 1000
+        policy = CompressionPolicy("auto", upload_bytes_per_sec=1e3)
+        self.assertGreater(policy.select(arr).level, 0)
+
+    def test_policy_auto_measures_each_dtype_once_across_threads(self):
+        measured = []
+
+        def measure(arr):
+            measured.append(arr.dtype.str)
+            time.sleep(0.1)  # Long enough for every thread to ask before the first measurement is done
+            return Compression("gzip", 1)
+
+        policy = CompressionPolicy("auto", upload_bytes_per_sec=1e6)
+        with mock.patch.object(CompressionPolicy, "_CompressionPolicy__measure", side_effect=measure):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                selected = list(executor.map(policy.select, [self.arr] * 4))
+
+        self.assertEqual(measured, [self.arr.dtype.str])
+        self.assertEqual(selected, [Compression("gzip", 1)] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from task_input.contour_packing import BITMASK, LABEL_MAP, bitmask_dtype, pack_masks, unpack_masks
+
+
+class TestContourPacking(unittest.TestCase):
+    def setUp(self) -> None:
+        self.shape = (4, 8, 8)
+
+    def test_pack_masks_disjoint_is_label_map(self):
+        masks = [np.zeros(self.shape, dtype=bool) for _ in range(3)]
+        for i, mask in enumerate(masks):
+            mask[i] = True
+
+        packed, encoding = pack_masks(iter(masks), len(masks))
+        self.assertEqual(encoding, LABEL_MAP)
+        self.assertEqual(packed.dtype, np.uint8)
+        self.assertEqual(sorted(np.unique(packed).tolist()), [0, 1, 2, 3])
+        for mask, unpacked in zip(masks, unpack_masks(packed, encoding, len(masks))):
+            self.assertTrue(np.array_equal(mask, unpacked))
+
+    def test_pack_masks_overlap_is_bitmask(self):
+        rng = np.random.RandomState(0)
+        masks = [rng.randint(0, 2, self.shape) for _ in range(10)]
+
+        packed, encoding = pack_masks(iter(masks), len(masks))
+        self.assertEqual(encoding, BITMASK)
+        self.assertEqual(packed.dtype, np.uint16)
+        for mask, unpacked in zip(masks, unpack_masks(packed, encoding, len(masks))):
+            self.assertTrue(np.array_equal(mask != 0, unpacked))
+
+    def test_pack_masks_overlap_after_label_map(self):
+        # The first masks are disjoint, so they are already in the label map when the overlap is found
+        masks = [np.zeros(self.shape, dtype=bool) for _ in range(3)]
+        masks[0][0] = True
+        masks[1][1] = True
+        masks[2][:2] = True
+
+        packed, encoding = pack_masks(iter(masks), len(masks))
+        self.assertEqual(encoding, BITMASK)
+        self.assertEqual(packed[0, 0, 0], 0b101)
+        self.assertEqual(packed[1, 0, 0], 0b110)
+        self.assertEqual(packed[3, 0, 0], 0)
+
+    def test_pack_masks_64_bits(self):
+        masks = [np.ones(self.shape, dtype=bool) for _ in range(64)]
+        packed, encoding = pack_masks(iter(masks), len(masks))
+        self.assertEqual(packed.dtype, np.uint64)
+        self.assertTrue(np.all(packed == np.iinfo(np.uint64).max))
+        self.assertTrue(all(m.all() for m in unpack_masks(packed, encoding, len(masks))))
+
+    def test_pack_masks_shape_mismatch(self):
+        masks = [np.zeros(self.shape), np.zeros((1, 1, 1))]
+        self.assertRaises(ValueError, pack_masks, iter(masks), len(masks))
+
+    def test_bitmask_dtype_too_many(self):
+        self.assertEqual(bitmask_dtype(8), np.uint8)
+        self.assertEqual(bitmask_dtype(9), np.uint16)
+        self.assertRaises(ValueError, bitmask_dtype, 65)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,16 +2,19 @@ import json
 import os
 import sys
 import unittest
+from unittest import mock
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from task_input.info_generators import generate_image_meta_information, generate_dicom_meta
+from task_input.info_generators import generate_image_meta_information, generate_dicom_meta, parse_dicom_tags, \
+    clear_dicom_cache, DICOM_TAG_GROUPS
 from testing.mock_classes import XMimImage
 
 
 class TestInfoGenerators(unittest.TestCase):
     def setUp(self) -> None:
         self.img_zero = XMimImage()
+        clear_dicom_cache()
 
     def test_generate_image_meta_information(self):
         meta = generate_image_meta_information(self.img_zero)
@@ -46,6 +49,42 @@ class TestInfoGenerators(unittest.TestCase):
         post_contours = self.img_zero.getContours()
         self.assertEqual(pre_contours, post_contours)
 
+    def test_parse_dicom_tags(self):
+        self.assertIsNone(parse_dicom_tags(""))
+        self.assertIsNone(parse_dicom_tags(" all "))
+        self.assertEqual(parse_dicom_tags("(0018,0050), 0x00280030;0020000E 2097202"),
+                         {0x00180050, 0x00280030, 0x0020000E, 0x00200032})
+        self.assertEqual(parse_dicom_tags("Geometry pixel"),
+                         set(DICOM_TAG_GROUPS["geometry"] + DICOM_TAG_GROUPS["pixel"]))
+        self.assertRaises(ValueError, parse_dicom_tags, "geometry, hest")
+
+    def test_generate_dicom_meta_selected_tags(self):
+        dicom = generate_dicom_meta(self.img_zero, tags=parse_dicom_tags("geometry, 0x00080060, 0x7FE00010"))
+        # Only tags the image has are exported
+        available = set(self.img_zero.getInfo().getDicomInfo().getTags())
+        self.assertEqual(set(dicom.keys()), available.intersection(DICOM_TAG_GROUPS["geometry"] + [0x00080060]))
+        self.assertIn(0x00200032, dicom)
+        self.assertEqual(dicom[0x00080060], "CT")
+
+        all_tags = generate_dicom_meta(self.img_zero)
+        self.assertEqual(len(all_tags), len(self.img_zero.getInfo().getDicomInfo().getTags()))
+
+    def test_generate_dicom_meta_cached_per_series(self):
+        dicom_info = self.img_zero.getInfo().getDicomInfo()
+        with mock.patch.object(dicom_info, "getValue", wraps=dicom_info.getValue) as get_value:
+            geometry = generate_dicom_meta(self.img_zero, tags=DICOM_TAG_GROUPS["geometry"])
+            self.assertEqual(get_value.call_count, 1 + len(geometry))  # SeriesInstanceUID + the tags
+
+            # Same series: only the SeriesInstanceUID is asked again
+            get_value.reset_mock()
+            self.assertEqual(generate_dicom_meta(self.img_zero, tags=DICOM_TAG_GROUPS["geometry"]), geometry)
+            self.assertEqual(get_value.call_count, 1)
+
+            # Tags not fetched before are fetched, the rest comes from the cache
+            get_value.reset_mock()
+            all_tags = generate_dicom_meta(self.img_zero)
+            self.assertEqual(get_value.call_count, 1 + len(all_tags) - len(geometry))
+
     @staticmethod
     def is_serializable(obj):
         try:
@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from task_input.narrowing import narrow, narrowest_integer_dtype
+
+
+class TestNarrowing(unittest.TestCase):
+    def assertNarrowed(self, arr: np.ndarray, dtype) -> None:
+        narrowed = narrow(arr)
+        self.assertEqual(narrowed.dtype, np.dtype(dtype))
+        self.assertTrue(np.array_equal(narrowed, arr))
+
+    def test_narrowest_integer_dtype(self):
+        self.assertEqual(narrowest_integer_dtype(0, 1), np.uint8)
+        self.assertEqual(narrowest_integer_dtype(-1, 1), np.int8)
+        self.assertEqual(narrowest_integer_dtype(-1024, 3071), np.int16)
+        self.assertEqual(narrowest_integer_dtype(0, 40000), np.uint16)
+        self.assertIsNone(narrowest_integer_dtype(-1, 2 ** 40))
+
+    def test_narrow_masks(self):
+        self.assertNarrowed(np.random.randint(0, 2, (4, 8, 8)), np.uint8)
+        self.assertNarrowed(np.random.randint(0, 2, (4, 8, 8)).astype(bool), np.uint8)
+
+    def test_narrow_hu(self):
+        self.assertNarrowed(np.random.randint(-1000, 1200, (4, 8, 8)), np.int16)
+        self.assertNarrowed(np.random.randint(-1000, 1200, (4, 8, 8)).astype(np.float64), np.int16)
+
+    def test_narrow_mr(self):
+        self.assertNarrowed(np.random.rand(4, 8, 8).astype(np.float32).astype(np.float64), np.float32)
+
+    def test_narrow_keeps_lossy(self):
+        self.assertNarrowed(np.random.rand(4, 8, 8), np.float64)
+        self.assertNarrowed(np.array([0, 2 ** 40]), np.int64)
+        with_nan = np.array([0.5, np.nan])
+        self.assertIs(narrow(with_nan), with_nan)
+
+    def test_narrow_never_widens(self):
+        self.assertNarrowed(np.array([-1, 255], dtype=np.int16), np.int16)
+        self.assertNarrowed(np.array([1.5], dtype=np.float32), np.float32)
+
+
+if __name__ == '__main__':
+    unittest.main()
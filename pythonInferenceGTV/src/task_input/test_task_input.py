@@ -1,11 +1,22 @@
+import json
 import os
 import sys
+import tempfile
+import threading
+import time
 import unittest
 import zipfile
+from unittest import mock
+
+import SimpleITK as sitk
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from .task_input import TaskInput
+from .contour_packing import unpack_masks
+from cropping.cropping import CropPolicy
+from disk_cache.disk_cache import DiskCache
 from testing.mock_classes import XMimImage
 
 
@@ -125,6 +136,295 @@ class TestTaskInput(unittest.TestCase):
                     self.assertIn(zipinfo.filename, expected_names)
                     self.assertGreater(zipinfo.file_size, 0)
 
+    def test_get_input_zip_members_are_stored_nifti(self):
+        task_input = TaskInput(model_human_readable_id=self.model_human_readable_id)
+        img = XMimImage()
+        task_input.add_image(img)
+
+        with task_input.get_input_zip() as tmp_file:
+            with zipfile.ZipFile(tmp_file, "r") as zip:
+                for zipinfo in zip.filelist:
+                    self.assertEqual(zipinfo.compress_type, zipfile.ZIP_STORED)
+
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    path = zip.extract("tmp_0000.nii.gz", tmp_dir)
+                    sitk_img = sitk.ReadImage(path)
+
+        self.assertTrue(np.array_equal(sitk.GetArrayFromImage(sitk_img), img.getRawData().copyToNPArray()))
+        self.assertEqual(sitk_img.GetSize(), tuple(reversed(img.getRawData().copyToNPArray().shape)))
+
+    def test_get_input_zip_spool_max_size(self):
+        task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, spool_max_size=1024)
+        task_input.add_image(XMimImage())
+        with task_input.get_input_zip() as tmp_file:
+            self.assertTrue(tmp_file._rolled)
+            with zipfile.ZipFile(tmp_file, "r") as zip:
+                self.assertIsNone(zip.testzip())
+
+        task_input = TaskInput(model_human_readable_id=self.model_human_readable_id)
+        task_input.add_image(XMimImage())
+        with task_input.get_input_zip() as tmp_file:
+            self.assertFalse(tmp_file._rolled)
+
+    def test_get_input_zip_parallel_equals_sequential(self):
+        img = XMimImage()
+        contour_names = ["GTVt", "GTVn", "Parotid_L"]
+        for name in contour_names:
+            img.createNewContour(name)
+        images = [img, XMimImage(), XMimImage(), XMimImage()]
+
+        contents = []
+        for max_workers, max_in_flight in [(1, 1), (4, 4), (2, 8)]:
+            task_input = TaskInput(model_human_readable_id=self.model_human_readable_id,
+                                   max_workers=max_workers,
+                                   max_in_flight=max_in_flight)
+            for image in images:
+                task_input.add_image(image)
+            task_input.set_contours_to_export_from_img(img, contour_names=contour_names)
+
+            with task_input.get_input_zip() as tmp_file:
+                with zipfile.ZipFile(tmp_file, "r") as zip:
+                    contents.append([(name, zip.read(name)) for name in zip.namelist()])
+
+        self.assertEqual(len(contents[0]), 4 * 2 + 3 * 2)
+        for content in contents[1:]:
+            self.assertEqual(content, contents[0])
+
+    def test_get_input_zip_from_fetched_volumes(self):
+        img = XMimImage()
+        img.getRawData().arr = np.full(img.getRawData().arr.shape, -1000)
+        img.getRawData().arr[10:20, 30:90, 40:100] = 40
+        img.createNewContour("GTVt")
+        images = [img, XMimImage()]
+
+        contents, crop_boxes = [], []
+        for fetch_first in [False, True]:
+            task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, crop=CropPolicy("body:0"))
+            for image in images:
+                task_input.add_image(image)
+            task_input.set_contours_to_export_from_img(img, contour_names=["GTVt"])
+
+            if fetch_first:
+                jobs = task_input.fetch_volumes()
+                # Encoding the fetched volumes makes no MIM call
+                with mock.patch.object(XMimImage, "getRawData", side_effect=AssertionError), \
+                        mock.patch.object(XMimImage, "getContours", side_effect=AssertionError):
+                    tmp_file = task_input.get_input_zip(jobs)
+                self.assertEqual(jobs, [])
+            else:
+                tmp_file = task_input.get_input_zip()
+
+            with tmp_file, zipfile.ZipFile(tmp_file, "r") as zip:
+                contents.append([(name, zip.read(name)) for name in zip.namelist()])
+            crop_boxes.append(task_input.crop_box)
+
+        self.assertEqual(contents[0], contents[1])
+        self.assertEqual(crop_boxes[0], crop_boxes[1])
+        self.assertIsNotNone(crop_boxes[0])
+
+    def test_get_input_zip_max_in_flight(self):
+        lock = threading.Lock()
+        counter = {"running": 0, "max_running": 0}
+
+        compression_class = sys.modules[TaskInput.__module__].Compression
+        encode = compression_class.encode
+
+        def slow_encode(*args, **kwargs):
+            with lock:
+                counter["running"] += 1
+                counter["max_running"] = max(counter["running"], counter["max_running"])
+            time.sleep(0.1)
+            with lock:
+                counter["running"] -= 1
+            return encode(*args, **kwargs)
+
+        task_input = TaskInput(model_human_readable_id=self.model_human_readable_id,
+                               max_workers=8,
+                               max_in_flight=2)
+        for i in range(6):
+            task_input.add_image(XMimImage())
+
+        with mock.patch.object(compression_class, "encode", autospec=True, side_effect=slow_encode):
+            with task_input.get_input_zip() as tmp_file:
+                with zipfile.ZipFile(tmp_file, "r") as zip:
+                    self.assertEqual(len(zip.namelist()), 12)
+
+        self.assertGreater(counter["max_running"], 1)
+        self.assertLessEqual(counter["max_running"], 2)
+
+    def test_get_input_zip_encoded_volume_cache(self):
+        img = XMimImage()
+        img.createNewContour("GTVt")
+        images = [img, XMimImage()]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            contents = []
+            for i in range(2):
+                cache = DiskCache(cache_dir, max_bytes=1024 ** 3)
+                task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, cache=cache)
+                for image in images:
+                    task_input.add_image(image)
+                task_input.set_contours_to_export_from_img(img, contour_names=["GTVt"])
+
+                with task_input.get_input_zip() as tmp_file:
+                    with zipfile.ZipFile(tmp_file, "r") as zip:
+                        contents.append({name: zip.read(name) for name in zip.namelist() if name.endswith(".nii.gz")})
+
+                if i == 0:
+                    self.assertEqual((cache.hits, cache.misses), (0, 3))
+                else:
+                    self.assertEqual((cache.hits, cache.misses), (3, 0))
+
+            self.assertEqual(contents[0], contents[1])
+
+            # Edited contour is a miss, untouched images are hits
+            img.getContours()[0].getData().arr = 1 - img.getContours()[0].getData().arr
+            cache = DiskCache(cache_dir, max_bytes=1024 ** 3)
+            task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, cache=cache)
+            for image in images:
+                task_input.add_image(image)
+            task_input.set_contours_to_export_from_img(img, contour_names=["GTVt"])
+            task_input.get_input_zip().close()
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_get_input_zip_encoded_volume_cache_direction(self):
+        img = XMimImage()
+        flipped = [-1, 0, 0, 0, -1, 0, 0, 0, 1]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = DiskCache(cache_dir, max_bytes=1024 ** 3)
+            for direction in [None, flipped]:
+                if direction is not None:
+                    img.getSpace().iop = direction
+                task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, cache=cache)
+                task_input.add_image(img)
+                with task_input.get_input_zip() as tmp_file:
+                    with zipfile.ZipFile(tmp_file, "r") as zip:
+                        data = zip.read("tmp_0000.nii.gz")
+
+            # Same voxels on a rotated grid must not be served the bytes encoded for the original grid
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, "tmp_0000.nii.gz")
+                with open(path, "wb") as f:
+                    f.write(data)
+                np.testing.assert_allclose(sitk.ReadImage(path).GetDirection(), flipped, atol=1e-6)
+
+    def test_get_input_zip_packed_contours(self):
+        img = XMimImage()
+        for name in ["GTVt", "GTVn", "Brain"]:
+            img.createNewContour(name)
+        contours = img.getContours()
+        for i, contour in enumerate(contours[:2]):  # GTVt and GTVn are disjoint, Brain overlaps both
+            contour.getData().arr = np.zeros((4, 8, 8), dtype=np.int64)
+            contour.getData().arr[i] = 1
+        contours[2].getData().arr = np.ones((4, 8, 8), dtype=np.int64)
+
+        for contour_names, encoding, labels in [(["GTVt", "GTVn"], "label_map", {"1": "GTVt", "2": "GTVn"}),
+                                                (["GTVt", "GTVn", "Brain"], "bitmask", {"0": "GTVt", "1": "GTVn", "2": "Brain"})]:
+            task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, contour_export_mode="packed")
+            task_input.add_image(img)
+            task_input.set_contours_to_export_from_img(img, contour_names=contour_names)
+
+            with task_input.get_input_zip() as tmp_file:
+                with zipfile.ZipFile(tmp_file, "r") as zip:
+                    expected_names = generate_expected_files(1, False) + ["contours_0000.nii.gz", "contours_0000.json"]
+                    self.assertEqual(sorted(zip.namelist()), sorted(expected_names))
+
+                    mapping = json.loads(zip.read("contours_0000.json"))
+                    with tempfile.TemporaryDirectory() as tmp_dir:
+                        packed = sitk.GetArrayFromImage(sitk.ReadImage(zip.extract("contours_0000.nii.gz", tmp_dir)))
+
+            self.assertEqual(mapping["encoding"], encoding)
+            self.assertEqual(mapping["labels"], labels)
+            self.assertEqual([meta["name"] for meta in mapping["contours"]], contour_names)
+            unpacked = unpack_masks(packed, encoding, len(contour_names))
+            for i in range(len(contour_names)):
+                self.assertTrue(np.array_equal(contours[i].getData().arr != 0, unpacked[i]))
+
+    def test_get_input_zip_packed_contours_chunks(self):
+        img = XMimImage()
+        contour_names = ["ROI_{}".format(i) for i in range(70)]
+        for name in contour_names:
+            img.createNewContour(name).getData().arr = np.ones((2, 4, 4), dtype=np.int64)
+
+        task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, contour_export_mode="packed")
+        task_input.add_image(img)
+        task_input.set_contours_to_export_from_img(img, contour_names=contour_names)
+
+        with task_input.get_input_zip() as tmp_file:
+            with zipfile.ZipFile(tmp_file, "r") as zip:
+                mappings = [json.loads(zip.read("contours_000{}.json".format(i))) for i in range(2)]
+                self.assertNotIn("contours_0002.json", zip.namelist())
+
+        self.assertEqual([len(m["labels"]) for m in mappings], [64, 6])
+        self.assertEqual(mappings[1]["labels"]["0"], "ROI_64")
+
+    def test_get_input_zip_crop_to_contours(self):
+        img = XMimImage()
+        gtv = img.createNewContour("GTVt")
+        gtv.getData().arr = np.zeros_like(gtv.getData().arr)
+        gtv.getData().arr[30:34, 100:120, 60:80] = 1
+        images = [img, XMimImage()]
+
+        task_input = TaskInput(model_human_readable_id=self.model_human_readable_id,
+                               crop=CropPolicy("contours:0", contour_names=["GTVt"]))
+        for image in images:
+            task_input.add_image(image)
+        task_input.set_contours_to_export_from_img(img, contour_names=["GTVt"])
+
+        with task_input.get_input_zip() as tmp_file:
+            with zipfile.ZipFile(tmp_file, "r") as zip:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    volumes = {name: sitk.ReadImage(zip.extract(name, tmp_dir))
+                               for name in ["tmp_0000.nii.gz", "tmp_0001.nii.gz", "GTVt.nii.gz"]}
+                metas = {name: json.loads(zip.read(name)) for name in ["tmp_0000.meta.json", "GTVt.json"]}
+
+        box = task_input.crop_box
+        self.assertEqual(box.offset, [30, 50, 30])
+        self.assertEqual(box.size, [4, 10, 10])
+        for i, image in enumerate(images):
+            arr = sitk.GetArrayFromImage(volumes["tmp_000{}.nii.gz".format(i)])
+            self.assertTrue(np.array_equal(arr, image.getRawData().copyToNPArray()[30:34, 50:60, 30:40]))
+        self.assertEqual(np.count_nonzero(sitk.GetArrayFromImage(volumes["GTVt.nii.gz"]) == 0), 0)
+
+        self.assertEqual(metas["tmp_0000.meta.json"]["crop"], box.to_dict())
+        self.assertEqual(metas["GTVt.json"]["crop"], box.to_dict())
+        self.assertTrue(np.allclose(volumes["tmp_0000.nii.gz"].GetOrigin(), metas["tmp_0000.meta.json"]["origin"]))
+        self.assertNotEqual(metas["tmp_0000.meta.json"]["origin"], list(img.getSpace().getDicomCenter()))
+
+    def test_get_input_zip_crop_other_grid(self):
+        other = XMimImage()
+        other.getRawData().arr = other.getRawData().arr[:32]
+        task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, crop=CropPolicy("body"))
+        task_input.add_image(XMimImage())
+        task_input.add_image(other)
+        task_input.images[0].getRawData().arr[:, :10] = -1000  # Something to crop away
+        self.assertRaises(ValueError, task_input.get_input_zip)
+
+    def test_get_input_zip_narrows_dtypes(self):
+        img = XMimImage()
+        img.createNewContour("GTVt")
+
+        for narrow_dtypes, image_dtype, contour_dtype in [(True, "int16", "uint8"), (False, "int64", "int64")]:
+            task_input = TaskInput(model_human_readable_id=self.model_human_readable_id, narrow_dtypes=narrow_dtypes)
+            task_input.add_image(img)
+            task_input.set_contours_to_export_from_img(img, contour_names=["GTVt"])
+
+            with task_input.get_input_zip() as tmp_file:
+                with zipfile.ZipFile(tmp_file, "r") as zip:
+                    self.assertEqual(json.loads(zip.read("tmp_0000.meta.json"))["dtype"], image_dtype)
+                    self.assertEqual(json.loads(zip.read("GTVt.json"))["dtype"], contour_dtype)
+                    with tempfile.TemporaryDirectory() as tmp_dir:
+                        arr = sitk.GetArrayFromImage(sitk.ReadImage(zip.extract("tmp_0000.nii.gz", tmp_dir)))
+
+            self.assertEqual(arr.dtype, np.dtype(image_dtype))
+            self.assertTrue(np.array_equal(arr, img.getRawData().copyToNPArray()))
+
+    def test_contour_export_mode_illegal(self):
+        self.assertRaises(ValueError, TaskInput, self.model_human_readable_id, contour_export_mode="merged")
+
+
 def generate_expected_files(number_of_images: int, dicom: bool):
     expected_names = []
     for i in range(number_of_images):
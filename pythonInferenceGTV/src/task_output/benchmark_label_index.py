@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from task_output.label_index import LabelIndex
+
+"""
+Compares splitting a label volume into bool masks per label by full volume comparison (as get_output_as_label_array_dict
+did before) with LabelIndex. Run from src with: python -m task_output.benchmark_label_index
+"""
+
+SHAPE = (64, 256, 256)  # Contour grid of the mock images, i.e. image_dim * multiplier
+REPEATS = 3
+
+
+def make_label_volume(n_labels: int, shape=SHAPE) -> np.ndarray:
+    # Blocky structures of different sizes covering about a third of the volume, like a multi structure OAR output
+    rng = np.random.RandomState(n_labels)
+    arr = np.zeros(shape, dtype=np.uint8)
+    for label in range(1, n_labels + 1):
+        size = [max(1, int(s * rng.uniform(0.05, 0.3))) for s in shape]
+        start = [rng.randint(0, s - z + 1) for s, z in zip(shape, size)]
+        arr[tuple(slice(a, a + z) for a, z in zip(start, size))] = label
+    return arr
+
+
+def split_by_comparison(arr: np.ndarray, label_dict):
+    label_array_dict = {}
+    for i, label in label_dict.items():
+        tmp_array = np.zeros_like(arr, dtype=bool)
+        tmp_array[arr == int(i)] = True
+        label_array_dict[label] = tmp_array
+    return label_array_dict
+
+
+def split_by_label_index(arr: np.ndarray, label_dict):
+    label_index = LabelIndex(arr)
+    return {label: label_index.mask(int(i)) for i, label in label_dict.items()}
+
+
+def best_of(func, *args) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main():
+    print("{:>8} {:>14} {:>14} {:>9}".format("labels", "comparison [s]", "LabelIndex [s]", "speedup"))
+    for n_labels in [10, 50, 100]:
+        arr = make_label_volume(n_labels)
+        label_dict = {str(i): "ROI_{}".format(i) for i in range(1, n_labels + 1)}
+
+        expected = split_by_comparison(arr, label_dict)
+        result = split_by_label_index(arr, label_dict)
+        assert all(np.array_equal(expected[k], result[k]) for k in expected)
+
+        old = best_of(split_by_comparison, arr, label_dict)
+        new = best_of(split_by_label_index, arr, label_dict)
+        print("{:>8} {:>14.3f} {:>14.3f} {:>8.1f}x".format(n_labels, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
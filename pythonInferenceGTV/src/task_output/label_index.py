@@ -0,0 +1,130 @@
+import collections.abc
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from task_output.sparse_labels import SparseLabelVolume
+from task_output.upsampling import upsample_nearest, upsampled_shape
+
+
+SLAB_VOXELS = 2 ** 19  # Voxels indexed at a time. Caps the transient index arrays at about 10 MB
+
+
+class LabelIndex:
+    """
+    Splits a label volume into per-label masks with a single pass over the volume.
+    The volume is indexed in slabs of whole slices of at most SLAB_VOXELS voxels. The foreground voxels of each slab
+    are sorted by label, which gives the bounding box of every label. Each mask is then a zeroed array where only the
+    voxels inside the box of its label are compared, instead of the full volume per label
+    """
+    def __init__(self, arr: np.ndarray) -> None:
+        self.arr = arr
+
+        boxes: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}  # value -> (start, stop) in numpy order
+        slab_size = max(1, SLAB_VOXELS // max(int(np.prod(arr.shape[1:])), 1))
+        for offset in range(0, arr.shape[0], slab_size):
+            values, starts, stops = self.__slab_boxes(arr[offset:offset + slab_size])
+            starts[:, 0] += offset
+            stops[:, 0] += offset
+            for value, start, stop in zip(values.tolist(), starts, stops):
+                if value in boxes:
+                    start, stop = np.minimum(boxes[value][0], start), np.maximum(boxes[value][1], stop)
+                boxes[value] = (start, stop)
+
+        self.values = np.array(sorted(boxes), dtype=arr.dtype)
+        self.box_start = np.array([boxes[value][0] for value in self.values.tolist()], dtype=np.int64)
+        self.box_stop = np.array([boxes[value][1] for value in self.values.tolist()], dtype=np.int64)
+
+    @staticmethod
+    def __slab_boxes(slab: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Values present in slab with the start and stop of their boxes. Indices are uint32, as a slab is small
+        flat = slab.reshape(-1)
+        foreground = np.flatnonzero(flat).astype(np.uint32)
+        values = flat[foreground]
+        order = np.argsort(values, kind="stable")  # Radix sort for the small integer dtypes of label maps
+        values, foreground = values[order], foreground[order]
+        del order
+
+        starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+        starts = np.concatenate([[0], starts]) if len(values) else starts
+        box_start = np.empty((len(starts), slab.ndim), dtype=np.int64)
+        box_stop = np.empty((len(starts), slab.ndim), dtype=np.int64)
+        stride = len(flat)
+        for axis, dim in enumerate(slab.shape):
+            stride //= dim
+            coords = foreground // np.uint32(stride) % np.uint32(dim)
+            if len(starts):
+                box_start[:, axis] = np.minimum.reduceat(coords, starts)
+                box_stop[:, axis] = np.maximum.reduceat(coords, starts) + 1
+        return values[starts], box_start, box_stop
+
+    def labels(self) -> np.ndarray:
+        """
+        The nonzero values present in the volume
+        """
+        return self.values
+
+    def bounding_box(self, value):
+        """
+        Slices of the bounding box of value or None if it is not in the volume
+        """
+        k = np.searchsorted(self.values, value)
+        if k == len(self.values) or self.values[k] != value:
+            return None
+        return tuple(slice(int(start), int(stop)) for start, stop in zip(self.box_start[k], self.box_stop[k]))
+
+    def mask(self, value, scale: Sequence[int] = None) -> np.ndarray:
+        """
+        Bool mask of the voxels equal to value. Same result as arr == value.
+        With scale, the mask is upsampled by these integer factors. Only the bounding box of value is upsampled
+        """
+        if value == 0:  # Background is not indexed
+            return self.arr == 0 if scale is None else upsample_nearest(self.arr == 0, scale)
+
+        scale = scale or [1] * self.arr.ndim
+        mask = np.zeros(upsampled_shape(self.arr.shape, scale), dtype=bool)
+        box = self.bounding_box(value)
+        if box is not None:
+            fine_box = tuple(slice(b.start * f, b.stop * f) for b, f in zip(box, scale))
+            upsample_nearest(self.arr[box] == value, scale, out=mask[fine_box])
+        return mask
+
+
+class LabelMaskMapping(collections.abc.Mapping):
+    """
+    Read-only {label name: bool mask} over the (dense or sparse) label volumes of a TaskOutput.
+    Masks are built when accessed and are not kept, so iterating over items() holds about one mask at a time.
+    A label name found in several volumes maps to the last one, like assigning to a dict would.
+    scales optionally gives the factor each volume's masks are upsampled by (None to keep a volume as it is)
+    """
+    def __init__(self,
+                 json_nii_list: List[Tuple[Dict, Union[np.ndarray, SparseLabelVolume]]],
+                 scales: List[Optional[Sequence[int]]] = None) -> None:
+        self.__arrays = [arr for _, arr in json_nii_list]
+        self.__scales = scales or [None] * len(json_nii_list)
+        self.__sources: Dict[str, Tuple[int, int]] = {}  # label name -> (volume, value in volume)
+        for volume, (label_dict, _) in enumerate(json_nii_list):
+            for i, label in label_dict.items():
+                self.__sources[label] = (volume, int(i))
+
+        self.__label_indices: Dict[int, LabelIndex] = {}  # Built on first access to a label of the volume
+        self.__lock = threading.Lock()
+
+    def __label_index(self, volume: int) -> Union[LabelIndex, SparseLabelVolume]:
+        if isinstance(self.__arrays[volume], SparseLabelVolume):  # Decodes masks itself
+            return self.__arrays[volume]
+        with self.__lock:
+            if volume not in self.__label_indices:
+                self.__label_indices[volume] = LabelIndex(self.__arrays[volume])
+            return self.__label_indices[volume]
+
+    def __getitem__(self, label: str) -> np.ndarray:
+        volume, value = self.__sources[label]
+        return self.__label_index(volume).mask(value, scale=self.__scales[volume])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__sources)
+
+    def __len__(self) -> int:
+        return len(self.__sources)
@@ -0,0 +1,121 @@
+import io
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+from cropping.cropping import CropBox
+from task_output.upsampling import upsample_nearest, upsampled_shape
+
+"""
+Sparse alternatives to dense .nii.gz label maps for predictions covering a small part of the volume.
+The label json declares the format and the shape of the volume (numpy order) next to the labels: {"1": "GTVt", "format": "rle", "shape": [64, 256, 256]}. The payload is "{prefix}.npz" with per label value:
+- "rle": "runs_{value}", an (n, 2) integer array of (start, length) runs of the label in the C-order flattened volume
+- "bitpacked": "box_{value}", the bounding box [z0, y0, x0, z1, y1, x1] (stop exclusive) of the label, and
+  "bits_{value}", np.packbits of the C-order flattened mask inside the box
+A value without payload is absent from the volume. Background (0) can not be requested from a sparse volume.
+"""
+
+FORMAT_NIFTI = "nifti"  # Dense .nii.gz label map (default)
+FORMAT_RLE = "rle"
+FORMAT_BITPACKED = "bitpacked"
+SPARSE_FORMATS = [FORMAT_RLE, FORMAT_BITPACKED]
+
+
+def encode_sparse_labels(arr: np.ndarray, fmt: str) -> Dict[str, np.ndarray]:
+    """
+    Payload of the label volume arr in the sparse format fmt. Inverse of SparseLabelVolume
+    """
+    payload = {}
+    for value in np.unique(arr):
+        if value == 0:
+            continue
+        mask = arr == value
+        if fmt == FORMAT_RLE:
+            padded = np.concatenate([[0], mask.reshape(-1).view(np.int8), [0]])
+            edges = np.diff(padded)
+            starts, stops = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+            dtype = np.uint32 if mask.size <= np.iinfo(np.uint32).max else np.uint64
+            payload["runs_{}".format(value)] = np.stack([starts, stops - starts], axis=1).astype(dtype)
+        elif fmt == FORMAT_BITPACKED:
+            coords = np.nonzero(mask)
+            start, stop = [int(c.min()) for c in coords], [int(c.max()) + 1 for c in coords]
+            box = tuple(slice(a, b) for a, b in zip(start, stop))
+            payload["box_{}".format(value)] = np.array(start + stop, dtype=np.uint32)
+            payload["bits_{}".format(value)] = np.packbits(mask[box].reshape(-1))
+        else:
+            raise ValueError("Sparse format must be one of {}. Got {}".format(SPARSE_FORMATS, fmt))
+    return payload
+
+
+def decode_npz(data: bytes) -> Dict[str, np.ndarray]:
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+class SparseLabelVolume:
+    """
+    A label volume in a sparse format. Serves masks like LabelIndex, decoding only the voxels of the requested label
+    into a zeroed full size mask. Cropped predictions are placed by pad instead of padding a dense array
+    """
+    def __init__(self, fmt: str, shape: Sequence[int], payload: Mapping[str, np.ndarray]) -> None:
+        if fmt not in SPARSE_FORMATS:
+            raise ValueError("Sparse format must be one of {}. Got {}".format(SPARSE_FORMATS, fmt))
+        self.format = fmt
+        self.shape = tuple(int(s) for s in shape)
+        self.payload = payload
+        self.offset = (0,) * len(self.shape)  # Position of the payload in the full grid
+        self.full_shape = self.shape
+
+    def pad(self, crop: CropBox) -> "SparseLabelVolume":
+        """
+        Places the volume, which covers crop, in the full grid of crop. Nothing is decoded
+        """
+        scale = crop.scale_for(self.shape, reference=crop.size)
+        self.offset = tuple(o * f for o, f in zip(crop.offset, scale))
+        self.full_shape = tuple(s * f for s, f in zip(crop.full_shape, scale))
+        return self
+
+    def __decode_box(self, value) -> Tuple[List[int], np.ndarray]:
+        """
+        Returns the start of the bounding box of value and the mask inside it, or None if value is absent
+        """
+        if self.format == FORMAT_BITPACKED:
+            key = "box_{}".format(value)
+            if key not in self.payload:
+                return None
+            box = [int(b) for b in self.payload[key]]
+            start, stop = box[:len(self.shape)], box[len(self.shape):]
+            size = [b - a for a, b in zip(start, stop)]
+            bits = np.unpackbits(self.payload["bits_{}".format(value)], count=int(np.prod(size)))
+            return start, bits.view(bool).reshape(size)
+
+        key = "runs_{}".format(value)
+        if key not in self.payload or len(self.payload[key]) == 0:
+            return None
+        runs = self.payload[key].astype(np.int64)
+        starts, lengths = runs[:, 0], runs[:, 1]
+        # Flat index of every voxel of every run: the start of its run plus its position within the run
+        first = np.cumsum(lengths) - lengths
+        flat = np.repeat(starts - first, lengths) + np.arange(int(lengths.sum()))
+        coords = np.unravel_index(flat, self.shape)
+        start = [int(c.min()) for c in coords]
+        box = np.zeros([int(c.max()) + 1 - a for c, a in zip(coords, start)], dtype=bool)
+        box[tuple(c - a for c, a in zip(coords, start))] = True
+        return start, box
+
+    def mask(self, value, scale: Sequence[int] = None) -> np.ndarray:
+        """
+        Bool mask of value on the full grid, upsampled by scale if given
+        """
+        if value == 0:
+            raise ValueError("Background can not be served from a sparse label volume")
+
+        scale = scale or [1] * len(self.shape)
+        mask = np.zeros(upsampled_shape(self.full_shape, scale), dtype=bool)
+        decoded = self.__decode_box(value)
+        if decoded is not None:
+            start, box = decoded
+            fine_box = tuple(slice((o + a) * f, (o + a + s) * f)
+                             for o, a, s, f in zip(self.offset, start, box.shape, scale))
+            upsample_nearest(box, scale, out=mask[fine_box])
+        return mask
@@ -0,0 +1,181 @@
+import struct
+import zipfile
+import zlib
+from typing import List, Optional, Tuple
+
+"""
+Incremental reader of zip archives as they are downloaded. Members are returned as soon as all of their bytes have
+arrived, instead of waiting for the central directory at the end of the archive.
+"""
+
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_DIRECTORY_SIGNATURE = 0x02014b50
+END_OF_CENTRAL_DIRECTORY_SIGNATURE = 0x06054b50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+LOCAL_HEADER_FORMAT = "<IHHHHHIIIHH"
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+ZIP64_EXTRA_ID = 0x0001
+
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+
+
+class _Member:
+    def __init__(self, name: str, flags: int, method: int, crc: int, compressed_size: Optional[int],
+                 zip64: bool) -> None:
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size  # None if only known from the data descriptor after the data
+        self.has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        self.zip64 = zip64
+        self.consumed = 0  # Compressed bytes read so far
+        self.data = bytearray()
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == zipfile.ZIP_DEFLATED else None
+
+
+class StreamingZipReader:
+    """
+    Feed the bytes of a zip archive in order with feed(). Each call returns the (name, data) of the members which
+    were completed by it. Supports STORED and DEFLATED members incl. data descriptors and zip64 sizes.
+    If a member can not be read in a stream (encrypted, other compression, or STORED without its size in the local
+    header) streamable is set to False and the rest is ignored. The caller must then read the full archive with zipfile.
+    """
+    def __init__(self) -> None:
+        self.streamable = True
+        self.finished = False  # True once the central directory is reached
+        self.__buffer = bytearray()
+        self.__member: Optional[_Member] = None
+        self.__awaiting_descriptor = False
+
+    def feed(self, data: bytes) -> List[Tuple[str, bytes]]:
+        completed = []
+        if not self.streamable or self.finished:
+            return completed
+        self.__buffer += data
+
+        while self.streamable and not self.finished:
+            if self.__awaiting_descriptor:
+                if not self.__read_descriptor():
+                    break
+                completed.append(self.__complete())
+            elif self.__member is not None:
+                if not self.__read_data():
+                    break
+                if self.__member.has_descriptor:
+                    self.__awaiting_descriptor = True
+                else:
+                    completed.append(self.__complete())
+            elif not self.__read_header():
+                break
+        return completed
+
+    def close(self) -> None:
+        """
+        Raises zipfile.BadZipFile if the archive ended before its central directory, like zipfile does for an empty or
+        truncated archive
+        """
+        if not self.streamable or self.finished:
+            return
+        if self.__member is not None or self.__buffer:
+            raise zipfile.BadZipFile("Zip archive ended within a member")
+        raise zipfile.BadZipFile("Zip archive ended before its central directory")
+
+    def __unsupported(self) -> bool:
+        self.streamable = False
+        self.__buffer = bytearray()
+        self.__member = None
+        return False
+
+    def __read_header(self) -> bool:
+        if len(self.__buffer) < 4:
+            return False
+        signature = struct.unpack("<I", self.__buffer[:4])[0]
+        if signature in (CENTRAL_DIRECTORY_SIGNATURE, END_OF_CENTRAL_DIRECTORY_SIGNATURE):
+            self.finished = True
+            self.__buffer = bytearray()
+            return False
+        if signature != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile("Bad local file header signature: {:#x}".format(signature))
+        if len(self.__buffer) < LOCAL_HEADER_SIZE:
+            return False
+
+        _, _, flags, method, _, _, crc, compressed_size, _, name_len, extra_len = \
+            struct.unpack(LOCAL_HEADER_FORMAT, self.__buffer[:LOCAL_HEADER_SIZE])
+        end = LOCAL_HEADER_SIZE + name_len + extra_len
+        if len(self.__buffer) < end:
+            return False
+
+        name_bytes = bytes(self.__buffer[LOCAL_HEADER_SIZE:LOCAL_HEADER_SIZE + name_len])
+        name = name_bytes.decode("utf-8" if flags & 0x800 else "cp437")
+        extra = bytes(self.__buffer[LOCAL_HEADER_SIZE + name_len:end])
+        del self.__buffer[:end]
+
+        zip64 = False
+        pos = 0
+        while pos + 4 <= len(extra):
+            extra_id, size = struct.unpack("<HH", extra[pos:pos + 4])
+            if extra_id == ZIP64_EXTRA_ID:
+                zip64 = True
+                if compressed_size == 0xFFFFFFFF and size >= 16:
+                    compressed_size = struct.unpack("<Q", extra[pos + 12:pos + 20])[0]  # After the uncompressed size
+            pos += 4 + size
+
+        if flags & FLAG_ENCRYPTED or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            return self.__unsupported()
+        has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        if has_descriptor and method == zipfile.ZIP_STORED:
+            return self.__unsupported()  # The end of the data can not be found without its size
+
+        self.__member = _Member(name=name,
+                                flags=flags,
+                                method=method,
+                                crc=crc,
+                                compressed_size=None if has_descriptor else compressed_size,
+                                zip64=zip64)
+        return True
+
+    def __read_data(self) -> bool:
+        # Returns True once all compressed data of the current member is read
+        member = self.__member
+        if member.compressed_size is not None:
+            chunk = self.__buffer[:member.compressed_size - member.consumed]
+            del self.__buffer[:len(chunk)]
+        else:
+            chunk, self.__buffer = self.__buffer, bytearray()
+        member.consumed += len(chunk)
+
+        if member.decompressor is None:
+            member.data += chunk
+            return member.consumed == member.compressed_size
+
+        member.data += member.decompressor.decompress(bytes(chunk))
+        if member.decompressor.eof:
+            # Bytes past the end of the deflate stream belong to the data descriptor or the next member
+            self.__buffer = bytearray(member.decompressor.unused_data) + self.__buffer
+            return True
+        if member.compressed_size is not None and member.consumed == member.compressed_size:
+            raise zipfile.BadZipFile("Deflate stream of {} is truncated".format(member.name))
+        return False
+
+    def __read_descriptor(self) -> bool:
+        size_format = "<IQQ" if self.__member.zip64 else "<III"
+        size = struct.calcsize(size_format)
+        if len(self.__buffer) < 4:
+            return False
+        offset = 4 if struct.unpack("<I", self.__buffer[:4])[0] == DATA_DESCRIPTOR_SIGNATURE else 0
+        if len(self.__buffer) < offset + size:
+            return False
+        self.__member.crc = struct.unpack(size_format, self.__buffer[offset:offset + size])[0]
+        del self.__buffer[:offset + size]
+        return True
+
+    def __complete(self) -> Tuple[str, bytes]:
+        member = self.__member
+        self.__member = None
+        self.__awaiting_descriptor = False
+
+        data = bytes(member.data)
+        if zlib.crc32(data) & 0xFFFFFFFF != member.crc:
+            raise zipfile.BadZipFile("Bad CRC-32 for member {}".format(member.name))
+        return member.name, data
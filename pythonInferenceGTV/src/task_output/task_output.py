@@ -1,70 +1,140 @@
+import io
 import json
 import os
 import tempfile
 import zipfile
-from typing import Dict, Tuple, List
+from typing import Any, BinaryIO, Callable, Dict, Tuple, List, Mapping, Sequence, Union
 
 import SimpleITK as sitk
 import numpy as np
 
+from cropping.cropping import CropBox
+from nifti_codec.exceptions import UnsupportedNiftiError
+from nifti_codec.nifti_codec import decode_nifti_gz, read_nifti_gz
 from task_output.exceptions import NiftiNamingError, PredictionLoadError
+from task_output.label_index import LabelMaskMapping
+from task_output.sparse_labels import FORMAT_NIFTI, SPARSE_FORMATS, SparseLabelVolume, decode_npz
+
+GRID_KEY = "grid"  # Optional key of a label json telling which grid its volume is on
+GRID_CONTOUR = "contour"  # The contour grid, i.e. the image grid times the contour multiplier (default)
+GRID_IMAGE = "image"  # The image grid. Upsampled to the contour grid on the client
+GRIDS = [GRID_CONTOUR, GRID_IMAGE]
+FORMAT_KEY = "format"  # Optional key of a label json with the format of its volume. See sparse_labels.py
+SHAPE_KEY = "shape"  # Shape of a sparse volume
+
+
+def decode_output_member(name: str, data: bytes):
+    """
+    Decodes a member of an output zip: the dict of a .json, the array of a .nii.gz, else the bytes as they are
+    """
+    if name.endswith(".json"):
+        return json.loads(data)
+    if name.endswith(".npz"):
+        return decode_npz(data)
+    if not name.endswith(".nii.gz"):
+        return data
+    try:
+        return decode_nifti_gz(data)
+    except UnsupportedNiftiError:
+        # Exotic header, e.g. scaled voxel values or NIfTI-2. Let SimpleITK deal with it through a temporary file
+        with tempfile.TemporaryDirectory() as output_dir:
+            path = os.path.join(output_dir, "prediction.nii.gz")
+            with open(path, "wb") as f:
+                f.write(data)
+            return sitk.GetArrayFromImage(sitk.ReadImage(path))
 
 
 class TaskOutput:
     """
     Makes an object which represents the returned bytes of inference_client.py:get_task
     The retrieved zip must contain "{prefix}.nii.gz"s with predictions and "{prefix}.json"s with the same prefix for the nifti and the json.
+    If the input was cropped, crop is the CropBox it was cropped with and predictions are padded back into the full grid.
+    The zip is given as bytes or a file object (output_zip_bytes), or as members already decoded with
+    decode_output_member while it was downloaded ({name: decoded member or the exception raised decoding it}).
+    A label json may contain "grid": "image" next to the labels if its volume is on the image grid instead of the
+    contour grid. Such volumes are smaller to send and are upsampled when masks are served.
+    A label json may also declare a sparse "format" ("rle" or "bitpacked") and "shape" of its volume, which is then
+    read from "{prefix}.npz" instead of "{prefix}.nii.gz". See sparse_labels.py
     """
-    def __init__(self, output_zip_bytes: bytes) -> None:
-        self.json_nii_list: List[Tuple[Dict, np.ndarray]] = []  # path to json in [0] and path to pred in [1]
+    def __init__(self,
+                 output_zip_bytes: Union[bytes, BinaryIO] = None,
+                 crop: CropBox = None,
+                 members: Dict[str, Any] = None) -> None:
+        # Label dict in [0] and the label volume in [1], dense or sparse
+        self.json_nii_list: List[Tuple[Dict, Union[np.ndarray, SparseLabelVolume]]] = []
+        self.grids: List[str] = []  # Grid of each volume of json_nii_list
+        self.formats: List[str] = []  # Format of each volume of json_nii_list
+        self.crop = crop
 
-        # Load output zip bytes to a TemporaryFile
-        with tempfile.TemporaryFile(suffix=".zip") as output_zip:
-            output_zip.write(output_zip_bytes)
-            output_zip.seek(0)
+        if members is not None:
+            self.__find_label_json_and_nii_members(list(members),
+                                                   read_json=lambda name: self.__decoded(members, name),
+                                                   read_nii=lambda name: self.__decoded(members, name))
+            return
 
-            # Make a temporary directory to load output nifti and label_json
-            with tempfile.TemporaryDirectory() as output_dir:
-                with zipfile.ZipFile(output_zip) as zip:
-                    zip.extractall(output_dir)
-
-                # Set self.json_nii_list
-                self.__find_label_json_and_nii_paths_in_dir(output_dir)
-
-        # <-- output_zip is closed here -->
+        # Members are decoded straight from the zip in memory. Nothing is extracted to disk
+        if isinstance(output_zip_bytes, (bytes, bytearray)):
+            output_zip_bytes = io.BytesIO(output_zip_bytes)
+        with zipfile.ZipFile(output_zip_bytes) as zip:
+            # Set self.json_nii_list
+            self.__find_label_json_and_nii_members(zip.namelist(),
+                                                   read_json=lambda name: json.loads(zip.read(name)),
+                                                   read_nii=lambda name: self.__read_nii(zip, name))
 
-    def __load_json(self, path: str) -> Dict:
-        with open(path) as r:
-            return json.loads(r.read())
+    @staticmethod
+    def __decoded(members: Dict[str, Any], name: str):
+        if isinstance(members[name], Exception):
+            raise members[name]
+        return members[name]
 
-    def __find_label_json_and_nii_paths_in_dir(self, directory: str) -> None:
-
-        for fol, subs, files in os.walk(directory):
-            for file in files:
-                path = os.path.join(fol, file)
-                if path.endswith(".json"):
-                    label_dict = self.__load_json(path)
-                    nii_path = path.replace(".json", ".nii.gz")
-                    if not os.path.exists(nii_path):
-                        raise NiftiNamingError
-                    try:
-                        img = sitk.ReadImage(nii_path)
-                        arr = sitk.GetArrayFromImage(img)
-                        self.json_nii_list.append((label_dict, arr))
-                    except Exception as e:
-                        raise PredictionLoadError
+    @staticmethod
+    def __read_nii(zip: zipfile.ZipFile, name: str) -> np.ndarray:
+        if not name.endswith(".nii.gz"):
+            return decode_output_member(name, zip.read(name))
+        try:
+            with zip.open(name) as member:
+                return read_nifti_gz(member)
+        except UnsupportedNiftiError:
+            # Exotic header, e.g. scaled voxel values or NIfTI-2. Let SimpleITK deal with it through a temporary file
+            with tempfile.TemporaryDirectory() as output_dir:
+                return sitk.GetArrayFromImage(sitk.ReadImage(zip.extract(name, output_dir)))
 
-    def get_output_as_label_array_dict(self) -> Dict[str, np.ndarray]:
-        # Generate label_array_dict to return. Represented like {"GTVn_AI": nd.array with dtype bool}
-        label_array_dict = {}
-        for label_dict_arr in self.json_nii_list:
-            label_dict, arr = label_dict_arr
+    def __find_label_json_and_nii_members(self,
+                                          names: List[str],
+                                          read_json: Callable[[str], Dict],
+                                          read_nii: Callable[[str], np.ndarray]) -> None:
+        for name in names:
+            if name.endswith(".json"):
+                label_dict = dict(read_json(name))
+                grid = label_dict.pop(GRID_KEY, GRID_CONTOUR)
+                if grid not in GRIDS:
+                    raise PredictionLoadError("Grid must be one of {}. Got {} in {}".format(GRIDS, grid, name))
+                fmt = label_dict.pop(FORMAT_KEY, FORMAT_NIFTI)
+                if fmt != FORMAT_NIFTI and fmt not in SPARSE_FORMATS:
+                    raise PredictionLoadError("Unknown format {} in {}".format(fmt, name))
+                shape = label_dict.pop(SHAPE_KEY, None)
 
-            # Generate the actual label_array_dict
-            for i, label in label_dict.items():
-                i = int(i)  # For conformity
-                tmp_array = np.zeros_like(arr, dtype=bool)
-                tmp_array[arr == i] = True  # Set the appropriate voxels to true for a given structure.
-                label_array_dict[label] = tmp_array  # Insert the binary array to label_array_dict
+                nii_name = name.replace(".json", ".nii.gz" if fmt == FORMAT_NIFTI else ".npz")
+                if nii_name not in names:
+                    raise NiftiNamingError
+                try:
+                    arr = read_nii(nii_name)
+                    if fmt != FORMAT_NIFTI:
+                        arr = SparseLabelVolume(fmt, shape, arr)
+                    if self.crop is not None:
+                        arr = self.crop.pad(arr) if fmt == FORMAT_NIFTI else arr.pad(self.crop)
+                    self.json_nii_list.append((label_dict, arr))
+                    self.grids.append(grid)
+                    self.formats.append(fmt)
+                except Exception as e:
+                    raise PredictionLoadError
 
-        return label_array_dict
+    def get_output_as_label_array_dict(self, scaling_factor: Sequence[int] = None) -> Mapping[str, np.ndarray]:
+        """
+        Serves predictions like {"GTVn_AI": nd.array with dtype bool}. Each mask is built when it is looked up and is
+        not kept, so only the label volumes stay in memory. Use dict(...) on the result to build all masks at once.
+        Masks of volumes on the image grid are upsampled by scaling_factor (the contour multiplier, numpy order),
+        or left on the image grid if it is None
+        """
+        scales = [scaling_factor if grid == GRID_IMAGE else None for grid in self.grids]
+        return LabelMaskMapping(self.json_nii_list, scales=scales)
@@ -0,0 +1,116 @@
+import os
+import sys
+import tracemalloc
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from task_output.label_index import LabelIndex, LabelMaskMapping
+from task_output.benchmark_label_index import make_label_volume, split_by_comparison, split_by_label_index
+
+
+class TestLabelIndex(unittest.TestCase):
+    def test_masks_match_comparison(self):
+        arr = make_label_volume(20, shape=(16, 32, 32))
+        label_dict = {str(i): "ROI_{}".format(i) for i in range(0, 25)}  # Incl. background and absent labels
+
+        expected = split_by_comparison(arr, label_dict)
+        result = split_by_label_index(arr, label_dict)
+        self.assertEqual(list(result.keys()), list(expected.keys()))
+        for label in expected:
+            self.assertEqual(result[label].dtype, bool)
+            self.assertTrue(np.array_equal(result[label], expected[label]), label)
+
+    def test_boxes_are_merged_across_slabs(self):
+        arr = make_label_volume(20, shape=(16, 32, 32))
+        with mock.patch("task_output.label_index.SLAB_VOXELS", 3 * 32 * 32):  # Slabs of 3 slices
+            label_index = LabelIndex(arr)
+
+        for value in range(1, 21):
+            expected = LabelIndex(arr).bounding_box(value)
+            self.assertEqual(label_index.bounding_box(value), expected, value)
+            self.assertTrue(np.array_equal(label_index.mask(value), arr == value), value)
+
+    def test_index_memory_is_capped(self):
+        arr = np.ones((64, 256, 256), dtype=np.uint8)  # All foreground, 4 M voxels
+
+        tracemalloc.start()
+        try:
+            LabelIndex(arr)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # Indexing the whole volume at once would take about 40 bytes per voxel
+        self.assertLess(peak, 4 * arr.size)
+
+    def test_bounding_box(self):
+        arr = np.zeros((4, 5, 6), dtype=np.uint16)
+        arr[1, 2, 3] = 300
+        arr[2, 4, 1] = 300
+        arr[0, 0, 0] = 7
+
+        label_index = LabelIndex(arr)
+        self.assertEqual(label_index.labels().tolist(), [7, 300])
+        self.assertEqual(label_index.bounding_box(300), (slice(1, 3), slice(2, 5), slice(1, 4)))
+        self.assertEqual(label_index.bounding_box(7), (slice(0, 1), slice(0, 1), slice(0, 1)))
+        self.assertIsNone(label_index.bounding_box(8))
+
+    def test_scaled_masks_match_upsampled_comparison(self):
+        arr = make_label_volume(5, shape=(8, 16, 16))
+        label_index = LabelIndex(arr)
+        for value in [0, 1, 3, 5, 6]:  # Background, present and absent labels
+            expected = arr == value
+            for axis, f in enumerate([1, 2, 2]):
+                expected = np.repeat(expected, f, axis=axis)
+            self.assertTrue(np.array_equal(label_index.mask(value, scale=[1, 2, 2]), expected), value)
+
+    def test_empty_volume(self):
+        arr = np.zeros((2, 3, 4), dtype=np.uint8)
+        label_index = LabelIndex(arr)
+        self.assertEqual(len(label_index.labels()), 0)
+        self.assertFalse(label_index.mask(1).any())
+        self.assertTrue(label_index.mask(0).all())
+
+    def test_mapping_matches_dict(self):
+        arrs = [make_label_volume(5, shape=(8, 16, 16)), make_label_volume(3, shape=(8, 16, 16))]
+        json_nii_list = [({"1": "GTVt", "2": "GTVn", "5": "Brain"}, arrs[0]),
+                         ({"3": "Brain", "1": "Lung"}, arrs[1])]
+
+        expected = {}
+        for label_dict, arr in json_nii_list:
+            expected.update(split_by_comparison(arr, label_dict))
+
+        mapping = LabelMaskMapping(json_nii_list)
+        self.assertEqual(list(mapping), list(expected))
+        self.assertEqual(len(mapping), 4)
+        self.assertNotIn("Heart", mapping)
+        self.assertRaises(KeyError, mapping.__getitem__, "Heart")
+        for label, mask in mapping.items():
+            self.assertTrue(np.array_equal(mask, expected[label]), label)
+        self.assertTrue(np.array_equal(mapping["Brain"], arrs[1] == 3))  # Last volume wins
+
+    def test_mapping_does_not_keep_masks(self):
+        n_labels = 100
+        arr = make_label_volume(n_labels, shape=(16, 64, 64))
+        mapping = LabelMaskMapping([({str(i): str(i) for i in range(1, n_labels + 1)}, arr)])
+        self.assertIsNot(mapping["1"], mapping["1"])
+
+        tracemalloc.start()
+        try:
+            for label, mask in mapping.items():
+                self.assertEqual(mask.shape, arr.shape)
+                del mask
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # All masks at once would take n_labels * arr.size bytes
+        self.assertLess(peak, n_labels * arr.size / 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import io
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from cropping.cropping import CropBox
+from nifti_codec.nifti_codec import encode_nifti_gz
+from task_output.sparse_labels import FORMAT_BITPACKED, FORMAT_RLE, SPARSE_FORMATS, SparseLabelVolume, \
+    decode_npz, encode_sparse_labels
+
+
+def make_lesions(shape=(32, 64, 64)):
+    arr = np.zeros(shape, dtype=np.uint8)
+    arr[10:14, 20:30, 15:22] = 1
+    arr[11, 22:25, 40:41] = 2
+    arr[0, 0, 0] = 3
+    arr[-1, -1, -1] = 3  # Label spanning the whole volume
+    return arr
+
+
+class TestSparseLabels(unittest.TestCase):
+    def test_round_trip(self):
+        arr = make_lesions()
+        for fmt in SPARSE_FORMATS:
+            volume = SparseLabelVolume(fmt, arr.shape, encode_sparse_labels(arr, fmt))
+            for value in [1, 2, 3, 4]:
+                mask = volume.mask(value)
+                self.assertEqual(mask.dtype, bool)
+                self.assertTrue(np.array_equal(mask, arr == value), (fmt, value))
+            self.assertRaises(ValueError, volume.mask, 0)
+
+    def test_scaled_and_padded(self):
+        crop = CropBox(offset=[2, 10, 20], size=[32, 64, 64], full_shape=[40, 80, 90])
+        arr = make_lesions()
+        expected = np.zeros(crop.full_shape, dtype=np.uint8)
+        expected[crop.slices()] = arr
+        expected = np.repeat(np.repeat(expected, 2, axis=1), 2, axis=2)
+
+        for fmt in SPARSE_FORMATS:
+            volume = SparseLabelVolume(fmt, arr.shape, encode_sparse_labels(arr, fmt)).pad(crop)
+            for value in [1, 2, 3]:
+                self.assertTrue(np.array_equal(volume.mask(value, scale=[1, 2, 2]), expected == value), (fmt, value))
+
+    def test_npz_is_smaller_than_nifti(self):
+        arr = np.zeros((64, 256, 256), dtype=np.uint8)
+        arr[30:36, 100:120, 110:125] = 1
+        nifti_size = len(encode_nifti_gz(arr, spacing=[1, 1, 1], origin=[0, 0, 0]))
+
+        for fmt in [FORMAT_RLE, FORMAT_BITPACKED]:
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, **encode_sparse_labels(arr, fmt))
+            self.assertLess(len(buffer.getvalue()) * 10, nifti_size, fmt)
+
+            volume = SparseLabelVolume(fmt, arr.shape, decode_npz(buffer.getvalue()))
+            self.assertTrue(np.array_equal(volume.mask(1), arr == 1))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, SparseLabelVolume, "png", (1, 1, 1), {})
+        self.assertRaises(ValueError, encode_sparse_labels, np.ones((1, 1, 1)), "png")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import io
+import os
+import sys
+import unittest
+import zipfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from task_output.streaming_zip import StreamingZipReader
+
+
+class Unseekable:
+    """
+    Write-only stream, which makes zipfile write data descriptors after each member
+    """
+    def __init__(self) -> None:
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+
+class TestStreamingZip(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.RandomState(0)
+        self.members = {
+            "pred.json": b'{"1": "GTVt"}',
+            "pred.nii.gz": rng.randint(0, 3, 200000).astype(np.uint8).tobytes(),
+            "empty.txt": b"",
+            "sub/dir/æøå.bin": rng.bytes(5000),
+        }
+
+    def make_zip(self, compression: int, seekable: bool = True, force_zip64: bool = False) -> bytes:
+        fileobj = io.BytesIO() if seekable else Unseekable()
+        with zipfile.ZipFile(fileobj, "w", compression) as zip:
+            for name, data in self.members.items():
+                with zip.open(name, "w", force_zip64=force_zip64) as w:
+                    w.write(data)
+        return (fileobj if seekable else fileobj.buffer).getvalue()
+
+    def read(self, data: bytes, chunk_size: int):
+        reader = StreamingZipReader()
+        members = {}
+        for i in range(0, len(data), chunk_size):
+            for name, content in reader.feed(data[i:i + chunk_size]):
+                members[name] = content
+        reader.close()
+        return reader, members
+
+    def test_members_in_chunks(self):
+        for compression in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]:
+            data = self.make_zip(compression)
+            for chunk_size in [1, 7, 4096, len(data)]:
+                reader, members = self.read(data, chunk_size)
+                self.assertTrue(reader.streamable)
+                self.assertTrue(reader.finished)
+                self.assertEqual(members, self.members)
+
+    def test_member_completed_before_end(self):
+        data = self.make_zip(zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(io.BytesIO(data)) as zip:
+            second = zip.getinfo("pred.nii.gz").header_offset
+
+        reader = StreamingZipReader()
+        self.assertEqual(reader.feed(data[:second + 4]), [("pred.json", self.members["pred.json"])])
+
+    def test_data_descriptors(self):
+        reader, members = self.read(self.make_zip(zipfile.ZIP_DEFLATED, seekable=False), 1000)
+        self.assertTrue(reader.streamable)
+        self.assertEqual(members, self.members)
+
+        # STORED members with a data descriptor have no known end
+        reader, members = self.read(self.make_zip(zipfile.ZIP_STORED, seekable=False), 1000)
+        self.assertFalse(reader.streamable)
+
+    def test_zip64(self):
+        for compression in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]:
+            reader, members = self.read(self.make_zip(compression, force_zip64=True), 999)
+            self.assertEqual(members, self.members)
+
+    def test_truncated(self):
+        data = self.make_zip(zipfile.ZIP_DEFLATED)
+        reader = StreamingZipReader()
+        reader.feed(data[:len(data) // 2])
+        self.assertRaises(zipfile.BadZipFile, reader.close)
+
+    def test_ended_before_central_directory(self):
+        # An empty body and one cut exactly between members are not archives either, like for zipfile
+        self.assertRaises(zipfile.BadZipFile, StreamingZipReader().close)
+
+        data = self.make_zip(zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(io.BytesIO(data)) as zip:
+            second = zip.getinfo("pred.nii.gz").header_offset
+        reader = StreamingZipReader()
+        self.assertEqual(len(reader.feed(data[:second])), 1)
+        self.assertRaises(zipfile.BadZipFile, reader.close)
+
+    def test_bad_crc(self):
+        data = bytearray(self.make_zip(zipfile.ZIP_STORED))
+        data[30 + len("pred.json")] ^= 0xFF  # First byte of the first member
+        self.assertRaises(zipfile.BadZipFile, StreamingZipReader().feed, bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
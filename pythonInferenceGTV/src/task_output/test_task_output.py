@@ -1,6 +1,9 @@
+import gzip
+import io
 import json
 import os
 import sys
+import struct
 import tempfile
 import unittest
 import zipfile
@@ -12,7 +15,10 @@ from task_output.exceptions import NiftiNamingError, PredictionLoadError
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from task_output.task_output import TaskOutput
+from cropping.cropping import CropBox
+from nifti_codec.nifti_codec import encode_nifti_gz
+from task_output.sparse_labels import SPARSE_FORMATS, encode_sparse_labels
+from task_output.task_output import TaskOutput, decode_output_member
 from testing.mock_classes import XMimContour
 
 
@@ -99,5 +105,111 @@ class TestTaskOutput(unittest.TestCase):
 
             self.assertRaises(PredictionLoadError, TaskOutput, output_zip_bytes=output_zip.read())
 
+    def test_task_output_pads_cropped_predictions(self):
+        crop = CropBox(offset=[2, 10, 20], size=[4, 30, 40], full_shape=[64, 128, 128])
+        pred = np.zeros((4, 60, 80), dtype=np.uint8)  # Contour grid, i.e. multiplier [1, 2, 2]
+        pred[1:3, 5:50, 10:70] = 1
+
+        with tempfile.TemporaryFile(suffix=".zip") as output_zip:
+            with tempfile.TemporaryDirectory() as output_dir:
+                with open(os.path.join(output_dir, "predictions.json"), "w") as f:
+                    f.write(json.dumps({"1": "GTVt"}))
+                sitk.WriteImage(sitk.GetImageFromArray(pred), os.path.join(output_dir, "predictions.nii.gz"))
+
+                with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zip:
+                    for file in os.listdir(output_dir):
+                        zip.write(os.path.join(output_dir, file), arcname=file)
+            output_zip.seek(0)
+
+            label_array_dict = TaskOutput(output_zip_bytes=output_zip.read(), crop=crop).get_output_as_label_array_dict()
+
+        gtvt = label_array_dict["GTVt"]
+        self.assertEqual(gtvt.shape, (64, 256, 256))
+        self.assertEqual(np.count_nonzero(gtvt), np.count_nonzero(pred))
+        self.assertTrue(np.array_equal(gtvt[2:6, 20:80, 40:120], pred == 1))
+
+    def test_task_output_upsamples_image_grid_predictions(self):
+        crop = CropBox(offset=[2, 10, 20], size=[4, 30, 40], full_shape=[64, 128, 128])
+        pred = np.zeros((4, 30, 40), dtype=np.uint8)  # Image grid of the cropped box
+        pred[1:3, 5:25, 10:30] = 1
+        pred[0, 0:3, 0:3] = 2
+
+        with tempfile.TemporaryFile(suffix=".zip") as output_zip:
+            with zipfile.ZipFile(output_zip, "w") as zip:
+                zip.writestr("predictions.json", json.dumps({"1": "GTVt", "2": "GTVn", "grid": "image"}))
+                zip.writestr("predictions.nii.gz", encode_nifti_gz(pred, spacing=[1, 1, 1], origin=[0, 0, 0]))
+            output_zip.seek(0)
+
+            task_output = TaskOutput(output_zip_bytes=output_zip.read(), crop=crop)
+
+        self.assertEqual(task_output.grids, ["image"])
+        self.assertEqual(set(task_output.get_output_as_label_array_dict()), {"GTVt", "GTVn"})
+        self.assertEqual(task_output.get_output_as_label_array_dict()["GTVt"].shape, (64, 128, 128))
+
+        label_array_dict = task_output.get_output_as_label_array_dict(scaling_factor=[1, 2, 2])
+        for value, label in [(1, "GTVt"), (2, "GTVn")]:
+            expected = np.zeros((64, 128, 128), dtype=bool)
+            expected[2:6, 10:40, 20:60] = pred == value
+            expected = np.repeat(np.repeat(expected, 2, axis=1), 2, axis=2)
+            self.assertTrue(np.array_equal(label_array_dict[label], expected), label)
+
+    def test_task_output_sparse_formats(self):
+        crop = CropBox(offset=[2, 10, 20], size=[4, 30, 40], full_shape=[64, 128, 128])
+        pred = np.zeros((4, 60, 80), dtype=np.uint8)  # Contour grid of the cropped box
+        pred[1:3, 5:50, 10:70] = 1
+        pred[3, 0:2, 0:2] = 2
+        expected = np.zeros((64, 256, 256), dtype=np.uint8)
+        expected[2:6, 20:80, 40:120] = pred
+
+        for fmt in SPARSE_FORMATS:
+            label_json = json.dumps({"1": "GTVt", "2": "GTVn", "format": fmt, "shape": list(pred.shape)})
+            npz = io.BytesIO()
+            np.savez_compressed(npz, **encode_sparse_labels(pred, fmt))
+
+            with tempfile.TemporaryFile(suffix=".zip") as output_zip:
+                with zipfile.ZipFile(output_zip, "w") as zip:
+                    zip.writestr("predictions.json", label_json)
+                    zip.writestr("predictions.npz", npz.getvalue())
+                output_zip.seek(0)
+                from_zip = TaskOutput(output_zip_bytes=output_zip.read(), crop=crop)
+
+            members = {"predictions.json": decode_output_member("predictions.json", label_json.encode()),
+                       "predictions.npz": decode_output_member("predictions.npz", npz.getvalue())}
+            from_members = TaskOutput(members=members, crop=crop)
+
+            for task_output in [from_zip, from_members]:
+                self.assertEqual(task_output.formats, [fmt])
+                label_array_dict = task_output.get_output_as_label_array_dict()
+                self.assertEqual(set(label_array_dict), {"GTVt", "GTVn"})
+                for value, label in [(1, "GTVt"), (2, "GTVn")]:
+                    self.assertTrue(np.array_equal(label_array_dict[label], expected == value), (fmt, label))
+
+    def test_task_output_unknown_grid(self):
+        with tempfile.TemporaryFile(suffix=".zip") as output_zip:
+            with zipfile.ZipFile(output_zip, "w") as zip:
+                zip.writestr("predictions.json", json.dumps({"1": "GTVt", "grid": "dose"}))
+                zip.writestr("predictions.nii.gz", encode_nifti_gz(np.zeros((2, 2, 2), dtype=np.uint8),
+                                                                   spacing=[1, 1, 1], origin=[0, 0, 0]))
+            output_zip.seek(0)
+
+            self.assertRaises(PredictionLoadError, TaskOutput, output_zip_bytes=output_zip.read())
+
+    def test_task_output_exotic_nifti_falls_back_to_sitk(self):
+        pred = np.zeros((4, 8, 8), dtype=np.uint8)
+        pred[1:3, 2:6, 2:6] = 1
+        raw = bytearray(gzip.decompress(encode_nifti_gz(pred, spacing=[1, 1, 1], origin=[0, 0, 0])))
+        raw[116:120] = struct.pack("<f", 1.0)  # scl_inter. Voxel values must be shifted by one when read
+
+        with tempfile.TemporaryFile(suffix=".zip") as output_zip:
+            with zipfile.ZipFile(output_zip, "w") as zip:
+                zip.writestr("predictions.json", json.dumps({"1": "Background", "2": "GTVt"}))
+                zip.writestr("predictions.nii.gz", gzip.compress(bytes(raw)))
+            output_zip.seek(0)
+
+            label_array_dict = TaskOutput(output_zip_bytes=output_zip.read()).get_output_as_label_array_dict()
+
+        self.assertTrue(np.array_equal(label_array_dict["GTVt"], pred == 1))
+        self.assertTrue(np.array_equal(label_array_dict["Background"], pred == 0))
+
 if __name__ == '__main__':
     unittest.main()
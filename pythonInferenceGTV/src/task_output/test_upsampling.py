@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from task_output.upsampling import upsample_nearest
+
+
+def repeat_all_axes(arr, factor):
+    for axis, f in enumerate(factor):
+        arr = np.repeat(arr, f, axis=axis)
+    return arr
+
+
+class TestUpsampling(unittest.TestCase):
+    def test_matches_repeat(self):
+        arr = np.random.RandomState(0).randint(0, 5, (3, 4, 5)).astype(np.uint8)
+        for factor in [[1, 1, 1], [1, 2, 2], [2, 3, 1]]:
+            result = upsample_nearest(arr, factor)
+            self.assertEqual(result.dtype, arr.dtype)
+            self.assertTrue(np.array_equal(result, repeat_all_axes(arr, factor)), factor)
+
+    def test_out_may_be_a_slice(self):
+        arr = np.random.RandomState(1).rand(2, 3, 4) > 0.5
+        full = np.zeros((6, 10, 12), dtype=bool)
+        upsample_nearest(arr, [1, 2, 2], out=full[1:3, 2:8, 4:12])
+
+        expected = np.zeros_like(full)
+        expected[1:3, 2:8, 4:12] = repeat_all_axes(arr, [1, 2, 2])
+        self.assertTrue(np.array_equal(full, expected))
+
+    def test_wrong_factor_or_out(self):
+        arr = np.zeros((2, 3, 4), dtype=bool)
+        self.assertRaises(ValueError, upsample_nearest, arr, [1, 2])
+        self.assertRaises(ValueError, upsample_nearest, arr, [0, 1, 1])
+        self.assertRaises(ValueError, upsample_nearest, arr, [1, 2, 2], out=np.zeros((2, 3, 4), dtype=bool))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+from typing import Sequence
+
+import numpy as np
+
+"""
+Nearest-neighbour upsampling by integer factors, used to bring predictions made on the image grid onto the finer grid
+of MIM contours (the contour multiplier, exported as "scaling_factor" in the meta json).
+"""
+
+
+def upsampled_shape(shape: Sequence[int], factor: Sequence[int]):
+    if len(shape) != len(factor) or any(int(f) < 1 for f in factor):
+        raise ValueError("Can not upsample shape {} by {}".format(tuple(shape), tuple(factor)))
+    return tuple(int(s) * int(f) for s, f in zip(shape, factor))
+
+
+def upsample_nearest(arr: np.ndarray, factor: Sequence[int], out: np.ndarray = None) -> np.ndarray:
+    """
+    Repeats every voxel of arr factor[axis] times along each axis, like np.repeat over all axes, in a single pass.
+    out, if given, must have the upsampled shape. It may be a slice of a larger array, e.g. a bounding box
+    """
+    shape = upsampled_shape(arr.shape, factor)
+    if out is None:
+        out = np.empty(shape, dtype=arr.dtype)
+    elif tuple(out.shape) != shape:
+        raise ValueError("out has shape {}, expected {}".format(tuple(out.shape), shape))
+
+    # View out as (z, fz, y, fy, x, fx) blocks and broadcast arr as (z, 1, y, 1, x, 1) into them.
+    # Splitting axes never needs a copy, so the blocks are a view and the assignment lands in out
+    blocks = out.reshape([d for s, f in zip(arr.shape, factor) for d in (s, int(f))])
+    blocks[...] = arr.reshape([d for s in arr.shape for d in (s, 1)])
+    return out
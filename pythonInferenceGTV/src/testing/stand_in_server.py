@@ -0,0 +1,313 @@
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+"""
+A local stand-in for the inference server. Only used for testing the http behaviour of the client against a real
+socket, e.g. downloads which are cut off mid-transfer.
+"""
+
+
+class StandInInferenceServer:
+    """
+    Serves GET /api/tasks/{uid} for the output zips added with add_task and HEAD of any path. Use as context manager to
+    run it on a free port.
+    Completion of a task can also be awaited with
+    - GET /api/tasks/{uid}/wait?timeout=<sec>: long-poll. Answers {"status": "done"} (200) as soon as the output is added,
+      {"status": "failed"} (200) after fail_task or 204 when timeout passes first
+    - GET /api/tasks/{uid}/events: server-sent "status" events {"status": "pending" | "done" | "failed"}. The stream ends
+      once the task is done or failed
+    Setting long_poll or sse to False answers 404 instead, like a server without the endpoint
+    POST /api/tasks/ keeps the raw body in posted under a new UID. The chunked upload protocol of chunked_upload.py is
+    served on /api/uploads/, unless chunked_uploads is False
+    """
+    def __init__(self) -> None:
+        self.tasks: Dict[str, bytes] = {}  # uid -> output zip
+        self.failed: Set[str] = set()  # uids of tasks which failed
+        self.completed_at: Dict[str, float] = {}  # uid -> time.monotonic() when its output was added or it failed
+        self.long_poll = True
+        self.sse = True
+        self.keep_alive_sec = 0.5  # Interval of comments sent on an idle event stream
+        self.events_error: Optional[int] = None  # Answer the event stream with this status code instead, e.g. 503
+        self.pending: Dict[str, Dict[str, str]] = {}  # uid -> headers sent with the 404 while its output is not added
+        self.requests: List[Tuple[str, str, Dict[str, str]]] = []  # (method, path, headers) of every request
+        self.cut_after_bytes: Optional[int] = None  # Close the connection after this many bytes of a body ...
+        self.cuts_left = 0  # ... for this many responses
+        self.honor_range = True  # If False, Range headers are ignored and the full body is sent
+        self.gzip_bodies = False  # Send output zips with Content-Encoding: gzip. Ranges are of the encoded body
+        self.send_digest = True  # Announce the sha256 of the body in a Digest header
+        self.digest_override: Optional[bytes] = None  # Announce this sha256 instead of the real one
+        self.stall_sec = 0.0  # Wait this long before answering
+        self.posted: Dict[str, Tuple[str, bytes]] = {}  # uid -> (model_human_readable_id, body of the post or upload)
+        self.chunked_uploads = True
+        self.uploads: Dict[str, Dict] = {}  # upload_id -> {"model", "size", "sha256", "data"}
+        self.drop_chunks_left = 0  # Keep only the first half of this many chunks and drop the connection unanswered
+        self.corrupt_chunks_left = 0  # Flip a byte of this many chunks, so their checksum fails
+        self.client_ports: List[int] = []  # Client port of every request. Requests on one connection share it
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # Notified when a task completes or the server stops
+        self.stopping = False
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.__make_handler(), bind_and_activate=False)
+        self.httpd.request_queue_size = 128  # The default of 5 drops connections of concurrent clients
+        self.httpd.server_bind()
+        self.httpd.server_activate()
+        self.httpd.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def base_url(self) -> str:
+        return "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+
+    def add_task(self, uid: str, output_zip: bytes) -> None:
+        with self.lock:
+            self.tasks[uid] = output_zip
+            self.completed_at[uid] = time.monotonic()
+            self.changed.notify_all()
+
+    def new_task(self, model_human_readable_id: str, body: bytes) -> str:
+        with self.lock:
+            uid = "uid_{}".format(len(self.posted))
+            self.posted[uid] = (model_human_readable_id, body)
+            return uid
+
+    def fail_task(self, uid: str) -> None:
+        with self.lock:
+            self.failed.add(uid)
+            self.completed_at[uid] = time.monotonic()
+            self.changed.notify_all()
+
+    def status(self, uid: str) -> str:
+        # Must be called with lock held
+        if uid in self.tasks:
+            return "done"
+        return "failed" if uid in self.failed else "pending"
+
+    def requests_to(self, path: str, method: str = "GET") -> List[Dict[str, str]]:
+        with self.lock:
+            return [headers for m, p, headers in self.requests if m == method and p == path]
+
+    def start(self) -> "StandInInferenceServer":
+        self.__thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopping = True
+            self.changed.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StandInInferenceServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
+
+    def __make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # Headers and body are written separately. Do not hold the body back
+
+            def log_message(self, format, *args):
+                pass
+
+            def __record(self, method: str):
+                with server.lock:
+                    server.requests.append((method, self.path, dict(self.headers)))
+                    server.client_ports.append(self.client_address[1])
+                if server.stall_sec:
+                    time.sleep(server.stall_sec)
+
+            def do_HEAD(self):
+                self.__record("HEAD")
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                self.__record("GET")
+                url = urlsplit(self.path)
+                match = re.fullmatch(r"/api/tasks/([^/]+)/(wait|events)", url.path)
+                if match and match.group(2) == "wait" and server.long_poll:
+                    timeout = float(parse_qs(url.query).get("timeout", ["30"])[0])
+                    self.__long_poll(match.group(1), timeout)
+                    return
+                if match and match.group(2) == "events" and server.sse:
+                    if server.events_error is not None:
+                        self.__send(server.events_error, b"Event stream error")
+                    else:
+                        self.__events(match.group(1))
+                    return
+                match = re.fullmatch(r"/api/uploads/([^/]+)", url.path)
+                if match:
+                    upload = server.uploads.get(match.group(1)) if server.chunked_uploads else None
+                    if upload is None:
+                        self.__send(404, b"Upload not found")
+                    else:
+                        self.__send_json(200, {"offset": len(upload["data"])})
+                    return
+                match = re.fullmatch(r"/api/tasks/([^/]+)", self.path)
+                body = server.tasks.get(match.group(1)) if match else None
+                if body is None:
+                    headers = server.pending.get(match.group(1)) if match else None
+                    self.__send(404, b"Task not found", headers)
+                    return
+                self.__send_body(body)
+
+            def do_POST(self):
+                self.__record("POST")
+                url = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if url.path == "/api/tasks/":
+                    self.__send_json(200, server.new_task(query.get("model_human_readable_id"), body))
+                    return
+
+                match = re.fullmatch(r"/api/uploads/(?:([^/]+?)(/finalize)?)?", url.path)
+                if not match or not server.chunked_uploads:
+                    self.__send(404, b"Not found")
+                    return
+                upload_id, finalize = match.groups()
+                if upload_id is None:
+                    with server.lock:
+                        upload_id = "upload_{}".format(len(server.uploads))
+                        server.uploads[upload_id] = {"model": query.get("model_human_readable_id"),
+                                                     "size": int(query["size"]),
+                                                     "sha256": query["sha256"],
+                                                     "data": bytearray()}
+                    self.__send_json(201, {"upload_id": upload_id})
+                    return
+
+                upload = server.uploads.get(upload_id)
+                if upload is None:
+                    self.__send(404, b"Upload not found")
+                elif finalize:
+                    data = bytes(upload["data"])
+                    if len(data) != upload["size"] or hashlib.sha256(data).hexdigest() != upload["sha256"]:
+                        self.__send(422, b"Size or sha256 of the upload does not match")
+                    else:
+                        self.__send_json(200, server.new_task(upload["model"], data))
+                else:
+                    self.__chunk(upload, int(query["offset"]), body)
+
+            def __chunk(self, upload: Dict, offset: int, chunk: bytes):
+                with server.lock:
+                    drop = server.drop_chunks_left > 0
+                    corrupt = server.corrupt_chunks_left > 0 and not drop
+                    server.drop_chunks_left -= drop
+                    server.corrupt_chunks_left -= corrupt
+                if corrupt:
+                    chunk = bytes([chunk[0] ^ 0xFF]) + chunk[1:]
+
+                received = len(upload["data"])
+                if offset != received:
+                    self.__send_json(409, {"offset": received})
+                elif hashlib.sha256(chunk).hexdigest() != self.headers.get("X-Chunk-Sha256") and not drop:
+                    self.__send_json(422, {"offset": received})
+                elif drop:  # Like a connection lost mid-chunk. What arrived is kept
+                    upload["data"] += chunk[:len(chunk) // 2]
+                    self.close_connection = True
+                else:
+                    upload["data"] += chunk
+                    self.__send_json(200, {"offset": len(upload["data"])})
+
+            def __send_json(self, status: int, obj):
+                self.__send(status, json.dumps(obj).encode(), {"Content-Type": "application/json"})
+
+            def __long_poll(self, uid: str, timeout: float):
+                deadline = time.monotonic() + timeout
+                with server.lock:
+                    while server.status(uid) == "pending" and not server.stopping:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        server.changed.wait(remaining)
+                    status = server.status(uid)
+                if status == "pending":
+                    self.__send(204, b"")
+                else:
+                    self.__send(200, json.dumps({"status": status}).encode(), {"Content-Type": "application/json"})
+
+            def __events(self, uid: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")  # The stream has no length. Its end is the end of the body
+                self.end_headers()
+                self.close_connection = True
+
+                with server.lock:
+                    status = server.status(uid)
+                self.__event(status)
+                while status == "pending":
+                    with server.lock:
+                        server.changed.wait(server.keep_alive_sec)
+                        status = server.status(uid)
+                        if server.stopping:
+                            return
+                    if status == "pending":
+                        self.wfile.write(b": keep-alive\n\n")
+                        self.wfile.flush()
+                    else:
+                        self.__event(status)
+
+            def __event(self, status: str):
+                self.wfile.write("event: status\ndata: {}\n\n".format(json.dumps({"status": status})).encode())
+                self.wfile.flush()
+
+            def __send(self, status: int, body: bytes, headers: Dict[str, str] = None):
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def __send_body(self, body: bytes):
+                headers = {"Accept-Ranges": "bytes", "Content-Type": "application/zip"}
+                if server.send_digest:
+                    digest = server.digest_override or hashlib.sha256(body).digest()
+                    headers["Digest"] = "sha-256=" + base64.b64encode(digest).decode()
+                if server.gzip_bodies:
+                    headers["Content-Encoding"] = "gzip"
+                    compressor = zlib.compressobj(wbits=31)  # gzip format without a timestamp, so every body is alike
+                    body = compressor.compress(body) + compressor.flush()
+
+                status, start = 200, 0
+                match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                if match and server.honor_range:
+                    status, start = 206, int(match.group(1))
+                    headers["Content-Range"] = "bytes {}-{}/{}".format(start, len(body) - 1, len(body))
+                part = body[start:]
+
+                with server.lock:
+                    cut = server.cut_after_bytes if server.cuts_left > 0 else None
+                    if cut is not None:
+                        server.cuts_left -= 1
+
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(part)))
+                self.end_headers()
+                if cut is None:
+                    self.wfile.write(part)
+                    return
+
+                # Drop the connection mid-transfer
+                self.wfile.write(part[:cut])
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler